@@ -0,0 +1,89 @@
+""" Benchmark editing a filter chain without re-importing.
+
+    Compares the old way of changing a filter (re-import the full
+    export, then re-apply every filter) with the filter steps kept
+    by SubDB: undo/redo, editing a step in the middle of the chain
+    (with and without cached filter results), and removing/
+    re-applying all filters.
+
+    Usage (from the repository folder):
+        python -m benchmarks.filter_chain "path/to/General Search.csv"
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import contextlib
+import io
+import sys
+import time
+
+# Import custom modules
+from models import dbmodel
+
+
+#########
+# BEGIN #
+#########
+# Initial scrub plus two typical study filters
+CHAIN = [
+    ("Status", "equals", "Active"),
+    ("Good Candidate", "does not equal", "Poor"),
+    ("Employment Status", "does not equal", "Employee"),
+    ("Age", ">=", 60.0),
+    ("Miles From Starkey", "<=", 60.0),
+]
+
+# The same chain with the Age step changed
+EDITED = CHAIN[:3] + [("Age", ">=", 50.0)] + CHAIN[4:]
+
+
+def _time(label, func, repeats=5):
+    """ Print the best time of several runs of func (with 
+        SubDB messages hidden).
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+    print(f"{label:<40}{best * 1000:>10.1f} ms")
+
+
+def main(db_path):
+    db = dbmodel.SubDB(db_path)
+    print(f"\n{db.count()} records\n")
+
+    # Old way: every change meant re-importing the export
+    def reimport():
+        db.load_db(db_path)
+        for colname, operator, value in EDITED:
+            db.filter(colname, operator, value)
+    _time("Re-import and re-apply chain", reimport, repeats=1)
+
+    _time("Apply chain from base (no cache)",
+        lambda: (db.filter_cache.clear(), db.set_filters(CHAIN)))
+    _time("Edit step 4 of 5 (no cache)",
+        lambda: (db.filter_cache.clear(), db.set_filters(CHAIN),
+            db.set_filters(EDITED)))
+    _time("Edit step 4 of 5, then change back",
+        lambda: (db.set_filters(EDITED), db.set_filters(CHAIN)))
+    _time("Remove and re-apply all filters",
+        lambda: (db.reset_filters(), db.set_filters(CHAIN)))
+    _time("Undo and redo last step",
+        lambda: (db.undo_filter(), db.redo_filter()))
+    _time("Undo, redo and build filtered data",
+        lambda: (db.undo_filter(), db.redo_filter(), db.data.shape))
+    print(f"\n{db.count()} records after filtering")
+    print(f"Filter cache: {db.filter_cache.stats()}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1])
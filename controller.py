@@ -15,9 +15,14 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
+from tkinter import simpledialog
 
 # Import system packages
 import os
+import queue
+import sqlite3
+from functools import partial
+from datetime import datetime
 
 # Import misc packages
 import webbrowser
@@ -33,11 +38,16 @@ from models import sessionmodel
 from models import versionmodel
 from models import csvmodel
 from models import dbmodel
+from models import dbcache
+from models import loadermodel
+from models import previewmodel
+from models import exprmodel
 from models.constants import FieldTypes as FT
 # View imports
 from views import sessionview
 from views import filterview
 from views import browserview
+from views import progressview
 
 
 #########
@@ -123,6 +133,15 @@ class Application(tk.Tk):
         # Load CSV writer model
         self.csvmodel = csvmodel.CSVModel(self.sessionpars)
 
+        # Background database loader (None when idle)
+        self.loader = None
+        self.progress_dialog = None
+
+        # Background candidate count preview (None when idle) and 
+        # the rows it left, for reuse by the next preview
+        self.preview = None
+        self._preview_memo = None
+
         # Load menus
         self.menu = mainmenu.MainMenu(self, self._app_info)
         self.config(menu=self.menu)
@@ -131,17 +150,27 @@ class Application(tk.Tk):
         event_callbacks = {
             # File menu
             '<<FileImportFullDB>>': lambda _: self._import_full(),
+            '<<FileImportUpdate>>': lambda _: self._import_update(),
             '<<FileImportFilteredDB>>': lambda _: self._import_filtered(),
+            '<<FileBuildSQL>>': lambda _: self._build_sql(),
+            '<<FileOpenSQL>>': lambda _: self._open_sql(),
             '<<FileExportDB>>': lambda _: self.db.write(), #self._export_db(),
             '<<FileImportFilterVals>>': lambda _: self._import_csv_filter_vals(),
             '<<FileExportFilterVals>>': lambda _: self._export_filter_vals(),
+            '<<FileBatchFilters>>': lambda _: self._batch_filters(),
             '<<FileQuit>>': lambda _: self._quit(),
 
             # Tools menu
             '<<ToolsReset>>': lambda _: self.filter_view.clear_filters(),
+            '<<ToolsUndoFilter>>': lambda _: self._undo_filter(),
+            '<<ToolsRedoFilter>>': lambda _: self._redo_filter(),
+            '<<ToolsRemoveFilters>>': lambda _: self._remove_filters(),
             '<<ToolsPlotGroupAudio>>': lambda _: self.db.plot_group_audio(),
             '<<ToolsPlotEarSpecificGroupAudio>>': lambda _: self.db.plot_ear_specific_group_audio(),
             '<<ToolsSummaryStats>>': lambda _: self.summary_stats(),
+            '<<ToolsClearCache>>': lambda _: self.dbcache.clear(),
+            '<<ToolsAgeRefDate>>': lambda _: self._set_age_ref_date(),
+            '<<ToolsCompareFittingRules>>': lambda _: self._compare_fitting_rules(),
 
             # Help menu
             '<<Help>>': lambda _: self._show_help(),
@@ -152,9 +181,14 @@ class Application(tk.Tk):
             # Filter view
             '<<FilterviewFilter>>': lambda _: self._get_filterview_vals(),
             '<<FilterviewScrubToggled>>': lambda _: self._save_sessionpars(),
+            '<<FilterviewPreview>>': lambda _: self._preview_counts(),
 
             # Browser view
             '<<BrowserviewItemSelected>>': lambda _: self._tree_item_selected(),
+            '<<BrowserviewFindSimilar>>': lambda _: self._find_similar(),
+
+            # Progress dialog
+            '<<ProgressCancel>>': lambda _: self._cancel_load(),
         }
 
         # Bind callbacks to sequences
@@ -220,15 +254,19 @@ class Application(tk.Tk):
     def _create_sample_db(self):
         """ Load in default database and create dbmodel.
         """
+        # Create cleaned database cache
+        self.dbcache = dbcache.DBCache(self._app_info)
+
         # If running from compiled, look in compiled temp location
         print('controller: Looking for compiled default database...')
         db_path = general.resource_path('sample_data.csv')
         file_exists = os.access(db_path, os.F_OK)
         if not file_exists:
             print("controller: Not found! Checking local folder...")
-            self.db = dbmodel.SubDB(".\\assets\\sample_data.csv")
+            self.db = dbmodel.SubDB(".\\assets\\sample_data.csv", 
+                cache=self.dbcache)
         else:
-            self.db = dbmodel.SubDB(db_path)
+            self.db = dbmodel.SubDB(db_path, cache=self.dbcache)
 
         # Load in dict fields for displaying records
         self.dbmodel = dbmodel.DataModel()
@@ -257,9 +295,13 @@ class Application(tk.Tk):
         if not filename:
             return
 
-        # If a valid filename is found, load it
-        self.db.load_db(filename)
+        # If a valid filename is found, load it in the background
+        self._start_load(self.db.read_db, filename, self._on_full_loaded)
+
 
+    def _on_full_loaded(self, payload):
+        """ Display full database after it has been swapped in.
+        """
         # Get 'initial scrub' checkbox state
         if self.sessionpars['initial_scrub'].get() == 1:
             self._initial_scrub()
@@ -268,10 +310,61 @@ class Application(tk.Tk):
             self.filter_view.clear_output()
             # Show total record count
             self.filter_view.txt_output.insert(tk.END,
-                f"Candidates before filtering: {str(self.db.data.shape[0])}\n\n")
+                f"Candidates before filtering: {str(self.db.count())}\n\n")
 
-        # Reload the treeview with imported database
-        self.browser_view.load_tree()
+            # Reload the treeview with imported database
+            self.browser_view.load_tree()
+
+
+    def _import_update(self):
+        """ Merge a newer FULL database .csv file into the 
+            current full database
+        """
+        # Updates need the row hashes of a full import
+        if self.db.row_hashes is None:
+            messagebox.showwarning(title="No Full Database",
+                message="Cannot import an update!",
+                detail="Updates can only be merged into a full " +
+                    "database. Please import a full database first.")
+            return
+
+        # Query user for database .csv file
+        filename = filedialog.askopenfilename()
+        # Do nothing if cancelled
+        if not filename:
+            return
+
+        # If a valid filename is found, merge it in the background
+        self._start_load(self.db.read_update, filename, 
+            self._on_update_loaded)
+
+
+    def _on_update_loaded(self, payload):
+        """ Show update summary after the merged database has 
+            been swapped in.
+        """
+        delta = payload['delta']
+
+        # Get 'initial scrub' checkbox state
+        if self.sessionpars['initial_scrub'].get() == 1:
+            self._initial_scrub()
+        else:
+            # Clear any previous output from textbox
+            self.filter_view.clear_output()
+            # Show total record count
+            self.filter_view.txt_output.insert(tk.END,
+                f"Candidates before filtering: {str(self.db.count())}\n\n")
+
+            # Reload the treeview with merged database
+            self.browser_view.load_tree()
+
+        # Show what changed
+        self.filter_view.txt_output.insert(tk.END,
+            "Update summary:\n" +
+            f"Inserted: {delta['inserted']}\n" +
+            f"Changed: {delta['changed']}\n" +
+            f"Deleted: {delta['deleted']}\n" +
+            f"Unchanged: {delta['unchanged']}\n\n")
 
 
     def _import_filtered(self):
@@ -283,19 +376,160 @@ class Application(tk.Tk):
         # Do nothing if cancelled
         if not filename:
             return
-        # If a valid filename is found, load it
-        self.db.load_filtered_db(filename)
 
+        # If a valid filename is found, load it in the background
+        self._start_load(self.db.read_filtered_db, filename, 
+            self._on_filtered_loaded)
+
+
+    def _on_filtered_loaded(self, payload):
+        """ Display filtered database after it has been swapped in.
+        """
         # Clear any previous output from textbox
         self.filter_view.clear_output()
         # Show total record count
         self.filter_view.txt_output.insert(tk.END,
-            f"Candidates before filtering: {str(self.db.data.shape[0])}\n\n")       
+            f"Candidates before filtering: {str(self.db.count())}\n\n")       
 
         # Reload the treeview with imported database
         self.browser_view.load_tree()
 
 
+    def _build_sql(self):
+        """ Clean a FULL database .csv file into a SQLite 
+            database file, then open it
+        """
+        # Query user for database .csv file
+        filename = filedialog.askopenfilename(
+            title="Select Full Database Export")
+        # Do nothing if cancelled
+        if not filename:
+            return
+
+        # Query user for SQLite database save path
+        sql_path = filedialog.asksaveasfilename(
+            title="Save SQLite Database",
+            defaultextension='.db',
+            filetypes=[('SQLite Database', '*.db')])
+        if not sql_path:
+            return
+
+        # Build in the background
+        self._start_load(partial(self.db.build_sql, sql_path=sql_path), 
+            filename, self._on_full_loaded)
+
+
+    def _open_sql(self):
+        """ Open a SQLite database file built by the Subject 
+            Browser
+        """
+        # Query user for SQLite database file
+        sql_path = filedialog.askopenfilename(
+            title="Open SQLite Database",
+            filetypes=[('SQLite Database', '*.db'), ('All Files', '*.*')])
+        # Do nothing if cancelled
+        if not sql_path:
+            return
+
+        try:
+            self.db.open_sql(sql_path)
+        except (sqlite3.DatabaseError, ValueError) as e:
+            print(f"\ncontroller: {e}")
+            messagebox.showerror(title="Open Failed",
+                message="Cannot open the selected database!",
+                detail=str(e))
+            return
+
+        self.filter_view.refresh()
+        self._on_full_loaded(None)
+
+
+    def _start_load(self, read_func, filename, on_loaded):
+        """ Read a database on a worker thread while showing a 
+            progress dialog. on_loaded is called with the loaded 
+            payload after the new data have been swapped in.
+        """
+        # Only one import at a time
+        if self.loader is not None:
+            messagebox.showwarning(title="Import In Progress",
+                message="A database is already being imported!",
+                detail="Please wait for the current import to finish " +
+                    "or cancel it.")
+            return
+
+        self.progress_dialog = progressview.ProgressDialog(self, 
+            title="Importing Database")
+        self.loader = loadermodel.DBLoader(read_func, filename)
+        self.loader.start()
+        self._poll_loader(on_loaded)
+
+
+    def _poll_loader(self, on_loaded):
+        """ Handle events posted by the loader thread, then 
+            check again shortly.
+        """
+        while True:
+            try:
+                kind, value = self.loader.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == 'progress':
+                self.progress_dialog.update_progress(*value)
+                continue
+
+            # Loading finished: close dialog and release loader
+            self._finish_load()
+            if kind == 'done':
+                # Swap in new data, then refresh views. The current 
+                # database is kept if the new data cannot be used.
+                try:
+                    if 'sql_path' in value:
+                        self.db.open_sql(value['sql_path'])
+                    else:
+                        self.db.set_data(value['data'], 
+                            value['row_hashes'], value.get('stats'))
+                except (sqlite3.DatabaseError, ValueError, KeyError,
+                    TypeError) as e:
+                    print(f"\ncontroller: {e}")
+                    messagebox.showerror(title="Import Failed",
+                        message="Cannot import the selected database!",
+                        detail=str(e))
+                    return
+                print(f"\ncontroller: Loaded {self.db.count()} records")
+                self.filter_view.refresh()
+                on_loaded(value)
+            elif kind == 'cancelled':
+                print("\ncontroller: Import cancelled; keeping " +
+                    "current database")
+            elif kind == 'error':
+                print(f"\ncontroller: {value}")
+                messagebox.showerror(title="Import Failed",
+                    message="Cannot import the selected database!",
+                    detail=str(value))
+            return
+
+        self.after(100, self._poll_loader, on_loaded)
+
+
+    def _cancel_load(self):
+        """ Ask the loader thread to stop. The current database 
+            is kept.
+        """
+        if self.loader is not None:
+            self.loader.cancel()
+
+
+    def _finish_load(self):
+        """ Close the progress dialog and release the loader.
+        """
+        if self.progress_dialog is not None:
+            self.progress_dialog.grab_release()
+            self.progress_dialog.destroy()
+        self.progress_dialog = None
+        self.loader = None
+
+
     def _import_csv_filter_vals(self):
         """ Read external filter values list and update filterview
             comboboxes with values
@@ -312,6 +546,72 @@ class Application(tk.Tk):
         self.csvmodel.export_filters(filter_dict)
 
 
+    def _batch_filters(self):
+        """ Evaluate a folder of filter files (plus the initial 
+            scrub filters, if selected) against the full database, 
+            show the remaining candidates for each and save the 
+            counts and overlap matrices.
+        """
+        filter_sets = self.csvmodel.import_filter_sets(
+            self.db.column_names() + [self.db.EXPRESSION])
+        # Do nothing if cancelled or no filter files were found
+        if not filter_sets:
+            return
+
+        result = self.db.batch_filters(filter_sets, self._scrub_filters())
+
+        # Show remaining candidates for each filter file
+        self.filter_view.clear_output()
+        self.filter_view.txt_output.insert(tk.END,
+            f"Candidates before filtering: {str(self.db.base_count())}\n\n")
+        for name in filter_sets:
+            if name in result.errors:
+                remaining = result.errors[name]
+            else:
+                remaining = int(result.counts.loc[name, 'Remaining'])
+            self.filter_view.txt_output.insert(tk.END,
+                f"{name}: {remaining}\n")
+        self.filter_view.txt_output.yview(tk.END)
+
+        self.csvmodel.export_batch(result)
+
+
+    def _compare_fitting_rules(self):
+        """ Compare fitting rule files with the default Pro Fit 
+            rules across the database, show how many 
+            recommendations each changes and save the comparison.
+        """
+        # Tables are checked when read, and the thresholds they use 
+        # when evaluated
+        try:
+            tables = self.csvmodel.import_rule_tables()
+            # Do nothing if cancelled
+            if not tables:
+                return
+            comparison = self.db.compare_fitting_rules(tables)
+        except ValueError as e:
+            messagebox.showerror(title="Invalid Fitting Rules",
+                message="Cannot use the fitting rules!",
+                detail=str(e))
+            return
+
+        # Show the changed recommendations for each rule set
+        self.filter_view.clear_output()
+        labels = list(comparison.results)
+        self.filter_view.txt_output.insert(tk.END,
+            f"Changed recommendations vs. {labels[0]}:\n")
+        for label in labels[1:]:
+            self.filter_view.txt_output.insert(tk.END, f"\n{label}\n")
+            changes = comparison.changed[label].astype(object).fillna(
+                "Not calculated")
+            for col, changed in changes.items():
+                self.filter_view.txt_output.insert(tk.END,
+                    f"  {col}: {changed}\n")
+        self.filter_view.txt_output.yview(tk.END)
+
+        self.csvmodel.export_rule_comparison(comparison)
+
+
     def _quit(self):
         """ Exit the application.
         """
@@ -334,6 +634,9 @@ class Application(tk.Tk):
             Returns: new filter dictionary with updated data types.
         """
         for key in filter_dict:
+            # Expressions are parsed by dbmodel
+            if filter_dict[key][1] == exprmodel.MATCHES:
+                continue
             if (filter_dict[key][1] == 'contains') or \
                 (filter_dict[key][1] == 'not in'):
                 try:
@@ -363,46 +666,193 @@ class Application(tk.Tk):
 
     def on_filter(self, filter_dict):
         """ Called from filterview 'Filter Records' button event. 
-            Call filter method of dbmodel.
+            Apply the filter dict rows (plus the initial scrub 
+            filters, if selected) to the full database. Results of 
+            previous clicks are reused by dbmodel, so only new or 
+            edited rows are evaluated.
+            Update tree widget after filtering. 
+        """
+        # Nothing to do if filter values were not provided
+        if not filter_dict:
+            return
+
+        #print(f"\ncontroller: Filter dict: {filter_dict.items()}")
+
+        self._apply_filters(self._scrub_filters() + 
+            [filter_dict[val] for val in filter_dict])
+
+
+    def _preview_counts(self):
+        """ Count the candidates that would remain after each 
+            complete filter row (plus the initial scrub filters, 
+            if selected) on a worker thread, and show the counts 
+            next to the rows. Estimated counts are shown until 
+            then. Any preview still running is cancelled.
+        """
+        if self.preview is not None:
+            self.preview.cancel()
+            self.preview = None
+
+        filter_dict = self.filter_view.preview_rows()
+        planner = self.db.planner()
+        # SQLite connections cannot be shared with a worker thread
+        if (not filter_dict) or (planner is None):
+            self.filter_view.show_counts({})
+            return
+
+        filter_dict = self._format_filter_vals(filter_dict)
+        scrub = self._scrub_filters()
+        filters = scrub + list(filter_dict.values())
+
+        # Show estimates at once; counts replace them when ready
+        estimates = planner.estimate(filters)[len(scrub):]
+        self.filter_view.show_counts({row: f"~{count}" 
+            for row, count in zip(filter_dict, estimates) 
+            if count is not None})
+
+        self.preview = previewmodel.CountPreview(planner, 
+            self.db.generation, filters, self._preview_memo)
+        self.preview.start()
+        self._poll_preview(self.preview, list(filter_dict), len(scrub))
+
+
+    def _poll_preview(self, preview, rows, num_scrub):
+        """ Show the counts posted by a count preview, or check 
+            again shortly. Stops if a newer preview was started.
+        """
+        if preview is not self.preview:
+            return
+        try:
+            kind, value = preview.events.get_nowait()
+        except queue.Empty:
+            self.after(50, self._poll_preview, preview, rows, num_scrub)
+            return
+
+        self.preview = None
+        if kind != 'done':
+            self.filter_view.show_counts({})
+            return
+        counts, self._preview_memo = value
+        shown = {}
+        for row, count in zip(rows, counts[num_scrub:]):
+            if count is None:
+                break
+            shown[row] = str(count) if isinstance(count, int) else 'Error'
+        # A failing scrub filter leaves no counts
+        if any(not isinstance(count, int) for count in counts[:num_scrub]):
+            shown = {}
+        self.filter_view.show_counts(shown)
+
+
+    def _apply_filters(self, filters):
+        """ Pass a list of (attribute, operator, value) filters to 
+            the dbmodel filter planner, which applies the most 
+            selective filters first, and display the results.
             Update tree widget after filtering. 
         """
         # Clear any previous output from textbox
         self.filter_view.clear_output()
 
-        # Remind user what the previous record count was
+        # Remind user what the total record count is
         self.filter_view.txt_output.insert(tk.END,
-            f"Candidates before filtering: {str(self.db.data.shape[0])}\n\n")
+            f"Candidates before filtering: {str(self.db.base_count())}\n\n")
 
-        #print(f"\ncontroller: Filter dict: {filter_dict.items()}")
-
-        # Extract filter dict values and pass to db filter function
+        # Apply all filters in one pass
         try:
-            for val in filter_dict:
-                self.db.filter(
-                    filter_dict[val][0],
-                    filter_dict[val][1],
-                    filter_dict[val][2]
-                )
-                self.filter_view.txt_output.insert(tk.END, 
-                    f"Filtering by: {filter_dict[val][0]} " +
-                    f"{filter_dict[val][1]} {filter_dict[val][2]}...\n" +
-                    f"Remaining Candidates: {str(self.db.data.shape[0])}\n\n")
-                # Scroll to bottom of text box
-                self.filter_view.txt_output.yview(tk.END)
+            results = self.db.set_filters(filters)
         except TypeError as e:
             print(e)
             messagebox.showerror(title="Filtering Error",
                 message="Cannot compare different data types!",
                 detail="The search term data type does not match the " +
-                    "database data type.")
+                    "database data type. The filters were not changed.")
+            return
+        except ValueError as e:
+            print(e)
+            messagebox.showerror(title="Filtering Error",
+                message="Invalid filter value!",
+                detail=f"{e} The filters were not changed.")
+            return
+        except KeyError as e:
+            print(e)
+            messagebox.showerror(title="Filtering Error",
+                message="Unknown attribute!",
+                detail=f"'{e.args[0]}' is not a database column. " +
+                    "The filters were not changed.")
+            return
+
+        # Show remaining candidates after each filter, in the 
+        # order they were applied
+        for index, ((colname, operator, value), remaining) in \
+            enumerate(results):
+            self.filter_view.txt_output.insert(tk.END, 
+                f"Filtering by: {colname} {operator} {value}...\n")
+            # Show which frequencies excluded candidates
+            if colname == self.db.AUDIOGRAM:
+                for col, rejected in self.db.audiogram_rejections(
+                    index).items():
+                    self.filter_view.txt_output.insert(tk.END,
+                        f"    Outside window at {col}: {rejected}\n")
+            self.filter_view.txt_output.insert(tk.END, 
+                f"Remaining Candidates: {str(remaining)}\n\n")
+        # Scroll to bottom of text box
+        self.filter_view.txt_output.yview(tk.END)
 
         # Update tree widget after filtering
         self.browser_view.load_tree()
 
 
-    def _initial_scrub(self):
-        """ Perform perfunctory junk record removal
+    def _undo_filter(self):
+        """ Remove the most recent filter step.
         """
+        removed = self.db.undo_filter()
+        if removed is None:
+            print("\ncontroller: No filters to undo")
+            return
+        self._show_filter_steps("Removed filter: " + 
+            f"{removed[0]} {removed[1]} {removed[2]}")
+
+
+    def _redo_filter(self):
+        """ Re-apply the most recently removed filter step.
+        """
+        restored = self.db.redo_filter()
+        if restored is None:
+            print("\ncontroller: No filters to redo")
+            return
+        self._show_filter_steps("Restored filter: " + 
+            f"{restored[0]} {restored[1]} {restored[2]}")
+
+
+    def _remove_filters(self):
+        """ Remove all filter steps without re-importing.
+        """
+        self.db.reset_filters()
+        self._show_filter_steps("Removed all filters")
+
+
+    def _show_filter_steps(self, message):
+        """ Display message, the current filter steps and the 
+            remaining candidates, then update the tree widget.
+        """
+        self.filter_view.clear_output()
+        self.filter_view.txt_output.insert(tk.END, f"{message}\n\n")
+        for colname, operator, value in [
+            step['filter'] for step in self.db.steps]:
+            self.filter_view.txt_output.insert(tk.END, 
+                f"Filtered by: {colname} {operator} {value}\n")
+        self.filter_view.txt_output.insert(tk.END,
+            f"\nRemaining Candidates: {str(self.db.count())}\n\n")
+        self.browser_view.load_tree()
+
+
+    def _scrub_filters(self):
+        """ Return the perfunctory junk record filters if the 
+            'initial scrub' checkbox is selected.
+        """
+        if self.sessionpars['initial_scrub'].get() != 1:
+            return []
+
         # Create dictionary of filtering values
         filter_dict = {
             1: ("Status", "equals", "Active"),
@@ -410,9 +860,14 @@ class Application(tk.Tk):
             3: ("Employment Status", "does not equal", "Employee"),
             #4: ("Miles From Starkey", "<=", 60)
         }
+        return list(filter_dict.values())
+
 
+    def _initial_scrub(self):
+        """ Perform perfunctory junk record removal
+        """
         # Call filter function
-        self.on_filter(filter_dict)
+        self._apply_filters(self._scrub_filters())
 
 
     #########################
@@ -433,6 +888,33 @@ class Application(tk.Tk):
         self.browser_view.plot_audiogram(ac=ac, bc=bc)
 
 
+    def _find_similar(self):
+        """ List the remaining subjects with audiograms closest to 
+            the selected subject's.
+        """
+        try:
+            subject = self.browser_view.record
+        except AttributeError:
+            print("\ncontroller: No participant selected")
+            return
+
+        try:
+            matches = self.db.similar(subject, 
+                k=self.browser_view.similar_k.get(),
+                metric=self.browser_view.similar_metric.get())
+        except (IndexError, tk.TclError) as e:
+            messagebox.showerror(
+                title="Find Similar",
+                message="Cannot find similar audiograms!",
+                detail=str(e)
+            )
+            return
+
+        print(f"\ncontroller: Found {matches.shape[0]} audiograms " +
+            f"similar to {subject}")
+        self.browser_view.load_similar(matches, subject)
+
+
     ########################
     # Tools Menu Functions #
     ########################
@@ -458,6 +940,10 @@ class Application(tk.Tk):
             
             f"Right PTA4: {dstats['r_pta4']} dB HL" +
                 f"\nLeft PTA4: {dstats['l_pta4']} dB HL",
+
+            f"Within L receiver fitting range: {dstats['fits_l']}" +
+                f"\nWithin M receiver fitting range: {dstats['fits_m']}" +
+                f"\nWithin P receiver fitting range: {dstats['fits_p']}",
         ]
 
         # Join list, separated by new line
@@ -470,6 +956,48 @@ class Application(tk.Tk):
         )
 
 
+    def _set_age_ref_date(self):
+        """ Query user for a reference date and recalculate 
+            ages as of that date.
+        """
+        date_str = simpledialog.askstring(
+            title="Age Reference Date",
+            prompt="Calculate ages as of (MM/DD/YYYY).\n" +
+                "Leave blank to use today's date.",
+            parent=self
+        )
+        # Do nothing if cancelled
+        if date_str is None:
+            return
+
+        if not date_str.strip():
+            ref_date = None
+        else:
+            try:
+                ref_date = datetime.strptime(date_str.strip(), '%m/%d/%Y')
+            except ValueError:
+                messagebox.showerror(title="Invalid Date",
+                    message="Cannot read the provided date!",
+                    detail="Please enter the date as MM/DD/YYYY.")
+                return
+
+        # Stop any count preview before the ages change
+        if self.preview is not None:
+            self.preview.cancel()
+            self.preview = None
+        self.db.update_ages(ref_date)
+
+        # Show reference date in output box
+        if ref_date is None:
+            msg = "Ages calculated as of today\n\n"
+        else:
+            msg = f"Ages calculated as of {ref_date:%m/%d/%Y}\n\n"
+        self.filter_view.txt_output.insert(tk.END, msg)
+
+        # Age filter counts may have changed
+        self._preview_counts()
+
+
     ############################
     # Session Dialog Functions #
     ############################
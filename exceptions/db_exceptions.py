@@ -0,0 +1,16 @@
+""" Custom exceptions for the dbmodel class.
+
+    Written by: Travis M. Moore
+"""
+
+
+class LoadCancelled(Exception):
+    """ Database import was cancelled by the user """
+
+    def __init__(self, db_path, *args):
+        super().__init__(args)
+        self.db_path = db_path
+
+
+    def __str__(self):
+        return f'Database Exception: Import of {self.db_path} was cancelled.'
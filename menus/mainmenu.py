@@ -19,6 +19,8 @@ class MainMenu(tk.Menu):
 
     def _bind_accelerators(self):
         self.bind_all('<Control-q>', self._event('<<FileQuit>>'))
+        self.bind_all('<Control-z>', self._event('<<ToolsUndoFilter>>'))
+        self.bind_all('<Control-y>', self._event('<<ToolsRedoFilter>>'))
 
 
     def __init__(self, parent, _app_info, **kwargs):
@@ -35,10 +37,22 @@ class MainMenu(tk.Menu):
             label="Import Full DB...",
             command=self._event('<<FileImportFullDB>>')
         )
+        self.file_menu.add_command(
+            label="Import Update...",
+            command=self._event('<<FileImportUpdate>>')
+        )
         self.file_menu.add_command(
             label="Import Filtered DB...",
             command=self._event('<<FileImportFilteredDB>>')
         )
+        self.file_menu.add_command(
+            label="Build SQLite DB...",
+            command=self._event('<<FileBuildSQL>>')
+        )
+        self.file_menu.add_command(
+            label="Open SQLite DB...",
+            command=self._event('<<FileOpenSQL>>')
+        )
         self.file_menu.add_command(
             label="Export DB...",
             command=self._event('<<FileExportDB>>')
@@ -52,6 +66,10 @@ class MainMenu(tk.Menu):
             label="Export Filter Values...",
             command=self._event('<<FileExportFilterVals>>')
         )
+        self.file_menu.add_command(
+            label="Batch Evaluate Filter Files...",
+            command=self._event('<<FileBatchFilters>>')
+        )
         self.file_menu.add_separator()
         self.file_menu.add_command(
             label="Quit",
@@ -69,6 +87,10 @@ class MainMenu(tk.Menu):
             label="Summary Statistics...",
             command=self._event('<<ToolsSummaryStats>>')
         )
+        tools_menu.add_command(
+            label="Set Age Reference Date...",
+            command=self._event('<<ToolsAgeRefDate>>')
+        )
         tools_menu.add_separator()
         tools_menu.add_command(
             label='Group Audiogram...',
@@ -78,11 +100,33 @@ class MainMenu(tk.Menu):
             label='Ear Specific Audiogram...',
             command=self._event('<<ToolsPlotEarSpecificGroupAudio>>')
         )
+        tools_menu.add_command(
+            label='Compare Fitting Rules...',
+            command=self._event('<<ToolsCompareFittingRules>>')
+        )
         tools_menu.add_separator()
+        tools_menu.add_command(
+            label='Undo Filter',
+            command=self._event('<<ToolsUndoFilter>>'),
+            accelerator='Ctrl+Z'
+        )
+        tools_menu.add_command(
+            label='Redo Filter',
+            command=self._event('<<ToolsRedoFilter>>'),
+            accelerator='Ctrl+Y'
+        )
+        tools_menu.add_command(
+            label='Remove All Filters',
+            command=self._event('<<ToolsRemoveFilters>>')
+        )
         tools_menu.add_command(
             label='Reset Filters',
             command=self._event('<<ToolsReset>>')
         )
+        tools_menu.add_command(
+            label='Clear Database Cache',
+            command=self._event('<<ToolsClearCache>>')
+        )
         # Add Tools menu to the menubar
         self.add_cascade(label="Tools", menu=tools_menu)
 
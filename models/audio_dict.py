@@ -41,3 +41,13 @@ Jingjing = {
     '2000': (-10, 70),
     '4000': (-10, 70),
 }
+
+
+# Windows by name, as listed in the filter view
+presets = {
+    'below_70': below_70,
+    'N3_max': N3_max,
+    'N3': N3,
+    'N4': N4,
+    'Jingjing': Jingjing,
+}
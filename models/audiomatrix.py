@@ -0,0 +1,141 @@
+""" Audiogram threshold matrix for the Subject Browser.
+
+    Holds air and bone conduction thresholds as one contiguous 
+    subjects x frequencies array of int8 values (thresholds are 
+    whole dB values, normally between -10 and 120), with MISSING 
+    marking absent thresholds. Row order matches the SubDB 
+    dataframe, and a threshold is missing in the matrix exactly 
+    when it is missing in the dataframe.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+
+#########
+# BEGIN #
+#########
+class ThresholdMatrix:
+    """ Compact subjects x frequencies threshold array.
+    """
+    # Marker for missing thresholds
+    MISSING = -128
+
+    # Range of thresholds that can be stored (dB HL)
+    LOWEST = -127
+    HIGHEST = 127
+
+
+    def __init__(self, columns, values):
+        """ columns: list of threshold column names
+            values: (subjects x columns) int8 array
+        """
+        self.columns = list(columns)
+        self.values = values
+        self._positions = {col: ii for ii, col in enumerate(self.columns)}
+
+
+    @classmethod
+    def from_frame(cls, frame, columns):
+        """ Build a matrix from threshold columns of a dataframe. 
+            Thresholds are truncated to whole dB (as int() did 
+            before) and values outside LOWEST..HIGHEST are stored 
+            as the nearest limit rather than wrapping. Non-numeric 
+            and missing values are stored as MISSING.
+        """
+        thresholds = np.full((frame.shape[0], len(columns)), np.nan)
+        for ii, col in enumerate(columns):
+            if col not in frame.columns:
+                continue
+            values = frame[col]
+            if not is_numeric_dtype(values):
+                values = pd.to_numeric(values.astype(object), errors='coerce')
+            thresholds[:, ii] = values.to_numpy(dtype=float)
+
+        missing = np.isnan(thresholds)
+        thresholds = np.clip(np.trunc(thresholds), cls.LOWEST, cls.HIGHEST)
+        thresholds[missing] = cls.MISSING
+        values = np.ascontiguousarray(thresholds, dtype=np.int8)
+        return cls(columns, values)
+
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+
+    def take(self, rows):
+        """ Return a new matrix with the given rows (boolean mask 
+            or row positions).
+        """
+        return ThresholdMatrix(self.columns, self.values[rows])
+
+
+    def positions(self, columns):
+        """ Return matrix column positions for column names.
+        """
+        return [self._positions[col] for col in columns]
+
+
+    def as_float(self, columns=None, rows=None):
+        """ Return thresholds as float64 with NaN for missing 
+            values. Optionally select column names and rows.
+        """
+        values = self.values
+        if rows is not None:
+            values = values[rows]
+        if columns is not None:
+            values = values[:, self.positions(columns)]
+        out = values.astype(float)
+        out[values == self.MISSING] = np.nan
+        return out
+
+
+    def row(self, position):
+        """ Return a dict of column name: threshold (int, or None 
+            if missing) for one subject.
+        """
+        values = self.values[position]
+        return {col: (None if val == self.MISSING else int(val)) 
+                for col, val in zip(self.columns, values)}
+
+
+    def window(self, columns, lows, highs, rows=None):
+        """ Check thresholds in columns against [low, high] limits 
+            per column in one array operation. Missing thresholds 
+            are outside the window. Optionally select rows.
+
+            Returns: (keep, rejected) tuple: boolean array of rows 
+            with every threshold inside the window, and an array of 
+            the number of rows outside the window at each column.
+        """
+        positions = self.positions(columns)
+        if rows is None:
+            values = self.values[:, positions]
+        else:
+            values = self.values[np.ix_(rows, positions)]
+
+        # Thresholds are whole dB: round limits inward and compare 
+        # as int8. Lows of at least -127 also exclude MISSING.
+        lows = np.clip(np.ceil(lows), -127, 127).astype(np.int8)
+        highs = np.clip(np.floor(highs), -128, 127).astype(np.int8)
+        inside = (values >= lows) & (values <= highs)
+        return inside.all(axis=1), (~inside).sum(axis=0)
+
+
+    def row_means(self, columns):
+        """ Mean threshold per subject across columns, ignoring 
+            missing values (NaN if all are missing).
+        """
+        values = self.as_float(columns)
+        counts = np.sum(~np.isnan(values), axis=1)
+        sums = np.nansum(values, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
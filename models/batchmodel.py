@@ -0,0 +1,170 @@
+""" Batch evaluation of saved filter sets.
+
+    Evaluates many filter sets (e.g., the inclusion criteria of
+    each study, saved with File>Export Filter Values) against the
+    base database at once. Each distinct filter is evaluated once,
+    however many sets use it, and sets are combined as bitmaps, so
+    the counts for each set and the overlap between sets are
+    bitwise operations.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import custom modules
+from models.filtermodel import FilterCache
+from models import indexmodel
+
+
+#########
+# BEGIN #
+#########
+class BatchResult:
+    """ Candidates left by each filter set.
+
+        counts: dataframe with one row per set: the number of
+            filters, the candidates left after each filter (in
+            file order) and the candidates remaining
+        overlap: dataframe of the candidates shared by each pair of
+            sets (the diagonal is the candidates remaining)
+        errors: dict of set name: error message for sets that could
+            not be evaluated (left out of overlap)
+    """
+    def __init__(self, ids, rows, funnels, errors):
+        """ ids: Subject Ids of the base rows
+            rows: dict of set name: RowSet remaining
+            funnels: dict of set name: list of counts after each
+                filter
+            errors: dict of set name: error message
+        """
+        self.ids = ids
+        self.rows = rows
+        self.errors = errors
+
+        # Counts matrix
+        width = max([len(funnel) for funnel in funnels.values()] + [0])
+        columns = [f"Filter {ii + 1}" for ii in range(width)]
+        counts = pd.DataFrame(
+            [funnel + [np.nan] * (width - len(funnel))
+                for funnel in funnels.values()],
+            index=list(funnels), columns=columns)
+        counts.insert(0, 'Filters', [len(funnel) if name not in errors
+            else np.nan for name, funnel in funnels.items()])
+        counts['Remaining'] = [rows[name].count if name in rows
+            else np.nan for name in funnels]
+        counts.index.name = 'Filter Set'
+        # Whole numbers, blank where a set has fewer filters
+        self.counts = counts.astype('Int64')
+
+        # Pairwise overlap
+        names = list(rows)
+        bits = [rows[name].bits() for name in names]
+        overlap = np.zeros((len(names), len(names)), dtype=np.int64)
+        for ii in range(len(names)):
+            overlap[ii, ii] = rows[names[ii]].count
+            for jj in range(ii + 1, len(names)):
+                shared = indexmodel.popcount(bits[ii] & bits[jj])
+                overlap[ii, jj] = overlap[jj, ii] = shared
+        self.overlap = pd.DataFrame(overlap, index=names, columns=names)
+        self.overlap.index.name = 'Filter Set'
+
+
+    def subjects(self, name):
+        """ Return the Subject Ids remaining after a filter set.
+        """
+        return self.ids[self.rows[name].positions()]
+
+
+    def shared(self, first, second):
+        """ Return the Subject Ids remaining after both filter sets.
+        """
+        bits = self.rows[first].bits() & self.rows[second].bits()
+        rows = indexmodel.RowSet(self.rows[first].n, bits=bits)
+        return self.ids[rows.positions()]
+
+
+class FilterBatch:
+    """ Evaluate many filter sets against the base database,
+        sharing filter results between sets.
+    """
+    def __init__(self, evaluate, ids):
+        """ evaluate: function(filter) returning the RowSet of base
+                rows kept by one (colname, operator, value) filter
+            ids: array of the Subject Ids of the base rows
+        """
+        self.evaluate = evaluate
+        self.ids = np.asarray(ids)
+        self.n = self.ids.shape[0]
+
+        # Normalized filter: RowSet, or the exception it raised
+        self._filters = {}
+        # Normalized filter prefix: RowSet
+        self._prefixes = {}
+
+
+    def _filter_rows(self, flt):
+        """ Return the RowSet kept by flt, evaluating each distinct
+            filter only once. Raises the filter's error (e.g.,
+            TypeError for a mismatched value) every time.
+        """
+        norm = FilterCache.normalize(flt)
+        if norm not in self._filters:
+            try:
+                self._filters[norm] = self.evaluate(tuple(flt))
+            except (TypeError, KeyError, ValueError) as e:
+                self._filters[norm] = e
+        rows = self._filters[norm]
+        if isinstance(rows, Exception):
+            raise rows
+        return rows
+
+
+    def _apply(self, filters):
+        """ Return the counts after each filter, and the RowSet left
+            after all of them. Sets starting with the same filters
+            (e.g., the initial scrub) share the rows left by them.
+        """
+        rows = indexmodel.RowSet.all(self.n)
+        prefix = ()
+        funnel = []
+        for flt in filters:
+            prefix = prefix + (FilterCache.normalize(flt),)
+            if prefix not in self._prefixes:
+                bits = rows.bits() & self._filter_rows(flt).bits()
+                self._prefixes[prefix] = indexmodel.RowSet(self.n,
+                    bits=bits)
+            rows = self._prefixes[prefix]
+            funnel.append(rows.count)
+        return funnel, rows
+
+
+    def run(self, filter_sets, scrub=()):
+        """ Evaluate filter sets.
+
+            filter_sets: dict of name: list of (colname, operator,
+                value) filters
+            scrub: filters applied before every set (e.g., the
+                initial scrub)
+
+            Returns: BatchResult
+        """
+        scrub = list(scrub)
+        rows = {}
+        funnels = {}
+        errors = {}
+        for name, filters in filter_sets.items():
+            try:
+                funnel, rows[name] = self._apply(scrub + list(filters))
+                funnels[name] = funnel[len(scrub):]
+            except (TypeError, KeyError, ValueError) as e:
+                funnels[name] = []
+                errors[name] = f"{type(e).__name__}: {e}"
+        print(f"\nbatchmodel: Evaluated {len(filter_sets)} filter sets " +
+            f"({len(self._filters)} distinct filters)")
+        return BatchResult(self.ids, rows, funnels, errors)
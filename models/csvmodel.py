@@ -19,6 +19,10 @@ import os
 # Import misc packages
 import ast
 
+# Import custom modules
+from models import exprmodel
+from models import fittingmodel
+
 
 #########
 # MODEL #
@@ -68,7 +72,36 @@ class CSVModel:
         if not filename:
             return
         # If a valid filename is found, load it
+        return self.read_filters(filename)
+
+
+    # Operators in filter files: those of the filter view rows 
+    # and expression filters
+    OPERATORS = set(exprmodel.OPERATORS.values()) | {exprmodel.MATCHES}
+
+
+    @classmethod
+    def read_filters(cls, filename, attributes=None):
+        """ Read a filters .csv file written by export_filters. 
+            Raises ValueError if the file is not a filter file: it 
+            must have exactly three rows (attribute, operator, 
+            value), with known operators and, if attributes is 
+            given, attributes from that list.
+
+            Returns: filter dict of row name: (colname, operator, 
+            value)
+        """
         filter_df = pd.read_csv(filename)
+        if filter_df.shape[0] != 3:
+            raise ValueError(f"expected 3 rows, found {filter_df.shape[0]}")
+        for key in filter_df.columns:
+            if filter_df.loc[1,key] not in cls.OPERATORS:
+                raise ValueError(f"unknown operator " +
+                    f"'{filter_df.loc[1,key]}' in column '{key}'")
+            if (attributes is not None) and \
+                (filter_df.loc[0,key] not in attributes):
+                raise ValueError(f"unknown attribute " +
+                    f"'{filter_df.loc[0,key]}' in column '{key}'")
 
         # Create filter dict
         keys = list(filter_df.columns)
@@ -100,6 +133,100 @@ class CSVModel:
         return filter_dict
 
 
+    def import_filter_sets(self, attributes):
+        """ Read every filters .csv file in a folder chosen by the 
+            user. Files that are not filter files (see 
+            read_filters; e.g., saved batch results) are skipped. 
+            attributes: list of attributes filters may use.
+
+            Returns: dict of file name (without extension): list 
+            of filters, or None if cancelled
+        """
+        directory = filedialog.askdirectory(
+            title="Choose a folder of filter files")
+        # Do nothing if cancelled
+        if not directory:
+            return
+
+        filter_sets = {}
+        for path in sorted(Path(directory).glob('*.csv')):
+            try:
+                filter_dict = self.read_filters(path, attributes)
+            except (KeyError, ValueError, SyntaxError, 
+                pd.errors.ParserError) as e:
+                print(f"\ncsvmodel: Skipping {path.name}: not a " +
+                    f"filter file ({e})")
+                continue
+            filter_sets[path.stem] = list(filter_dict.values())
+        print(f"\ncsvmodel: Read {len(filter_sets)} filter files")
+        return filter_sets
+
+
+    def export_batch(self, result):
+        """ Save the counts matrix of a batchmodel.BatchResult to 
+            .csv, and the overlap matrix next to it (same name 
+            ending in '_overlap').
+        """
+        filename = 'batch_counts_' + self.datestamp
+
+        # Query user for save path
+        save_path = filedialog.asksaveasfilename(
+            initialfile=filename,
+            defaultextension='.csv')
+        # Do nothing if cancelled
+        if not save_path:
+            return
+
+        save_path = Path(save_path)
+        result.counts.to_csv(save_path)
+        result.overlap.to_csv(save_path.with_name(
+            save_path.stem + '_overlap' + save_path.suffix))
+        print("\ncsvmodel: Batch results successfully written to file.")
+
+
+    def import_rule_tables(self):
+        """ Read fitting rule tables (.json) chosen by the user.
+            Raises ValueError if a table cannot be compiled.
+
+            Returns: list of fittingmodel.RuleTable, or None if 
+            cancelled
+        """
+        filenames = filedialog.askopenfilenames(
+            title="Choose fitting rule files",
+            filetypes=[("Fitting rules", "*.json")])
+        # Do nothing if cancelled
+        if not filenames:
+            return
+        return [fittingmodel.RuleTable.load(filename) 
+                for filename in filenames]
+
+
+    def export_rule_comparison(self, comparison):
+        """ Save the value counts of a fittingmodel.RuleComparison
+            to .csv, with the changed counts and per-rule match 
+            counts next to it (same name ending in '_changed' and 
+            '_rules').
+        """
+        filename = 'rule_comparison_' + self.datestamp
+
+        # Query user for save path
+        save_path = filedialog.asksaveasfilename(
+            initialfile=filename,
+            defaultextension='.csv')
+        # Do nothing if cancelled
+        if not save_path:
+            return
+
+        save_path = Path(save_path)
+        comparison.counts.to_csv(save_path)
+        for suffix, frame in [('_changed', comparison.changed), 
+            ('_rules', comparison.matches)]:
+            frame.to_csv(save_path.with_name(
+                save_path.stem + suffix + save_path.suffix), 
+                index=(suffix == '_changed'))
+        print("\ncsvmodel: Rule comparison successfully written to file.")
+
+
 
 
 
@@ -0,0 +1,116 @@
+""" Ingestion schema for full 'General Search' database exports.
+
+    Lists the columns kept from the export (by their names in the 
+    export), how each column is read, and the names that replace 
+    inconsistent export column names.
+"""
+
+# Column types
+# Numbers: non-numeric values (e.g., '%null%') become NaN
+NUMERIC = 'numeric'
+# Free text: numbers are kept only if the whole column is numeric
+TEXT = 'text'
+
+# Columns to import, in export order
+COLUMNS = [
+    ('Subject Id', NUMERIC),
+    ('Status', TEXT),
+    ('Availability', TEXT),
+    ('Hearing AidUse', TEXT),
+    ('RightStyle', TEXT),
+    ('Right Earmold Style', TEXT),
+    ('LeftStyle', TEXT),
+    ('Left Earmold Style', TEXT),
+    ('RightAC 250', NUMERIC),
+    ('RightAC 500', NUMERIC),
+    ('RightAC 750', NUMERIC),
+    ('RightAC 1000', NUMERIC),
+    ('RightAC 1500', NUMERIC),
+    ('RightAC 2000', NUMERIC),
+    ('RightAC 3000', NUMERIC),
+    ('RightAC 4000', NUMERIC),
+    ('RightAC 6000', NUMERIC),
+    ('RightAC 8000', NUMERIC),
+    ('R Pt Type', TEXT),
+    ('R Lf Degree', TEXT),
+    ('R Hf Degree', TEXT),
+    ('R Pt Configuration', TEXT),
+    ('LeftAC 250', NUMERIC),
+    ('LeftAC 500', NUMERIC),
+    ('LeftAC 750', NUMERIC),
+    ('LeftAC 1000', NUMERIC),
+    ('LeftAC 1500', NUMERIC),
+    ('LeftAC 2000', NUMERIC),
+    ('LeftAC 3000', NUMERIC),
+    ('LeftAC 4000', NUMERIC),
+    ('LeftAC 6000', NUMERIC),
+    ('LeftAC 8000', NUMERIC),
+    ('L Pt Type', TEXT),
+    ('L Lf Degree', TEXT),
+    ('L Hf Degree', TEXT),
+    ('L Pt Configuration', TEXT),
+    ('Asymmetry', NUMERIC),
+    ('Latest Study', TEXT),
+    ('Employment Status', TEXT),
+    ('Steadi Pass Fail', TEXT),
+    ('Thi Score', NUMERIC),
+    ('Thi Pass Fail', TEXT),
+    ('Date Of Birth', TEXT),
+    ('Good Candidate', TEXT),
+    ('Good Candidate Comment', TEXT),
+    ('Ha Accessories Yn', TEXT),
+    ('Hours Used Daily', TEXT),
+    ('L Pt Bc 1000', NUMERIC),
+    ('L Pt Bc 2000', NUMERIC),
+    ('L Pt Bc 4000', NUMERIC),
+    ('L Pt Bc 500', NUMERIC),
+    ('L Speech Quicksin Snr', NUMERIC),
+    ('L Speech Wrs Pl', TEXT),
+    ('L Speech Wrs Score', NUMERIC),
+    ('L Tympanometry Type', TEXT),
+    ('Left Make', TEXT),
+    ('Left Ric Cable Size', NUMERIC),
+    ('Left Thin Tube Size', NUMERIC),
+    ('Medications', TEXT),
+    ('Miles From Starkey', NUMERIC),
+    ('MoCA Pass/Fail', TEXT),
+    ('MoCA Total Score', NUMERIC),
+    ('R Speech Quicksin Snr', NUMERIC),
+    ('R Speech Wrs Pl', TEXT),
+    ('R Speech Wrs Score', NUMERIC),
+    ('R Tympanometry Type', TEXT),
+    ('RightBC  1000', NUMERIC),
+    ('RightBC  2000', NUMERIC),
+    ('RightBC  4000', NUMERIC),
+    ('RightBC 500', NUMERIC),
+    ('Right Make', TEXT),
+    ('Right Ric Cable Size', NUMERIC),
+    ('Right Thin Tube Size', NUMERIC),
+    ('Sla Date', TEXT),
+    ('Smartphone Os', TEXT),
+    ('Smartphone Type', TEXT),
+    ('Smartphone Yn', TEXT),
+    ('Social Gatherings', TEXT),
+    ('Test Date', TEXT),
+    ('Use Cellphone', TEXT),
+    ('Use Email', TEXT),
+    ('Use Internet', TEXT),
+    ('Use Starkey Ha Accessories Yn', TEXT),
+    ('When Noticed Loss', TEXT),
+    ('Will Not Wear', TEXT),
+]
+
+# Corrected column names
+RENAME = {
+    'L Pt Bc 1000': 'LeftBC 1000',
+    'L Pt Bc 2000': 'LeftBC 2000',
+    'L Pt Bc 4000': 'LeftBC 4000',
+    'L Pt Bc 500': 'LeftBC 500',
+    'RightBC  1000': 'RightBC 1000',
+    'RightBC  2000': 'RightBC 2000',
+    'RightBC  4000': 'RightBC 4000',
+    'Hearing AidUse': 'Hearing Aid Use',
+}
+
+# Missing value marker used by the export
+NULL_VALUE = '%null%'
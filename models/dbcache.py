@@ -0,0 +1,195 @@
+""" Persistent cache of cleaned databases.
+
+    Stores the cleaned SubDB dataframe for a 'General Search'
+    export so re-opening the same export skips parsing and
+    cleaning. Entries are keyed by the source file fingerprint
+    (size, modification time and content hash) and the cleaning
+    schema version.
+
+    Written by: Travis M. Moore
+"""
+
+############
+# IMPORTS  #
+############
+# Import system packages
+from pathlib import Path
+import hashlib
+import os
+
+# Import data handling packages
+import json
+import pickle
+
+
+#########
+# BEGIN #
+#########
+class DBCache:
+    """ Read and write cleaned database cache files.
+    """
+    # Increment whenever SubDB cleaning changes its output, so
+    # stale cache files are ignored
+    SCHEMA_VERSION = 4
+
+    # Bytes read per block when hashing source files
+    BLOCK_SIZE = 1024 * 1024
+
+
+    def __init__(self, _app_info):
+        # Assign variables
+        self._app_info = _app_info
+
+        # Store cache files alongside the session parameters
+        # file in the user's home directory
+        self.directory = Path.home() / self._app_info['name'] / 'cache'
+        if not os.path.exists(self.directory):
+            print("dbcache: No cache directory found - creating it")
+            os.makedirs(self.directory)
+
+        # Index of source file paths and their last fingerprints
+        self.index_path = self.directory / 'index.json'
+        self._index = self._load_index()
+
+
+    ###################
+    # Index Functions #
+    ###################
+    def _load_index(self):
+        """ Read the source file index, or start a new one.
+        """
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, 'r') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            print("dbcache: Could not read cache index; starting a new one")
+            return {}
+
+
+    def _save_index(self):
+        """ Write the source file index to disk.
+        """
+        try:
+            with open(self.index_path, 'w') as fh:
+                json.dump(self._index, fh)
+        except OSError as e:
+            print(f"dbcache: Could not write cache index: {e}")
+
+
+    def _hash_file(self, db_path):
+        """ Return a content hash of the file at db_path.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        with open(db_path, 'rb') as fh:
+            for block in iter(lambda: fh.read(self.BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+
+    def fingerprint(self, db_path):
+        """ Return a dict of size, modification time and content
+            hash for db_path. The content hash is only recomputed
+            when size or modification time have changed since the
+            file was last seen.
+        """
+        key = os.path.abspath(db_path)
+        stat = os.stat(db_path)
+        known = self._index.get(key)
+        if known and (known['size'] == stat.st_size) \
+            and (known['mtime'] == stat.st_mtime_ns):
+            return known
+
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': self._hash_file(db_path)
+        }
+
+
+    def _entry_path(self, fingerprint):
+        """ Create the cache file path for a fingerprint.
+        """
+        filename = f"{fingerprint['hash']}_v{self.SCHEMA_VERSION}.pkl"
+        return self.directory / filename
+
+
+    ########################
+    # Read/Write Functions #
+    ########################
+    def load(self, db_path):
+        """ Return the cached payload for db_path, or None if
+            there is no valid cache entry.
+        """
+        try:
+            fingerprint = self.fingerprint(db_path)
+        except OSError as e:
+            print(f"dbcache: Could not fingerprint source file: {e}")
+            return None
+
+        entry = self._entry_path(fingerprint)
+        if not entry.exists():
+            print("\ndbcache: No cached copy found")
+            return None
+
+        try:
+            with open(entry, 'rb') as fh:
+                payload = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError) as e:
+            print(f"\ndbcache: Could not read cache file: {e}")
+            return None
+
+        # Guard against files written by a different schema
+        if payload.get('version') != self.SCHEMA_VERSION:
+            return None
+
+        # Remember the fingerprint to skip rehashing next time
+        self._index[os.path.abspath(db_path)] = fingerprint
+        self._save_index()
+
+        print("\ndbcache: Loaded cleaned database from cache")
+        return payload
+
+
+    def save(self, db_path, payload):
+        """ Write payload (a dict containing at least 'data') to
+            the cache entry for db_path.
+        """
+        try:
+            fingerprint = self.fingerprint(db_path)
+            payload = dict(payload, version=self.SCHEMA_VERSION,
+                fingerprint=fingerprint)
+
+            # Write to a temporary file first so an interrupted
+            # write never leaves a truncated cache entry behind
+            entry = self._entry_path(fingerprint)
+            temp = entry.with_suffix('.tmp')
+            with open(temp, 'wb') as fh:
+                pickle.dump(payload, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, entry)
+
+            # Remove the previous entry for this source file
+            key = os.path.abspath(db_path)
+            previous = self._index.get(key)
+            if previous and (previous['hash'] != fingerprint['hash']):
+                old_entry = self._entry_path(previous)
+                if old_entry.exists():
+                    os.remove(old_entry)
+
+            self._index[key] = fingerprint
+            self._save_index()
+            print("dbcache: Saved cleaned database to cache")
+        except OSError as e:
+            print(f"dbcache: Could not write cache file: {e}")
+
+
+    def clear(self):
+        """ Delete all cache entries.
+        """
+        for entry in self.directory.glob('*.pkl'):
+            os.remove(entry)
+        self._index = {}
+        self._save_index()
+        print("\ndbcache: Cleared database cache")
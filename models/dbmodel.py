@@ -21,10 +21,27 @@ import matplotlib
 matplotlib.use('TkAgg')
 
 # Import system packages
+import copy
 from datetime import datetime
+from functools import partial
+import os
+import re
 
 # Import custom modules
 from models.constants import FieldTypes as FT
+from models import db_schema
+from models import audiomatrix
+from models import audio_dict
+from models import sqlmodel
+from models import filtermodel
+from models import indexmodel
+from models import valuemodel
+from models import batchmodel
+from models import exprmodel
+from models import statsmodel
+from models import fittingmodel
+from models import featuremodel
+from exceptions.db_exceptions import LoadCancelled
 
 
 #########
@@ -35,77 +52,571 @@ class SubDB:
         functions (e.g., get air conduction thresholds)
     """
 
-    def __init__(self, db_path):
-        """ Load database .csv file from path
+    # Number of export rows read and cleaned at a time
+    CHUNK_ROWS = 20000
+
+    # Text columns with at most this many distinct values per row
+    # are stored as categoricals
+    CATEGORY_MAX_RATIO = 0.5
+
+    # Filter attribute for audiogram windows: both ears' air 
+    # conduction thresholds must be within the window
+    AUDIOGRAM = 'Audiogram'
+    WITHIN = 'within'
+
+    # Filter attribute for boolean expressions of filters (see 
+    # exprmodel)
+    EXPRESSION = 'Expression'
+
+
+    def __init__(self, db_path, cache=None):
+        """ Load database .csv file from path. If a DBCache is 
+            provided, cleaned databases are read from and written 
+            to the cache.
         """
+        self.cache = cache
+
+        # Date used to calculate ages (None: today)
+        self.age_ref_date = None
+
+        # Optional SQLite backend
+        self.sql = None
+
+        # Filter steps applied to the unfiltered base database, 
+        # and undone steps that can be redone
+        self.steps = []
+        self._redo = []
+
+        # Rows left by recent filter chains. Results are only 
+        # reused for the same generation of data, which changes 
+        # whenever the base database or ages change.
+        self.filter_cache = filtermodel.FilterCache()
+        self.generation = 0
+
+        # Column indexes for the base database (built on first use
+        # and replaced whenever the base database or ages change)
+        self.indexes = None
+
+        # Column statistics for the base database, for estimating 
+        # filter counts (see statsmodel)
+        self.stats = None
+
+        # Audiogram index over the current data with a SQLite 
+        # backend: (data_version, AudiogramIndex)
+        self._sql_audiograms = None
+
+        # Distinct values of columns in self.data, for the filter 
+        # dropdowns. data_version changes whenever self.data does.
+        self.value_cache = valuemodel.ValueCache()
+        self.data_version = 0
+        self._data = None
+        self._audio = None
+
         self.load_db(db_path)
 
 
+    @property
+    def data(self):
+        """ Current (filtered) database. Built from the base 
+            database and the filter steps on first use after 
+            loading or filtering (with a SQLite backend, matching 
+            rows are fetched).
+        """
+        if self._data is None:
+            self._materialize()
+        return self._data
+
+
+    @property
+    def audio(self):
+        """ Threshold matrix in the same row order as self.data.
+        """
+        if self._audio is None:
+            self._materialize()
+        return self._audio
+
+
+    def _materialize(self):
+        """ Build self.data and self.audio for the current filter 
+            steps.
+        """
+        if self.sql is not None:
+            self._fetch()
+            return
+
+        rows = self._rows()
+        if rows is None:
+            self._data = self.base
+            self._audio = self.base_audio
+        else:
+            rows = rows.positions()
+            self._data = self.base.iloc[rows]
+            self._audio = self.base_audio.take(rows)
+
+
+    def _invalidate(self):
+        """ Mark the filtered data as out of date.
+        """
+        self.data_version += 1
+        self._data = None
+        self._audio = None
+        self._row_index = None
+
+
+    def count(self):
+        """ Return the number of remaining candidates, without 
+            building the filtered database.
+        """
+        if self.steps:
+            return self.steps[-1]['count']
+        return self.base_count()
+
+
+    def base_count(self):
+        """ Return the number of candidates before filtering.
+        """
+        if self.sql is not None:
+            return self.sql.count([])
+        return self.base.shape[0]
+
+
+    def value_list(self, colname):
+        """ Return a valuemodel.ValueList of the distinct values 
+            of colname in the current data (cached until the data 
+            change). For the audiogram attribute, lists the window 
+            presets with the number of candidates within each.
+        """
+        if colname == self.AUDIOGRAM:
+            return self.value_cache.get(self.data_version, colname,
+                lambda: {name: int(self._audiogram_keep(self.audio, None,
+                    self.WITHIN, name).sum()) 
+                    for name in audio_dict.presets})
+        return self.value_cache.get(self.data_version, colname, 
+            lambda: self.data[colname])
+
+
+    def column_names(self):
+        """ Return the database column names, plus the audiogram 
+            window filter attribute.
+        """
+        if self.sql is not None:
+            return list(self.sql.kinds) + list(self.sql.DERIVED) + \
+                [self.AUDIOGRAM]
+        return list(self.base.columns) + [self.AUDIOGRAM]
+
+
     #################################
     # Import and Clean Raw Database #
     #################################
     def load_db(self, db_path):
+        """ Read, clean and swap in a full database export.
+        """
+        payload = self.read_db(db_path)
+        self.set_data(payload['data'], payload['row_hashes'], 
+            payload['stats'])
+        print("\ndbmodel: Loaded database.")
+        print(f"dbmodel: Remaining candidates: {self.data.shape[0]}")
+
+
+    def set_data(self, data, row_hashes=None, stats=None):
+        """ Replace the current database with a newly loaded one.
+            row_hashes holds the export row hash for each row of 
+            data (full exports only), for use by read_update. 
+            stats is the StatsCatalog of data (built if None).
+            Derived columns (see _derived_columns) are added to 
+            data. Everything is built before the current database 
+            is replaced, so if building fails (e.g., ValueError 
+            from the fitting rules) the current database is kept.
+        """
+        # Threshold matrix in the same row order as data
+        audio = audiomatrix.ThresholdMatrix.from_frame(
+            data, self._audio_col_names())
+
+        # Pro Fit recommendations, receiver fitting ranges and 
+        # audiometric features for every subject, as filterable 
+        # columns (replacing any from an exported database)
+        derived = self._derived_columns(audio)
+        for col, values in derived.items():
+            data[col] = values
+
+        if stats is None:
+            stats = statsmodel.StatsCatalog(data)
+        else:
+            stats.refresh(data, list(derived))
+        indexes = indexmodel.IndexSet(data, audio)
+
+        self._close_sql()
+
+        # Unfiltered database: never changed by filtering, and 
+        # used as the base for updates
+        self.base = data
+        self.base_audio = audio
+        self.row_hashes = row_hashes
+        self.stats = stats
+        self.indexes = indexes
+
+        # Start with no filters
+        self.generation += 1
+        self.steps = []
+        self._redo = []
+        self._invalidate()
+
+
+    def read_db(self, db_path, progress=None, cancel=None):
         """ Read raw database .csv from Star.
             Select desired columns only.
             Clean: convert to numeric, rename cols, fix max thresholds.
+            Uses the cleaned copy from the cache when the file is 
+            unchanged since it was last imported.
+
+            Safe to call from a worker thread: returns a dict of 
+            the cleaned dataframe ('data'), its export row hashes 
+            ('row_hashes') and column statistics ('stats') without 
+            changing self.data. 
+            progress is called as progress(stage, rows). Setting 
+            the cancel threading.Event raises LoadCancelled at the 
+            next chunk.
         """
-        # Import .csv file of database records
-        general_search = pd.read_csv(db_path)
+        if progress is None:
+            progress = lambda stage, rows: None
+
+        # Check for a cached copy of the cleaned database
+        if self.cache is not None:
+            progress("Checking cache...", 0)
+            payload = self.cache.load(db_path)
+            if payload is not None:
+                data = payload['data']
+                # Ages depend on the reference date, so never trust 
+                # cached values
+                data['Age'] = pd.to_numeric(
+                    self._calc_ages(data['Date Of Birth'], 
+                        self.age_ref_date), errors='coerce')
+                stats = payload['stats']
+                stats.refresh(data, ['Age'])
+                progress("Loaded from cache", data.shape[0])
+                return {'data': data, 'row_hashes': payload['row_hashes'],
+                    'stats': stats}
+
+        # Read and clean the export one chunk at a time
+        chunks = []
+        hashes = []
+        rows = 0
+        for chunk in self._read_raw_chunks(db_path):
+            self._check_cancel(cancel, db_path)
+            hashes.append(self._hash_rows(chunk))
+            chunks.append(self._clean_chunk(chunk))
+            rows += chunk.shape[0]
+            progress("Reading export...", rows)
+        short_gen = pd.concat(chunks, ignore_index=True)
+        del chunks
+
+        # Keep numbers in free text columns only if the whole 
+        # column is numeric
+        progress("Cleaning...", rows)
+        self._infer_text_types(short_gen)
 
-        # Define columns of interest
-        desired_cols = [0, 1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 
-                        16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 
-                        29, 30, 31, 32, 33, 34, 35, 36, 38, 40, 42, 49, 51, 
-                        52, 74, 85, 86, 88, 90, 101,102,103,104, 109, 112, 
-                        113, 116, 121, 123, 124, 131, 132, 133, 134, 151, 
-                        154, 155, 158, 163, 164, 165, 166, 170, 172, 173, 
-                        176, 177, 178, 179, 180, 185, 187, 189, 192, 196, 
-                        202, 204]
+        # Calculate age and store in new dataframe column
+        short_gen['Age'] = pd.to_numeric(
+            self._calc_ages(short_gen['Date Of Birth'], self.age_ref_date),
+            errors='coerce')
+        self._check_cancel(cancel, db_path)
+
+        # Store repetitive text columns as category codes
+        self._encode_categories(short_gen)
+
+        # Sort dataframe by subject ID (row hashes follow the rows)
+        progress("Sorting...", rows)
+        short_gen['_hash'] = np.concatenate(hashes)
+        short_gen.sort_values(by='Subject Id', inplace=True)
+        row_hashes = short_gen.pop('_hash').to_numpy()
+        data = short_gen.reset_index(drop=True)
+        del short_gen
+
+        # Column statistics for filter count estimates
+        progress("Summarizing columns...", rows)
+        stats = statsmodel.StatsCatalog(data)
+
+        # Store cleaned database for faster re-imports
+        payload = {'data': data, 'row_hashes': row_hashes, 'stats': stats}
+        if self.cache is not None:
+            progress("Saving to cache...", rows)
+            self.cache.save(db_path, payload)
+
+        return payload
+
+
+    def read_update(self, db_path, progress=None, cancel=None):
+        """ Merge a newer full export into the current unfiltered 
+            database. Rows are matched by Subject Id and compared 
+            by export row hash: only inserted or changed rows are 
+            cleaned, and subjects missing from the new export are 
+            dropped.
+
+            Like read_db, returns a dict ('data', 'row_hashes', 
+            'stats', plus a 'delta' dict of inserted, changed, 
+            deleted and unchanged counts) without changing 
+            self.data. Column statistics are updated with the 
+            removed and new rows rather than rebuilt. Requires a 
+            full export (not a filtered database) to be loaded.
+        """
+        if progress is None:
+            progress = lambda stage, rows: None
+
+        if self.row_hashes is None:
+            raise ValueError("Updates can only be merged into a full " +
+                "database export. Please import a full database first.")
+        base_ids = pd.Index(self.base['Subject Id'])
+        if not base_ids.is_unique:
+            raise ValueError("The current database has duplicate " +
+                "Subject Ids, so rows cannot be matched. Please " +
+                "import the new export as a full database instead.")
+
+        # Compare each export row to the current row with the 
+        # same Subject Id; only clean rows that differ
+        kept = []
+        matched = []
+        chunks = []
+        hashes = []
+        changed = 0
+        rows = 0
+        for chunk in self._read_raw_chunks(db_path):
+            self._check_cancel(cancel, db_path)
+            chunk_hashes = self._hash_rows(chunk)
+            pos = base_ids.get_indexer(chunk['Subject Id'])
+            known = pos >= 0
+            same = known.copy()
+            same[known] = self.row_hashes[pos[known]] == \
+                chunk_hashes[known]
+            kept.append(pos[same])
+            matched.append(pos[known])
+            changed += int((known & ~same).sum())
+            if not same.all():
+                chunks.append(self._clean_chunk(chunk[~same].copy()))
+                hashes.append(chunk_hashes[~same])
+            rows += chunk.shape[0]
+            progress("Comparing export...", rows)
+        kept = np.concatenate(kept)
+        matched = np.unique(np.concatenate(matched))
+
+        cleaned = sum(chunk.shape[0] for chunk in chunks)
+        delta = {
+            'inserted': cleaned - changed,
+            'changed': changed,
+            'deleted': self.base.shape[0] - matched.shape[0],
+            'unchanged': kept.shape[0]
+        }
 
-        # New dataframe with columns of interest only
-        short_gen = general_search[general_search.columns[desired_cols]].copy()
+        progress("Merging...", rows)
+        # Derived columns are recalculated by set_data
+        cols = np.flatnonzero(~self.base.columns.isin(
+            self._derived_names()))
+        frames = [self.base.iloc[kept, cols]]
+        row_hashes = [self.row_hashes[kept]]
+        removed = np.ones(self.base.shape[0], dtype=bool)
+        removed[kept] = False
+        removed = self.base.iloc[np.flatnonzero(removed), cols]
+        new_rows = self.base.iloc[:0, cols]
+        if chunks:
+            new_rows = pd.concat(chunks, ignore_index=True)
+            frames.append(new_rows)
+            row_hashes.append(np.concatenate(hashes))
+
+            # Text columns that are numeric in the current database 
+            # must stay numeric
+            for name in self._text_names():
+                col = db_schema.RENAME.get(name, name)
+                if not pd.api.types.is_numeric_dtype(self.base[col]):
+                    continue
+                try:
+                    new_rows[col] = pd.to_numeric(new_rows[col])
+                except (ValueError, TypeError):
+                    # The column now contains text, which changes 
+                    # its type for every row: clean the whole export
+                    print(f"\ndbmodel: '{col}' now contains text; " +
+                        "re-reading the full export")
+                    return dict(self.read_db(db_path, progress, cancel), 
+                        delta=delta)
+        self._check_cancel(cancel, db_path)
+
+        merged = pd.concat(frames, ignore_index=True)
+        merged['_hash'] = np.concatenate(row_hashes)
+        del frames, chunks
+
+        # Ages of all rows as of the current reference date
+        merged['Age'] = pd.to_numeric(
+            self._calc_ages(merged['Date Of Birth'], self.age_ref_date),
+            errors='coerce')
+
+        # Removed rows may leave text columns that are all numbers
+        self._infer_text_types(merged)
+
+        # Mixing new and current rows undoes categoricals, and 
+        # removed rows leave unused categories behind
+        self._encode_categories(merged)
+        for col in merged.select_dtypes('category').columns:
+            merged[col] = merged[col].cat.remove_unused_categories()
+
+        merged.sort_values(by='Subject Id', inplace=True)
+        row_hashes = merged.pop('_hash').to_numpy()
+        data = merged.reset_index(drop=True)
+        del merged
+        print(f"\ndbmodel: Update merged: {delta}")
+
+        # Update a copy of the column statistics (the current 
+        # database keeps its own); ages of all rows are new
+        progress("Summarizing columns...", rows)
+        stats = copy.deepcopy(self.stats)
+        stats.update(data.drop(columns='Age'), removed, new_rows)
+        stats.refresh(data, ['Age'])
+
+        # Cache the merged database under the new export
+        payload = {'data': data, 'row_hashes': row_hashes, 'stats': stats}
+        if self.cache is not None:
+            progress("Saving to cache...", rows)
+            self.cache.save(db_path, payload)
+
+        return dict(payload, delta=delta)
+
+
+    def _derived_columns(self, audio):
+        """ Return a dict of column name: values calculated from 
+            a threshold matrix: Pro Fit recommendations, receiver 
+            fitting ranges (see fittingmodel) and audiometric 
+            features (see featuremodel).
+        """
+        columns = fittingmodel.recommendation_columns(audio)
+        columns.update(featuremodel.FEATURES.compute(audio))
+        return columns
 
-        # Correct column names
-        short_gen.rename(columns = {
-            'L Pt Bc 1000':'LeftBC 1000',
-            'L Pt Bc 2000':'LeftBC 2000',
-            'L Pt Bc 4000':'LeftBC 4000',
-            'L Pt Bc 500':'LeftBC 500',
-            'RightBC  1000':'RightBC 1000',
-            'RightBC  2000':'RightBC 2000',
-            'RightBC  4000':'RightBC 4000',
-            'Hearing AidUse':'Hearing Aid Use'
-            }, inplace = True
-        )
 
-        # Calculate age and store in new dataframe column
-        short_gen['Age'] = short_gen['Date Of Birth'].apply(
-            lambda x: self._calc_age(x))
+    def _derived_names(self):
+        """ Return the names of the derived columns.
+        """
+        return fittingmodel.column_names() + \
+            featuremodel.FEATURES.names()
+
+
+    def _encode_categories(self, frame):
+        """ Convert text columns with few distinct values (relative 
+            to the number of rows) to categoricals, in place. 
+            Values are unchanged; only the storage differs.
+        """
+        max_distinct = frame.shape[0] * self.CATEGORY_MAX_RATIO
+        for col in frame.columns:
+            if frame[col].dtype != object:
+                continue
+            codes, uniques = pd.factorize(frame[col])
+            if len(uniques) <= max_distinct:
+                frame[col] = pd.Categorical.from_codes(codes, 
+                    categories=uniques)
+
+
+    def _row(self, sub_id):
+        """ Return the row position of sub_id in self.data (and 
+            self.audio). The Subject Id index is built on first use 
+            after each load or filter. Raises IndexError if the 
+            subject is not in the current data.
+        """
+        if self._row_index is None:
+            ids = self.data['Subject Id'].tolist()
+            # Build in reverse so the first of any duplicates wins
+            self._row_index = dict(
+                zip(reversed(ids), range(len(ids) - 1, -1, -1)))
+        try:
+            return self._row_index[sub_id]
+        except (KeyError, TypeError):
+            raise IndexError(f"Subject {sub_id} not found")
 
-        # Coerce columns with numerical data to numeric
-        cols = [0,8,9,10,11,12,13,14,15,16,17,22,23,24,25,26,27,28,29,
-                30,31,36,40,47,48,49,50,51,53,56,57,59,61,62,64,66,67,
-                68,69,71,72,85]
-        short_gen.iloc[:, cols] = short_gen.iloc[:, cols].apply(
-            pd.to_numeric, errors='coerce')
 
-        # Sort dataframe by subject ID
-        self.data = short_gen.sort_values(by='Subject Id').reset_index(
-            drop=True).copy()
+    def _check_cancel(self, cancel, db_path):
+        """ Raise LoadCancelled if cancellation was requested.
+        """
+        if (cancel is not None) and cancel.is_set():
+            print("\ndbmodel: Import cancelled")
+            raise LoadCancelled(db_path)
 
-        # Change all audiogram thresholds above 120 to NaN
-        # Generate column names
+
+    def _text_names(self):
+        """ Return the source names of the free text schema columns.
+        """
+        return [name for name, kind in db_schema.COLUMNS 
+                if kind == db_schema.TEXT]
+
+
+    def _numeric_names(self):
+        """ Return the source names of the numeric schema columns.
+        """
+        return [name for name, kind in db_schema.COLUMNS 
+                if kind == db_schema.NUMERIC]
+
+
+    def _read_raw_chunks(self, db_path):
+        """ Read schema columns from the export in chunks of 
+            CHUNK_ROWS rows. Yields uncleaned dataframe chunks.
+        """
+        # Only parse schema columns: numeric columns are parsed as 
+        # numbers, and text columns are kept as strings
+        reader = pd.read_csv(db_path, 
+            usecols=[name for name, _ in db_schema.COLUMNS],
+            dtype={name: str for name in self._text_names()},
+            na_values={name: [db_schema.NULL_VALUE] 
+                for name in self._numeric_names()},
+            chunksize=self.CHUNK_ROWS)
+
+        with reader:
+            for chunk in reader:
+                yield chunk
+
+
+    def _hash_rows(self, chunk):
+        """ Return a uint64 content hash for each row of an 
+            uncleaned chunk. Identical export rows always hash 
+            to the same value.
+        """
+        return pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+
+    def _clean_chunk(self, chunk):
+        """ Clean an uncleaned chunk in place and return it: 
+            convert to numeric, rename cols, fix max thresholds.
+        """
         audio_cols = self._audio_col_names()
-        # Replace values
-        for col in audio_cols:
-            self.data.loc[self.data[col] > 120, col] = np.NaN
+
+        # Coerce any remaining non-numeric values to NaN
+        for col in self._numeric_names():
+            if chunk[col].dtype == object:
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+
+        # Correct column names
+        chunk.rename(columns=db_schema.RENAME, inplace=True)
+
+        # Change all audiogram thresholds above 120 to NaN
+        thresholds = chunk[audio_cols]
+        chunk[audio_cols] = thresholds.where(
+            ~(thresholds > 120)).astype(float)
 
         # Convert all '%null' values to '-'
-        self.data.replace(to_replace='%null%', value='-', inplace=True)
+        for name in self._text_names():
+            col = db_schema.RENAME.get(name, name)
+            chunk[col] = chunk[col].replace(
+                to_replace=db_schema.NULL_VALUE, value='-')
 
-        # Provide feedback
-        print("\ndbmodel: Loaded database.")
-        print(f"dbmodel: Remaining candidates: {self.data.shape[0]}")
+        return chunk
+
+
+    def _infer_text_types(self, frame):
+        """ Convert text columns that contain only numbers (or 
+            missing values) to numeric, in place.
+        """
+        for name, kind in db_schema.COLUMNS:
+            if kind != db_schema.TEXT:
+                continue
+            col = db_schema.RENAME.get(name, name)
+            try:
+                frame[col] = pd.to_numeric(frame[col])
+            except (ValueError, TypeError):
+                # Column contains text
+                pass
 
 
     def _audio_col_names(self):
@@ -128,36 +639,255 @@ class SubDB:
         return audio_cols
 
 
-    def _calc_age(self, birthdate):
-        """ Convert birthdate to age.
+    def _calc_ages(self, birthdates, ref_date=None):
+        """ Convert a Series of 'month/day/year' birthdates to ages 
+            (in whole years) as of ref_date (default: today). 
+            Unparseable birthdates are marked with '-'.
         """
-        today = datetime.now()
-        x = str(birthdate).split('/')
-        try:
-            birth = datetime(int(x[2]), int(x[0]), int(x[1]))
-            age = int((today - birth).days / 365.2425)
-        except TypeError:
-            age = '-'
-        except IndexError:
-            age = '-'
-        except ValueError:
-            age = '-'
-        return age
+        if ref_date is None:
+            ref_date = datetime.now()
+
+        # Birthdates repeat heavily, so only parse distinct values
+        # (missing values get code -1)
+        codes, uniques = pd.factorize(birthdates)
+
+        # Split into month, day and year fields
+        parts = pd.Series(uniques).astype(str).str.extract(
+            r'^\s*([+-]?\d+)\s*/\s*([+-]?\d+)\s*/\s*([+-]?\d+)\s*(?:/|$)')
+        month, day, year = parts.to_numpy(dtype=float).T
+
+        # Check for impossible dates (e.g., 13/1 or 2/30)
+        valid = ~(np.isnan(month) | np.isnan(day) | np.isnan(year))
+        valid &= (year >= 1) & (year <= 9999) & (month >= 1) & (month <= 12)
+        year = np.where(valid, year, 1970).astype('int64')
+        month = np.where(valid, month, 1).astype('int64')
+        day = np.where(valid, day, 1).astype('int64')
+        months = ((year - 1970) * 12 + (month - 1)).astype('datetime64[M]')
+        month_start = months.astype('datetime64[D]')
+        month_len = ((months + 1).astype('datetime64[D]') - month_start
+            ).astype('int64')
+        valid &= (day >= 1) & (day <= month_len)
+
+        # Whole days elapsed, then whole years
+        births = month_start + (day - 1)
+        days = (np.datetime64(ref_date, 'D') - births).astype('int64')
+        ages = np.trunc(days / 365.2425).astype('int64')
+
+        # Map distinct values back to rows
+        ages = np.append(ages, 0)[codes]
+        valid = np.append(valid, False)[codes]
+
+        # Mark missing/invalid birthdates
+        if valid.all():
+            return pd.Series(ages, index=birthdates.index)
+        marked = np.full(ages.shape, '-', dtype=object)
+        marked[valid] = ages[valid]
+        return pd.Series(marked, index=birthdates.index)
+
+
+    def update_ages(self, ref_date=None):
+        """ Recalculate the 'Age' column as of ref_date 
+            (default: today) without reloading the database.
+
+            The base dataframe, indexes and column statistics are 
+            replaced rather than changed in place, so a count 
+            preview still running on the old ones (see 
+            previewmodel) reads consistent data.
+        """
+        self.age_ref_date = ref_date
+        if self.sql is not None:
+            self._set_sql_ages()
+        else:
+            base = self.base.assign(Age=pd.to_numeric(
+                self._calc_ages(self.base['Date Of Birth'], ref_date), 
+                errors='coerce'))
+            indexes = indexmodel.IndexSet(base, self.base_audio)
+            stats = copy.copy(self.stats)
+            stats.columns = dict(self.stats.columns)
+            stats.refresh(base, ['Age'])
+            self.base, self.indexes, self.stats = base, indexes, stats
+
+        # Age filters may now keep different rows
+        self.generation += 1
+        filters = [step['filter'] for step in self.steps]
+        self.steps = []
+        self.set_filters(filters)
+        if ref_date is None:
+            print("\ndbmodel: Updated ages as of today")
+        else:
+            print(f"\ndbmodel: Updated ages as of {ref_date:%m/%d/%Y}")
 
 
     def load_filtered_db(self, db_path):
         """ Import a previously-exported database.
         """
-        # Import .csv file of database records
-        self.data = pd.read_csv(db_path)
-
-        # Provide feedback
+        self.set_data(self.read_filtered_db(db_path)['data'])
         print("\ndbmodel: Loaded previously exported database.")
         print(f"dbmodel: Remaining candidates: {self.data.shape[0]}")
 
 
+    def read_filtered_db(self, db_path, progress=None, cancel=None):
+        """ Read a previously-exported database in chunks. Like 
+            read_db, returns a dict with the dataframe ('data') 
+            without changing self.data. Exported databases have no 
+            row hashes, so updates cannot be merged into them.
+        """
+        if progress is None:
+            progress = lambda stage, rows: None
+
+        # Import .csv file of database records
+        chunks = []
+        rows = 0
+        with pd.read_csv(db_path, chunksize=self.CHUNK_ROWS) as reader:
+            for chunk in reader:
+                self._check_cancel(cancel, db_path)
+                chunks.append(chunk)
+                rows += chunk.shape[0]
+                progress("Reading database...", rows)
+        data = pd.concat(chunks, ignore_index=True)
+        del chunks
+
+        # Store repetitive text columns as category codes
+        self._encode_categories(data)
+
+        return {'data': data, 'row_hashes': None}
+
+
+    ##################
+    # SQLite Backend #
+    ##################
+    def build_sql(self, db_path, sql_path, progress=None, cancel=None):
+        """ Clean a full database export into an indexed SQLite 
+            database at sql_path, one chunk at a time (the export 
+            is never held in memory).
+
+            Like read_db, safe to call from a worker thread. 
+            Returns a dict with the new database path ('sql_path').
+        """
+        if progress is None:
+            progress = lambda stage, rows: None
+
+        kinds = {}
+        for name, kind in db_schema.COLUMNS:
+            kinds[db_schema.RENAME.get(name, name)] = \
+                sqlmodel.SQLStore.NUMERIC if kind == db_schema.NUMERIC \
+                else sqlmodel.SQLStore.TEXT
+        # Free text columns are numbers if every value is a number
+        numbers = {db_schema.RENAME.get(name, name) 
+                   for name in self._text_names()}
+
+        # Build into a temporary file so a cancelled or failed 
+        # build never leaves a partial database behind
+        temp = sql_path + '.tmp'
+        store = sqlmodel.SQLStore.create(temp, kinds)
+        try:
+            rows = 0
+            for chunk in self._read_raw_chunks(db_path):
+                self._check_cancel(cancel, db_path)
+                self._clean_chunk(chunk)
+                for col in list(numbers):
+                    try:
+                        pd.to_numeric(chunk[col])
+                    except (ValueError, TypeError):
+                        numbers.discard(col)
+                store.append(chunk)
+                rows += chunk.shape[0]
+                progress("Building SQLite database...", rows)
+
+            progress("Creating indexes...", rows)
+            store.finish(numbers)
+            store.close()
+        except BaseException:
+            store.close()
+            os.remove(temp)
+            raise
+
+        os.replace(temp, sql_path)
+        print(f"\ndbmodel: Built SQLite database: {sql_path}")
+        return {'sql_path': sql_path}
+
+
+    def open_sql(self, sql_path):
+        """ Use the SQLite database at sql_path as the data source. 
+            Filters are run in SQLite, and only matching rows are 
+            fetched.
+        """
+        store = sqlmodel.SQLStore(sql_path)
+        if not store.kinds:
+            store.close()
+            raise ValueError(f"{sql_path} is not a Subject Browser " +
+                "SQLite database.")
+
+        self._close_sql()
+        self.sql = store
+        self._set_sql_ages()
+
+        # No in-memory base: updates need a full import
+        self.base = None
+        self.base_audio = None
+        self.row_hashes = None
+        self.indexes = None
+        self.stats = None
+        self.generation += 1
+        self.steps = []
+        self._redo = []
+        self._invalidate()
+        print(f"\ndbmodel: Opened SQLite database: {sql_path}")
+        print(f"dbmodel: Remaining candidates: {self.count()}")
+
+
+    def _close_sql(self):
+        """ Stop using the SQLite backend, if any.
+        """
+        if self.sql is not None:
+            self.sql.close()
+        self.sql = None
+
+
+    def _set_sql_ages(self):
+        """ Give SQLite the age for each distinct birthdate as of 
+            the current reference date.
+        """
+        births = pd.Series(self.sql.distinct('Date Of Birth'), 
+            dtype=object)
+        ages = pd.to_numeric(self._calc_ages(births, self.age_ref_date),
+            errors='coerce').astype(object)
+        ages[ages.isna()] = None
+        self.sql.set_ages(dict(zip(births, ages)))
+
+
+    def _fetch(self):
+        """ Fetch rows matching the current filters from SQLite, 
+            with the same columns and types as the in-memory 
+            database.
+        """
+        data = self.sql.fetch(self._sql_clauses())
+        for col, kind in self.sql.kinds.items():
+            if kind == sqlmodel.SQLStore.TEXT:
+                # Missing text values are NaN, as in read_db
+                data[col] = data[col].where(data[col].notna(), np.nan)
+            else:
+                data[col] = pd.to_numeric(data[col])
+        audio_cols = self._audio_col_names()
+        data[audio_cols] = data[audio_cols].astype(float)
+        data['Age'] = pd.to_numeric(
+            self._calc_ages(data['Date Of Birth'], self.age_ref_date),
+            errors='coerce')
+        self._encode_categories(data)
+
+        self._audio = audiomatrix.ThresholdMatrix.from_frame(
+            data, audio_cols)
+        for col, values in self._derived_columns(self._audio).items():
+            data[col] = values
+        self._data = data
+        self._row_index = None
+
+
     def write(self):
-        """ Save database to .csv"""
+        """ Save database to .csv. Derived columns (see 
+            _derived_names) are calculated again on import, so 
+            they are left out and exports keep the same columns.
+        """
         # Generate date stamp
         now = datetime.now()
         date_stamp = now.strftime("%Y_%b_%d_%H%M")
@@ -179,7 +909,8 @@ class SubDB:
             return
 
         # Write data to .csv file if a valid save path is given
-        self.data.to_csv(save_path, mode='w', index=False)
+        self.data.drop(columns=self._derived_names(), 
+            errors='ignore').to_csv(save_path, mode='w', index=False)
         print("\ndbmodel: Database successfully written to file!")
 
 
@@ -188,48 +919,451 @@ class SubDB:
     #######################
     def filter(self, colname, operator, value):
         """ Apply filters to data.
+
+            Adds a filter step on top of the current steps; the 
+            base database is unchanged. Clears any undone steps.
         """
-        if operator == "equals":
-            self.data = self.data[self.data[colname] == value]
-        if operator == "does not equal":
-            self.data = self.data[self.data[colname] != value]
-        if operator == ">":
-            self.data = self.data[self.data[colname] > value]
-        if operator == ">=":
-            self.data = self.data[self.data[colname] >= value]
-        if operator == "<":
-            self.data = self.data[self.data[colname] < value]
-        if operator == "<=":
-            self.data = self.data[self.data[colname] <= value]
-        if operator == "contains":
-            self.data = self.data[self.data[colname].isin(value)]
-        if operator == "not in":
-            self.data = self.data[~self.data[colname].isin(value)]
+        filters = [step['filter'] for step in self.steps]
+        self.set_filters(filters + [(colname, operator, value)])
         print(f"\ndbmodel: Filtered column '{colname}' for {value}")
-        print(f"dbmodel: Remaining candidates: {self.data.shape[0]}")
 
 
-    # def ac_thresh_filt(self, thresh_dict):
-    #     """ Filter by right/left air conduction thresholds. 
-    #         Expects dict of frequencies with tuple of lower
-    #         and upper threshold limits.
-    #     """
-    #     sides = ["RightAC", "LeftAC"]
-    #     for side in sides:
-    #         for key in thresh_dict:
-    #             # Construct column name
-    #             colname = side + " " + key
-    #             # Remove rows containing "-" (i.e., no data)
-    #             self.data = self.data[self.data[colname] != "-"]
-    #             # Convert column to int
-    #             self.data[colname] = self.data[colname].astype("int")
-    #             # Exclude thresholds above dict value 1
-    #             self.data = self.data[self.data[colname] <= thresh_dict[key][1]]
-    #             # Exclude thresholds below dict value 0
-    #             self.data = self.data[self.data[colname] >= thresh_dict[key][0]]
-
-    #     print("Filtered by provided air conduction threshold limits")
-    #     print(f"Remaining candidates: {self.data.shape[0]}\n")
+    def set_filters(self, filters):
+        """ Replace the filter steps with filters, a list of 
+            (colname, operator, value) tuples, evaluated from the 
+            base database.
+
+            In memory, filters are applied most selective first 
+            (see filtermodel.FilterPlanner; selectivity is exact 
+            for indexed filters and otherwise estimated from the 
+            column statistics in self.stats), equals/does not equal/
+            contains/not in filters on categorical columns use 
+            bitmap indexes, range filters on numeric columns use 
+            sorted indexes (see indexmodel), and the rows left by 
+            earlier chains are reused (see filtermodel.FilterCache), 
+            so only new or edited filters are evaluated. With a 
+            SQLite backend, each filter is compiled to a SQL clause 
+            and filters keep their order.
+
+            Each filter becomes one step, so undo_filter removes 
+            them one at a time. A repeated filter is only evaluated 
+            once; its repeats become steps after the others that 
+            keep the same rows. If any filter fails (e.g., 
+            TypeError), the current steps are kept. Clears any 
+            undone steps.
+
+            Returns: list of (filter, remaining candidates) tuples 
+            in the order the filters were applied.
+        """
+        filters = [tuple(flt) for flt in filters]
+        if self.sql is not None:
+            steps = self._sql_steps(filters)
+        else:
+            planner = self.planner()
+            steps = [
+                {'filter': flt, 'rows': rows, 'clause': None, 
+                    'count': rows.count}
+                for flt, rows in self.filter_cache.run(
+                    planner, filters, self.generation)
+            ]
+            # The cache evaluates repeated filters once
+            seen = set()
+            for flt in filters:
+                norm = filtermodel.FilterCache.normalize(flt)
+                if norm in seen:
+                    steps.append(dict(steps[-1], filter=flt))
+                seen.add(norm)
+
+        self.steps = steps
+        self._redo = []
+        self._invalidate()
+        print(f"\ndbmodel: Applied {len(filters)} filters")
+        print(f"dbmodel: Remaining candidates: {self.count()}")
+        return [(step['filter'], step['count']) for step in steps]
+
+
+    def planner(self):
+        """ Return a FilterPlanner for the base database, or None 
+            with a SQLite backend.
+        """
+        if self.sql is not None:
+            return None
+        planner = filtermodel.FilterPlanner(self.base, self._compare,
+            self.indexes, 
+            {self.AUDIOGRAM: partial(self._audiogram_keep, self.base_audio)},
+            self.stats)
+        planner.virtual[self.EXPRESSION] = partial(
+            self._expression_keep, planner)
+        return planner
+
+
+    def _sql_steps(self, filters):
+        """ Return SQLite filter steps for filters. Steps shared 
+            with the current chain (up to the first difference) 
+            are kept, so their counts are not queried again.
+        """
+        steps = []
+        for step, flt in zip(self.steps, filters):
+            if repr(step['filter']) != repr(flt):
+                break
+            steps.append(step)
+
+        for flt in filters[len(steps):]:
+            clause = self._compile(flt)
+            count = self.sql.count(
+                [step['clause'] for step in steps] + [clause])
+            steps.append({'filter': flt, 'rows': None, 'clause': clause,
+                'count': count})
+        return steps
+
+
+    def _compile(self, flt):
+        """ Return the SQL (sql, params) clause for a filter.
+        """
+        colname, operator, value = flt
+        if colname == self.EXPRESSION:
+            return self._compile_expression(
+                self._expression(operator, value))
+        if colname != self.AUDIOGRAM:
+            return self.sql.compile(colname, operator, value)
+        clauses = [self.sql.compile(col, op, limit)
+            for col, (low, high) in self.audiogram_window(
+                operator, value).items()
+            for op, limit in [(">=", low), ("<=", high)]]
+        return self.sql.combine(clauses)
+
+
+    def _compile_expression(self, node):
+        """ Return the SQL (sql, params) clause for an expression 
+            tree. Missing values never match a filter, so NOT 
+            keeps rows where its clause is NULL.
+        """
+        kind, child = node
+        if kind == 'filter':
+            return self._compile(child)
+        if kind == 'not':
+            sql, params = self._compile_expression(child)
+            return f"NOT COALESCE(({sql}), 0)", params
+        clauses = [self._compile_expression(item) for item in child]
+        if kind == 'and':
+            return self.sql.combine(clauses)
+        sql = ' OR '.join(f"({clause})" for clause, _ in clauses)
+        return sql, [param for _, params in clauses for param in params]
+
+
+    def _rows(self):
+        """ Return the indexmodel.RowSet remaining after the 
+            current steps, or None if there are no filters.
+        """
+        if not self.steps:
+            return None
+        return self.steps[-1]['rows']
+
+
+    def _sql_clauses(self):
+        """ Return the SQL clauses of the current steps.
+        """
+        return [step['clause'] for step in self.steps]
+
+
+    def undo_filter(self):
+        """ Remove the last filter step.
+
+            Returns: the removed filter tuple, or None if there 
+            are no filters.
+        """
+        if not self.steps:
+            return None
+        step = self.steps.pop()
+        self._redo.append(step)
+        self._invalidate()
+        print(f"\ndbmodel: Undid filter {step['filter']}")
+        print(f"dbmodel: Remaining candidates: {self.count()}")
+        return step['filter']
+
+
+    def redo_filter(self):
+        """ Re-apply the last undone filter step.
+
+            Returns: the filter tuple, or None if there is nothing 
+            to redo.
+        """
+        if not self._redo:
+            return None
+        # Undone steps were evaluated on top of the current steps
+        step = self._redo.pop()
+        self.steps.append(step)
+        self._invalidate()
+        print(f"\ndbmodel: Redid filter {step['filter']}")
+        print(f"dbmodel: Remaining candidates: {self.count()}")
+        return step['filter']
+
+
+    def reset_filters(self):
+        """ Remove all filter steps.
+        """
+        self.set_filters([])
+
+
+    def _compare(self, series, operator, value):
+        """ Evaluate a filter operator on a column.
+
+            Returns: boolean numpy array, True for rows to keep.
+        """
+        # Categorical columns: compare the (few) categories once 
+        # and look up the result by each row's integer code
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return self._compare_codes(series, operator, value)
+
+        if operator == "equals":
+            mask = series == value
+        elif operator == "does not equal":
+            mask = series != value
+        elif operator == ">":
+            mask = series > value
+        elif operator == ">=":
+            mask = series >= value
+        elif operator == "<":
+            mask = series < value
+        elif operator == "<=":
+            mask = series <= value
+        elif operator == "contains":
+            mask = series.isin(value)
+        elif operator == "not in":
+            mask = ~series.isin(value)
+        else:
+            # Unknown operator: keep all rows
+            return np.ones(series.shape[0], dtype=bool)
+        return mask.to_numpy(dtype=bool)
+
+
+    def _compare_codes(self, series, operator, value):
+        """ Evaluate a filter operator on a categorical column 
+            using its integer codes.
+        """
+        codes = series.cat.codes.to_numpy()
+        categories = series.cat.categories
+
+        # (Not) equal: a single integer code comparison
+        if operator in ["equals", "does not equal"]:
+            try:
+                code = categories.get_loc(value)
+            except (KeyError, TypeError):
+                # Value is not in this column
+                code = None
+            if isinstance(code, (int, np.integer)):
+                if operator == "equals":
+                    return codes == code
+                return codes != code
+
+        # Other operators: evaluate on the categories (plus NaN 
+        # for missing values) and index the result by code. 
+        # Missing values have code -1, i.e., the last entry.
+        lookup = pd.Series(list(categories) + [np.nan], dtype=object)
+        table = self._compare(lookup, operator, value)
+        return table[codes]
+
+
+    def audiogram_window(self, operator, value):
+        """ Return the audiogram window for a filter value as a 
+            dict of column name: (low, high), covering both ears.
+            value is a preset name from audio_dict, a dict of 
+            frequency: (low, high), or text such as 
+            "250:35-70 4000:60-90".
+        """
+        if operator != self.WITHIN:
+            raise ValueError(f"{self.AUDIOGRAM} filters use the " +
+                f"'{self.WITHIN}' operator.")
+
+        if isinstance(value, str) and (value in audio_dict.presets):
+            window = audio_dict.presets[value]
+        elif isinstance(value, dict):
+            window = value
+        else:
+            window = {}
+            pattern = r'^(\d+):(-?\d+(?:\.\d+)?)-(-?\d+(?:\.\d+)?)$'
+            for part in str(value).replace(',', ' ').split():
+                match = re.match(pattern, part)
+                if match is None:
+                    raise ValueError(f"Cannot read audiogram window " +
+                        f"'{value}'. Use a preset name or frequency:" +
+                        "low-high pairs (e.g., 250:35-70 4000:60-90).")
+                window[match[1]] = (float(match[2]), float(match[3]))
+            if not window:
+                raise ValueError("The audiogram window is empty.")
+
+        audio_cols = self._audio_col_names()
+        columns = {}
+        for side in ['RightAC ', 'LeftAC ']:
+            for freq, (low, high) in window.items():
+                col = side + str(freq)
+                if col not in audio_cols:
+                    raise ValueError(f"No air conduction thresholds " +
+                        f"at {freq} Hz.")
+                columns[col] = (low, high)
+        return columns
+
+
+    def _audiogram_keep(self, audio, positions, operator, value):
+        """ Return a boolean array, True for the rows of audio (a 
+            ThresholdMatrix; positions selects rows, None: all) 
+            with both ears within an audiogram window.
+        """
+        window = self.audiogram_window(operator, value)
+        keep, _ = audio.window(list(window), 
+            [low for low, _ in window.values()],
+            [high for _, high in window.values()], positions)
+        return keep
+
+
+    def _expression(self, operator, value):
+        """ Return the parsed tree of an expression filter value 
+            (see exprmodel.parse). Raises ValueError for attributes 
+            that cannot be filtered on (e.g., derived columns with 
+            a SQLite backend).
+        """
+        if operator != exprmodel.MATCHES:
+            raise ValueError(f"{self.EXPRESSION} filters use the " +
+                f"'{exprmodel.MATCHES}' operator.")
+        tree = exprmodel.parse(value)
+        known = set(self.column_names())
+        for colname in exprmodel.attributes(tree):
+            if colname not in known:
+                raise ValueError(f"Unknown attribute '{colname}' in " +
+                    "the expression.")
+        return tree
+
+
+    def _expression_keep(self, planner, positions, operator, value):
+        """ Return a boolean array, True for the base row positions 
+            (None: all rows) matching an expression filter.
+        """
+        tree = self._expression(operator, value)
+        rows = None
+        if positions is not None:
+            rows = indexmodel.RowSet(planner.n, positions=positions)
+        kept = exprmodel.ExpressionEvaluator(planner).evaluate(tree, rows)
+        if positions is None:
+            return np.unpackbits(kept.bits(), count=planner.n).astype(bool)
+        return kept.contains(positions)
+
+
+    def audiogram_rejections(self, index):
+        """ Return a dict of column name: number of candidates 
+            outside the window at that column, for the audiogram 
+            window filter at self.steps[index]. Candidates are 
+            those remaining before that step, and may be outside 
+            the window at several columns.
+        """
+        _, operator, value = self.steps[index]['filter']
+        window = self.audiogram_window(operator, value)
+        if self.sql is not None:
+            clauses = [step['clause'] for step in self.steps[:index]]
+            before = self.sql.count(clauses)
+            return {col: before - self.sql.count(clauses + 
+                [self.sql.combine([self.sql.compile(col, ">=", low),
+                    self.sql.compile(col, "<=", high)])])
+                for col, (low, high) in window.items()}
+
+        rows = None
+        if index > 0:
+            rows = self.steps[index - 1]['rows'].positions()
+        _, rejected = self.base_audio.window(list(window),
+            [low for low, _ in window.values()],
+            [high for _, high in window.values()], rows)
+        return dict(zip(window, rejected.tolist()))
+
+
+    #####################
+    # Batch Filter Sets #
+    #####################
+    def batch_filters(self, filter_sets, scrub=()):
+        """ Evaluate several filter sets (dict of name: list of 
+            filters) against the base database without changing 
+            the current filters. scrub filters are applied before 
+            every set. Each distinct filter is evaluated once (see 
+            batchmodel.FilterBatch).
+
+            Returns: batchmodel.BatchResult
+        """
+        if self.sql is None:
+            planner = self.planner()
+            all_rows = indexmodel.RowSet.all(planner.n)
+            def evaluate(flt):
+                return planner.apply(flt, all_rows)
+            ids = self.base['Subject Id'].to_numpy()
+        else:
+            rowids, ids = self.sql.subject_ids()
+            def evaluate(flt):
+                positions = np.searchsorted(rowids, 
+                    self.sql.rowids([self._compile(flt)]))
+                return indexmodel.RowSet(rowids.shape[0], 
+                    positions=positions)
+        return batchmodel.FilterBatch(evaluate, ids).run(
+            filter_sets, scrub)
+
+
+    def compare_fitting_rules(self, tables):
+        """ Evaluate fitting rule tables (list of 
+            fittingmodel.RuleTable) and the default Pro Fit table 
+            for every subject in the base database (the current 
+            data with a SQLite backend), without changing the 
+            recommendation columns.
+
+            Returns: fittingmodel.RuleComparison against the 
+            default table
+        """
+        audio = self.audio if self.sql is not None else self.base_audio
+        return fittingmodel.RuleComparison(
+            [fittingmodel.default_rules()] + list(tables), audio)
+
+
+    ######################
+    # Similar Audiograms #
+    ######################
+    def similar(self, sub_id, k=10, metric='euclidean', min_shared=None):
+        """ Find the k subjects in the current data whose air 
+            conduction audiograms (both ears) are closest to 
+            sub_id's. Only frequencies tested in both subjects 
+            count (see indexmodel.AudiogramIndex for metrics). 
+            Raises IndexError if sub_id is not in the current 
+            data.
+
+            Returns: dataframe of 'Subject Id', 'Distance' (dB) 
+            and 'Frequencies' (number compared), closest first.
+        """
+        columns = [col for col in self._audio_col_names() 
+                   if 'AC' in col]
+        position = self._row(sub_id)
+        target = self.audio.as_float(columns, rows=[position])[0]
+
+        if self.sql is not None:
+            # Index the fetched rows
+            if (self._sql_audiograms is None) or \
+                (self._sql_audiograms[0] != self.data_version):
+                self._sql_audiograms = (self.data_version, 
+                    indexmodel.AudiogramIndex(self.audio, columns))
+            index = self._sql_audiograms[1]
+            ids = self.data['Subject Id']
+            allowed = None
+        else:
+            # Search the base data within the current filters
+            index = self.indexes.audiogram_index(columns)
+            ids = self.base['Subject Id']
+            rows = self._rows()
+            allowed = None
+            if rows is not None:
+                position = rows.positions()[position]
+                allowed = np.unpackbits(rows.bits(), 
+                    count=rows.n).astype(bool)
+
+        positions, distances, shared = index.search(target, k, metric, 
+            allowed, position, min_shared)
+        return pd.DataFrame({
+            'Subject Id': ids.to_numpy()[positions],
+            'Distance': distances,
+            'Frequencies': shared
+        })
 
 
     ##########################
@@ -241,31 +1375,23 @@ class SubDB:
         # Number of subjects
         dstats['n'] = int(self.data.shape[0])
 
-        # 3-frequency PTA: 0.5, 1, 2 kHz
-        # Right
-        r_pta3_all = self.data[['RightAC 500', 'RightAC 1000', 
-                                'RightAC 2000']].mean(axis=1)
-        dstats['r_pta3'] = np.round(r_pta3_all.mean(), 1)
-        # Left
-        l_pta3_all = self.data[['LeftAC 500', 'LeftAC 1000', 
-                                'LeftAC 2000']].mean(axis=1)
-        dstats['l_pta3'] = np.round(l_pta3_all.mean(), 1)
-
-        # 4-frequency PTA: 0.5, 1, 2, 4 kHz
-        # Right
-        r_pta4_all = self.data[['RightAC 500', 'RightAC 1000', 
-                                'RightAC 2000', 'RightAC 4000']].mean(axis=1)
-        dstats['r_pta4'] = np.round(r_pta4_all.mean(), 1)
-        # Left
-        l_pta4_all = self.data[['LeftAC 500', 'LeftAC 1000', 
-                                'LeftAC 2000', 'LeftAC 4000']].mean(axis=1)
-        dstats['l_pta4'] = np.round(l_pta4_all.mean(), 1)
+        # Pure tone averages, calculated when the data were loaded
+        # (see featuremodel)
+        for key, col in [('r_pta3', 'Right PTA3'), ('l_pta3', 'Left PTA3'),
+            ('r_pta4', 'Right PTA4'), ('l_pta4', 'Left PTA4')]:
+            dstats[key] = np.round(self.data[col].mean(), 1)
 
         # Age
         dstats['age_mean'] = np.round(self.data['Age'].mean(axis=0), 1)
         dstats['age_max'] = int(self.data['Age'].max())
         dstats['age_min'] = int(self.data['Age'].min())
 
+        # Subjects within each receiver's fitting range
+        for receiver in fittingmodel.RECEIVER_RANGES:
+            col = fittingmodel.RECEIVER_FIT.format(receiver=receiver)
+            dstats[f"fits_{receiver.lower()}"] = \
+                int((self.data[col] == 'Yes').sum())
+
         # MoCA Total Score
         dstats['moca_mean'] = np.round(
             self.data['MoCA Total Score'].mean(axis=0), 1)
@@ -280,33 +1406,22 @@ class SubDB:
     ######################
     def get_thresholds(self, sub_id):
         """ Make dictionaries of air and bone conduction thresholds.
+            Missing thresholds (or subjects) are None.
         """
-        # Get AC thresholds
-        sides = ["RightAC", "LeftAC"]
-        freqs = [250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000]
+        # Find subject's row in the threshold matrix
+        try:
+            thresholds = self.audio.row(self._row(sub_id))
+        except IndexError:
+            thresholds = dict.fromkeys(self.audio.columns)
+
+        # Split into AC and BC thresholds
         ac = {}
-        for side in sides:
-            for freq in freqs:
-                colname = side + " " + str(freq)
-                try:
-                    ac[side + ' ' + str(freq)] = int(
-                        self.data[self.data['Subject Id'] == sub_id][colname].values[0]
-                    )
-                except:
-                    ac[side + ' ' + str(freq)] = None
-
-        # Get BC thresholds
-        sides = ["RightBC", "LeftBC"]
-        freqs = [500, 1000, 2000, 4000]
         bc = {}
-        for side in sides:
-            for freq in freqs:
-                colname = side + " " + str(freq)
-                try:
-                    bc[side + ' ' + str(freq)] = int(
-                        self.data[self.data['Subject Id'] == sub_id][colname].values[0])
-                except:
-                    bc[side + ' ' + str(freq)] = None
+        for col, value in thresholds.items():
+            if 'AC' in col:
+                ac[col] = value
+            else:
+                bc[col] = value
 
         return ac, bc
 
@@ -325,11 +1440,11 @@ class SubDB:
         left = [x for x in air_data if "Left" in x]
 
         # Create df of right audiogram data
-        df_right = self.data[right]
-        df_right.columns = [int(x.split()[1]) for x in df_right.columns]
+        df_right = pd.DataFrame(self.audio.as_float(right), 
+            columns=[int(x.split()[1]) for x in right])
         # Create df of left audiogram data
-        df_left = self.data[left]
-        df_left.columns = [int(x.split()[1]) for x in df_left.columns]
+        df_left = pd.DataFrame(self.audio.as_float(left), 
+            columns=[int(x.split()[1]) for x in left])
         # Concatenate left/right audiogram thresholds dfs
         thresholds = pd.concat([df_right, df_left]).reset_index(drop=True)
 
@@ -407,96 +1522,30 @@ class SubDB:
     # Acoustic Coupling Functions #
     ###############################
     def coupling(self, sub_id):
-        """ Calculate Pro Fit recommended coupling, receiver gain, 
-            and vent size. Based on logic from Pro Fit provided by 
-            Laura Woodworth. 
+        """ Return the Pro Fit recommended matrix (receiver gain), 
+            coupling and vent size as dicts of side: value. 
+            Recommendations are calculated for every subject when 
+            data are loaded, from the default fitting rule table 
+            (see fittingmodel). Raises TypeError if the subject's 
+            recommendation cannot be calculated.
         """
-        # Get subject thresholds
-        ac, bc = self.get_thresholds(sub_id)
+        try:
+            row = self._row(sub_id)
+        except IndexError as e:
+            raise TypeError(e)
 
-        # RIC coupling logic
-        sides = ['RightAC ', 'LeftAC ']
+        matrix = {}
         coupling = {}
         vent_size = {}
-        matrix = {}
-
-        for side in sides:
-            # RIC matrix selection logic
-            # Step 1: determine recommendation threshold
-            try:
-                if (ac[side + '2000'] >= ac[side + '500']):
-                    recommendation_threshold = ac[side + '2000']
-                elif (ac[side + '500'] > ac[side + '2000']):
-                    recommendation_threshold = ac[side + '500'] + 10
-            except TypeError:
-                raise TypeError
-
-            # Step 2: choose matrix based on recommendation threshold
-            if recommendation_threshold <= 65:
-                power = 'M'
-                #receiver = 'stock'
-            elif (recommendation_threshold <= 75) and (recommendation_threshold > 65):
-                power = 'P'
-                #receiver = 'stock'
-            elif (recommendation_threshold <= 80) and (recommendation_threshold > 75):
-                power = 'P'
-                #receiver = 'custom cased'
-            elif recommendation_threshold > 80:
-                power = 'UP'
-                #reciever = 'custom cased'
-
-            matrix[side[:-3]] = power
-
-            # RIC acoustic coupling logic
-            # This is partly based on the matrix recommendation from above
-            try:
-                # Open dome
-                if (ac[side + '250'] and ac[side + '500'] < 30) \
-                    and (ac[side + '1000'] <= 60) \
-                    and (matrix[side[:-3]] in ['S', 'M', 'P']):
-                        coupling[side[:-3]] = 'Open Dome'
-
-                # Occluded dome
-                elif (ac[side + '250'] or ac[side + '500'] > 30) \
-                    and (ac[side + '250'] and ac[side + '500'] <= 50) \
-                    and (ac[side + '1000'] <= 60) \
-                    and (matrix[side[:-3]] in ['S', 'M', 'P']):
-                        coupling[side[:-3]] = 'Occluded Dome'
-
-                # Earmolds
-                # Dome unless...
-                elif (ac[side + '250'] or ac[side + '500'] > 50):
-                    coupling[side[:-3]] = 'Earmold'
-
-                # Earmold
-                elif (ac[side + '1000'] > 60):
-                    coupling[side[:-3]] = 'Earmold'
-
-                # Earmold
-                elif matrix == 'UP':
-                    coupling[side[:-3]] = 'Earmold'
-
-                # Cannot categorize
-                else:
-                    coupling[side[:-3]] = 'Error!'
-
-            except TypeError:
-                coupling[side[:-3]] = '-'
-
-            # RIC (and custom) vent size
-            if coupling[side[:-3]] == 'Earmold':
-                # Get average threshold at 500 and 1000 Hz
-                avg500_1k = np.mean([ac[side + '500'], ac[side + '1000']])
-                if avg500_1k <= 40:
-                    vent_size[side[:-3]] = 'Large'
-                elif avg500_1k < 55:
-                    vent_size[side[:-3]] = 'Medium'
-                elif avg500_1k >= 55:
-                    vent_size[side[:-3]] = 'Small'
-                else:
-                    vent_size[side[:-3]] = 'Models_322: Calculation Error!'
-            else:
-                vent_size[side[:-3]] = 'NA'
+        for side in ['Right', 'Left']:
+            matrix[side] = self.data[
+                fittingmodel.MATRIX.format(side=side)].iloc[row]
+            coupling[side] = self.data[
+                fittingmodel.COUPLING.format(side=side)].iloc[row]
+            vent_size[side] = self.data[
+                fittingmodel.VENT.format(side=side)].iloc[row]
+            if matrix[side] == fittingmodel.default_rules().failed_value:
+                raise TypeError(f"Missing thresholds for subject {sub_id}")
 
         return matrix, coupling, vent_size
 
@@ -509,7 +1558,8 @@ class SubDB:
 
         # Attempt to parse study name and dates
         # Multiple pieces of information in a single cell...
-        latest_study = self.data[self.data['Subject Id'] == record]['Latest Study'].values[0]
+        row = self._row(record)
+        latest_study = self.data['Latest Study'].iloc[row]
         study_dates = [z.split(')')[0] for z in latest_study.split('(') if ')' in z]
         try:
             study_dates = study_dates[0]
@@ -551,11 +1601,11 @@ class SubDB:
             try:
                 if dict[key] in ['Age', 'Miles From Starkey', 'Right Ric Cable Size', 'Left Ric Cable Size']:
                     try:
-                        self._vars[key].set(int(self.data[self.data['Subject Id'] == record][dict[key]].values[0]))
+                        self._vars[key].set(int(self.data[dict[key]].iloc[row]))
                     except ValueError as e:
                         self._vars[key].set('-')
                 else:
-                    self._vars[key].set(self.data[self.data['Subject Id'] == record][dict[key]].values[0])
+                    self._vars[key].set(self.data[dict[key]].iloc[row])
             except KeyError as e:
                 print(f"dbmodel: KeyError: value not in list{e}")
 
@@ -0,0 +1,343 @@
+""" Boolean filter expressions for the Subject Browser.
+
+    Parses expressions that combine filters with AND, OR, NOT and
+    parentheses, e.g.:
+
+        ("RightAC 1000" <= 40 OR "LeftAC 1000" <= 40) AND
+            NOT Status = Inactive
+
+    into a tree, and evaluates the tree over the base database
+    with a filtermodel.FilterPlanner. Groups are evaluated
+    cheapest and most decisive first, and stop early: AND only
+    compares the rows kept by the clauses before it, and OR only
+    the rows not yet matched.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+from functools import lru_cache
+import re
+
+# Import data science packages
+import numpy as np
+
+# Import custom modules
+from models import indexmodel
+
+
+#########
+# BEGIN #
+#########
+# Operator for expression filters: (EXPRESSION, MATCHES, text)
+MATCHES = 'matches'
+
+# Comparison symbols and words: filter operator
+OPERATORS = {
+    '=': 'equals', '==': 'equals', '!=': 'does not equal',
+    '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+    'equals': 'equals', 'contains': 'contains', 'in': 'contains',
+    'within': 'within', 'does not equal': 'does not equal',
+    'not in': 'not in'
+}
+
+# Operators taking a list of values
+LIST_OPERATORS = ['contains', 'not in']
+
+TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?(?![^\s()\[\],]))
+        |"(?P<dquote>(?:[^"]|"")*)"
+        |'(?P<squote>(?:[^']|'')*)'
+        |(?P<symbol><=|>=|!=|==|[=<>()\[\],])
+        |(?P<word>[^\s()\[\],"'<>=!]+)
+    )''', re.VERBOSE)
+
+
+def _tokenize(text):
+    """ Return a list of (kind, value, position) tokens.
+    """
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f"Cannot read expression at position " +
+                f"{pos + 1}: '{text[pos:pos + 10]}'")
+        kind = match.lastgroup
+        value = match.group(kind)
+        position = match.start(kind) + 1
+        if kind == 'number':
+            value = float(value)
+        elif kind == 'dquote':
+            kind, value = 'string', value.replace('""', '"')
+        elif kind == 'squote':
+            kind, value = 'string', value.replace("''", "'")
+        tokens.append((kind, value, position))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """ Recursive descent parser (NOT binds tightest, then AND,
+        then OR).
+    """
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+
+    def _peek(self, ahead=0):
+        if self.pos + ahead < len(self.tokens):
+            return self.tokens[self.pos + ahead]
+        return (None, None, None)
+
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+
+    def _error(self, message):
+        _, value, position = self._peek()
+        if value is None:
+            raise ValueError(f"{message} at the end of the expression.")
+        raise ValueError(f"{message} at position {position} ('{value}').")
+
+
+    def _keyword(self, word, ahead=0):
+        kind, value, _ = self._peek(ahead)
+        return (kind == 'word') and (value.upper() == word)
+
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("The expression is empty.")
+        node = self._or()
+        if self.pos < len(self.tokens):
+            self._error("Expected AND, OR or the end of the expression")
+        return node
+
+
+    def _or(self):
+        children = [self._and()]
+        while self._keyword('OR'):
+            self._next()
+            children.append(self._and())
+        return children[0] if len(children) == 1 else ('or', children)
+
+
+    def _and(self):
+        children = [self._not()]
+        while self._keyword('AND'):
+            self._next()
+            children.append(self._not())
+        return children[0] if len(children) == 1 else ('and', children)
+
+
+    def _not(self):
+        if self._keyword('NOT'):
+            self._next()
+            return ('not', self._not())
+        if self._peek()[:2] == ('symbol', '('):
+            self._next()
+            node = self._or()
+            if self._next()[:2] != ('symbol', ')'):
+                self.pos -= 1
+                self._error("Expected ')'")
+            return node
+        return self._filter()
+
+
+    def _filter(self):
+        # Attribute: quoted text or one word
+        kind, colname, _ = self._peek()
+        if kind not in ['string', 'word']:
+            self._error("Expected an attribute")
+        self._next()
+
+        # Operator: symbol or words
+        kind, value, _ = self._peek()
+        operator = None
+        if kind == 'symbol':
+            operator = OPERATORS.get(value)
+        elif kind == 'word':
+            for words in [3, 2, 1]:
+                text = ' '.join(str(self._peek(ii)[1]).lower()
+                    for ii in range(words))
+                if (text in OPERATORS) and all(self._peek(ii)[0] == 'word'
+                    for ii in range(words)):
+                    operator = OPERATORS[text]
+                    self.pos += words - 1
+                    break
+        if operator is None:
+            self._error(f"Expected an operator after '{colname}'")
+        self._next()
+
+        value = self._value()
+        if (operator in LIST_OPERATORS) and not isinstance(value, list):
+            value = [value]
+        return ('filter', (colname, operator, value))
+
+
+    def _value(self):
+        kind, value, _ = self._peek()
+        if (kind == 'symbol') and (value == '['):
+            self._next()
+            values = []
+            while self._peek()[:2] != ('symbol', ']'):
+                values.append(self._value())
+                if self._peek()[:2] == ('symbol', ','):
+                    self._next()
+            self._next()
+            return values
+        if kind not in ['number', 'string', 'word']:
+            self._error("Expected a value")
+        self._next()
+        return value
+
+
+@lru_cache(maxsize=64)
+def parse(text):
+    """ Parse an expression into a tree of nodes:
+            ('filter', (colname, operator, value))
+            ('not', node)
+            ('and', [nodes]) / ('or', [nodes])
+
+        Attributes with spaces and text values with spaces or
+        symbols must be quoted ("..." or '...'). Lists (for
+        contains/not in) are written [a, b, c]. Raises ValueError
+        if the expression cannot be read.
+    """
+    return _Parser(str(text)).parse()
+
+
+def attributes(node):
+    """ Return the attribute names used in an expression tree, in
+        order of first use.
+    """
+    kind, child = node
+    if kind == 'filter':
+        return [child[0]]
+    if kind == 'not':
+        return attributes(child)
+    names = []
+    for item in child:
+        names += attributes(item)
+    return list(dict.fromkeys(names))
+
+
+class ExpressionEvaluator:
+    """ Evaluate expression trees over base rows.
+
+        Each group is ordered by estimated cost and selectivity
+        (with each filter's selectivity from the planner,
+        assuming filters are independent): AND evaluates first the
+        clauses that remove the most rows for their cost, and OR
+        first the clauses that match the most rows for their cost.
+    """
+    # Relative cost per row of an indexed filter (compared
+    # filters cost 1)
+    INDEXED_COST = 0.05
+
+
+    def __init__(self, planner):
+        """ planner: filtermodel.FilterPlanner for the base database
+        """
+        self.planner = planner
+
+
+    def _estimate(self, node, sample, memo):
+        """ Return (cost, selectivity) of a node: the cost per row
+            passed to it, and the fraction of those rows it keeps.
+        """
+        if id(node) in memo:
+            return memo[id(node)]
+        kind, child = node
+        if kind == 'filter':
+            indexes = self.planner.indexes
+            cost = 1.0
+            if (indexes is not None) and \
+                (child[0] not in self.planner.virtual) and \
+                (indexes.count(*child) is not None):
+                cost = self.INDEXED_COST
+            estimate = (cost, self.planner.selectivity(child, sample))
+        elif kind == 'not':
+            cost, selectivity = self._estimate(child, sample, memo)
+            estimate = (cost, 1 - selectivity)
+        else:
+            # Groups: expected cost of evaluating in order
+            cost, passed = 0.0, 1.0
+            for item_cost, item_selectivity in \
+                self._order(node, sample, memo)[1]:
+                cost += passed * item_cost
+                if kind == 'and':
+                    passed *= item_selectivity
+                else:
+                    passed *= 1 - item_selectivity
+            estimate = (cost, passed if kind == 'and' else 1 - passed)
+        memo[id(node)] = estimate
+        return estimate
+
+
+    def _order(self, node, sample, memo):
+        """ Return a group's children in evaluation order, with
+            their (cost, selectivity) estimates.
+        """
+        kind, children = node
+        estimates = [self._estimate(item, sample, memo) 
+            for item in children]
+
+        def _rank(ii):
+            cost, selectivity = estimates[ii]
+            # Fraction of rows decided by this clause
+            decided = (1 - selectivity) if kind == 'and' else selectivity
+            return cost / decided if decided > 0 else np.inf
+
+        order = sorted(range(len(children)), key=_rank)
+        return [children[ii] for ii in order], \
+            [estimates[ii] for ii in order]
+
+
+    def evaluate(self, node, rows=None):
+        """ Return the RowSet of rows (a RowSet; None: all base
+            rows) matching the expression tree.
+        """
+        if rows is None:
+            rows = indexmodel.RowSet.all(self.planner.n)
+        return self._evaluate(node, rows, self.planner.sampler(rows), {})
+
+
+    def _evaluate(self, node, rows, sample, memo):
+        kind, child = node
+        if rows.count == 0:
+            return rows
+        if kind == 'filter':
+            return self.planner.apply(child, rows)
+        if kind == 'not':
+            return rows.difference(
+                self._evaluate(child, rows, sample, memo))
+
+        children, _ = self._order(node, sample, memo)
+        if kind == 'and':
+            for item in children:
+                rows = self._evaluate(item, rows, sample, memo)
+                if rows.count == 0:
+                    break
+            return rows
+
+        # OR: only rows not yet matched are passed on
+        matched = indexmodel.RowSet(rows.n,
+            positions=np.array([], dtype=np.int64))
+        for item in children:
+            found = self._evaluate(item, rows, sample, memo)
+            matched = matched.union(found)
+            rows = rows.difference(found)
+            if rows.count == 0:
+                break
+        return matched
@@ -0,0 +1,176 @@
+""" Derived audiometric features for the Subject Browser.
+
+    Computes measures derived from the audiogram thresholds (pure
+    tone averages, high frequency PTA, interaural asymmetry,
+    air-bone gap and slope) for every subject at once over the
+    threshold matrix. Each feature lists the threshold columns or
+    earlier features it uses, so features are computed once, in
+    order, sharing intermediate results, and the threshold
+    columns behind any feature can be looked up.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+SIDES = ['Right', 'Left']
+
+
+class Feature:
+    """ One derived measure.
+
+        name: column name
+        inputs: threshold column names and names of earlier
+            features used
+        compute: function(*arrays) returning a float array, called
+            with the thresholds (float, NaN if missing) or feature
+            values of each input
+    """
+    def __init__(self, name, inputs, compute):
+        self.name = name
+        self.inputs = list(inputs)
+        self.compute = compute
+
+
+def _mean(*values):
+    """ Mean per subject, ignoring missing values (NaN if all are
+        missing). Matches ThresholdMatrix.row_means.
+    """
+    values = np.column_stack(values)
+    counts = np.sum(~np.isnan(values), axis=1)
+    sums = np.nansum(values, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def _gap(*values):
+    """ Mean air-bone gap: the first half of values are air
+        conduction thresholds, the second half the bone
+        conduction thresholds at the same frequencies. Only
+        frequencies with both are used.
+    """
+    half = len(values) // 2
+    gaps = np.column_stack(values[:half]) - np.column_stack(values[half:])
+    return _mean(*gaps.T)
+
+
+def _slope(octaves):
+    """ Return a function giving the threshold change in dB per
+        octave from a lower to a higher frequency, octaves apart.
+    """
+    return lambda low, high: (high - low) / octaves
+
+
+class FeatureEngine:
+    """ Ordered set of features with their dependencies.
+    """
+    def __init__(self, features):
+        """ features: list of Feature, each only using threshold
+            columns and features listed before it.
+        """
+        self.features = {}
+        for feature in features:
+            if feature.name in self.features:
+                raise ValueError(f"Feature '{feature.name}' is " +
+                    "defined twice")
+            self.features[feature.name] = feature
+
+
+    def names(self):
+        """ Return the feature names in order.
+        """
+        return list(self.features)
+
+
+    def dependencies(self, name):
+        """ Return the threshold columns a feature depends on,
+            directly or through other features.
+        """
+        columns = []
+        for item in self.features[name].inputs:
+            if item in self.features:
+                columns += self.dependencies(item)
+            else:
+                columns.append(item)
+        return list(dict.fromkeys(columns))
+
+
+    def compute(self, audio, names=None):
+        """ Compute features for every subject in audio (an
+            audiomatrix.ThresholdMatrix). names: features to
+            return (None: all). Features they use are computed
+            once and shared, and the threshold columns they depend
+            on are read from audio in one pass.
+
+            Returns: dict of feature name: float array
+        """
+        if names is None:
+            names = self.names()
+        wanted = set(names)
+        for name in names:
+            wanted |= self._used(name)
+
+        columns = []
+        for name in names:
+            columns += self.dependencies(name)
+        columns = list(dict.fromkeys(columns))
+        thresholds = dict(zip(columns, audio.as_float(columns).T))
+
+        values = {}
+        for name, feature in self.features.items():
+            if name not in wanted:
+                continue
+            args = [values[item] if item in self.features
+                    else thresholds[item] for item in feature.inputs]
+            values[name] = feature.compute(*args)
+        return {name: values[name] for name in names}
+
+
+    def _used(self, name):
+        """ Return the features a feature uses, directly or
+            through other features.
+        """
+        used = set()
+        for item in self.features[name].inputs:
+            if item in self.features:
+                used.add(item)
+                used |= self._used(item)
+        return used
+
+
+def _features():
+    """ Return the default features.
+    """
+    features = []
+    for side in SIDES:
+        ac = lambda freqs: [f"{side}AC {freq}" for freq in freqs]
+        bc = lambda freqs: [f"{side}BC {freq}" for freq in freqs]
+        features += [
+            # Mean air conduction thresholds
+            Feature(f"{side} PTA3", ac([500, 1000, 2000]), _mean),
+            Feature(f"{side} PTA4", ac([500, 1000, 2000, 4000]), _mean),
+            Feature(f"{side} HF PTA", ac([2000, 4000, 8000]), _mean),
+            # Mean air-bone gap from 500 to 4000 Hz
+            Feature(f"{side} Air-Bone Gap",
+                ac([500, 1000, 2000, 4000]) + bc([500, 1000, 2000, 4000]),
+                _gap),
+            # dB per octave from 500 to 4000 Hz
+            Feature(f"{side} Slope", ac([500, 4000]), _slope(3))
+        ]
+    # Difference between right and left PTA4
+    features.append(Feature("PTA4 Asymmetry",
+        ["Right PTA4", "Left PTA4"],
+        lambda right, left: np.abs(right - left)))
+    return features
+
+
+# Features added to every database
+FEATURES = FeatureEngine(_features())
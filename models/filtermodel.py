@@ -0,0 +1,391 @@
+""" Filter planner and filter result cache for the Subject 
+    Browser.
+
+    Evaluates a whole chain of (attribute, operator, value)
+    filters against the unfiltered database in one pass. Filters
+    are ordered by estimated selectivity, so each filter only
+    compares the rows that survived the more selective filters
+    before it, and indexed filters are bitwise operations (see
+    indexmodel). Rows remaining after each part of a chain are 
+    cached, so editing one filter only re-evaluates the filters 
+    that changed.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+from collections import OrderedDict
+
+# Import data science packages
+import numpy as np
+
+# Import custom modules
+from models import indexmodel
+
+
+#########
+# BEGIN #
+#########
+class FilterPlanner:
+    """ Order and evaluate filters over a base dataframe.
+    """
+    # Rows used to estimate the selectivity of each filter
+    SAMPLE_ROWS = 2000
+
+    # Use a sorted index when the range holds at most 1/RANGE_RATIO
+    # of the remaining rows (otherwise comparing is faster)
+    RANGE_RATIO = 8
+
+    # Compare whole columns when at least 1/DENSE_RATIO of the base
+    # rows remain (selecting the rows costs more than comparing)
+    DENSE_RATIO = 4
+
+
+    def __init__(self, base, compare, indexes=None, virtual=None, 
+        stats=None):
+        """ base: unfiltered dataframe
+            compare: function(series, operator, value) returning a
+                boolean numpy array of rows to keep
+            indexes: optional indexmodel.IndexSet for base
+            virtual: optional dict of attribute name: function(
+                positions, operator, value) returning a boolean 
+                numpy array of the base row positions (None: all 
+                rows) to keep, for attributes that are not columns
+            stats: optional statsmodel.StatsCatalog for base
+        """
+        self.base = base
+        self.compare = compare
+        self.indexes = indexes
+        self.virtual = {} if virtual is None else virtual
+        self.stats = stats
+        self.n = base.shape[0]
+
+
+    def _sample(self, rows):
+        """ Return evenly spaced base row positions from a RowSet.
+        """
+        positions = rows.positions()
+        step = max(1, positions.shape[0] // self.SAMPLE_ROWS)
+        return positions[::step]
+
+
+    def sampler(self, rows):
+        """ Return a function returning a sample of rows (a RowSet)
+            for selectivity, taken on first use (i.e., only if a 
+            filter has no index).
+        """
+        sample = []
+        def _sample():
+            if not sample:
+                sample.append(self._sample(rows))
+            return sample[0]
+        return _sample
+
+
+    def selectivity(self, flt, sample):
+        """ Return the fraction of rows kept by flt: exact for 
+            indexed filters, otherwise estimated from the column 
+            statistics or, failing that, from the sample (a 
+            function returning base row positions).
+        """
+        if flt[0] not in self.virtual:
+            if self.indexes is not None:
+                count = self.indexes.count(*flt)
+                if count is not None:
+                    return count / max(1, self.n)
+            if self.stats is not None:
+                estimate = self.stats.selectivity(*flt)
+                if estimate is not None:
+                    return estimate
+        sample = sample()
+        if sample.shape[0] == 0:
+            return 1.0
+        return self._compare_rows(flt, sample).mean()
+
+
+    def _compare_rows(self, flt, positions):
+        """ Return a boolean array, True for the base row positions
+            (None: all rows) kept by flt.
+        """
+        colname, operator, value = flt
+        if colname in self.virtual:
+            return self.virtual[colname](positions, operator, value)
+        series = self.base[colname]
+        if positions is not None:
+            series = series.iloc[positions]
+        return self.compare(series, operator, value)
+
+
+    def _indexed(self, flt, rows):
+        """ Return the RowSet of rows kept by flt using an index, 
+            or None if flt should be compared instead.
+        """
+        if (self.indexes is None) or (flt[0] in self.virtual):
+            return None
+        bits = self.indexes.bitmap(*flt)
+        if bits is not None:
+            return indexmodel.RowSet(self.n, bits=rows.bits() & bits)
+
+        found = self.indexes.bounds(*flt)
+        if found is None:
+            return None
+        index, (start, stop) = found
+        # Few rows in range: intersect sorted row positions
+        if (stop - start) * self.RANGE_RATIO <= rows.count:
+            return rows.intersect(index.positions(start, stop))
+        # Stay a bitmap after bitmap filters
+        if rows.is_bitmap:
+            return indexmodel.RowSet(self.n, 
+                bits=rows.bits() & index.bits(start, stop))
+        return None
+
+
+    def plan(self, filters, rows=None, last=()):
+        """ Return filters ordered from most to least selective
+            (ties keep their original order). rows is the RowSet 
+            to filter (None: all rows). Filters at positions in 
+            last are placed after all others.
+        """
+        if rows is None:
+            rows = indexmodel.RowSet.all(self.n)
+        sample = self.sampler(rows)
+        estimates = [self.selectivity(flt, sample) for flt in filters]
+        order = sorted(range(len(filters)), 
+            key=lambda ii: (ii in last, estimates[ii]))
+        return [filters[ii] for ii in order]
+
+
+    def estimate(self, filters):
+        """ Return the estimated number of rows left after each 
+            filter, in order, without evaluating them (assuming 
+            filters are independent). Estimates after a filter 
+            that cannot be applied (e.g., TypeError) are None.
+        """
+        sample = self.sampler(indexmodel.RowSet.all(self.n))
+        remaining = float(self.n)
+        counts = []
+        for flt in filters:
+            try:
+                remaining *= self.selectivity(flt, sample)
+            except (TypeError, KeyError, ValueError):
+                break
+            counts.append(int(round(remaining)))
+        return counts + [None] * (len(filters) - len(counts))
+
+
+    def run(self, filters, rows=None, last=()):
+        """ Evaluate filters in plan order, starting from a RowSet
+            (None: all base rows). See plan for last.
+
+            Bitmap indexed filters are a bitwise AND with the 
+            current rows (counted by popcount). Range filters that
+            keep few rows intersect the sorted row positions from 
+            a sorted index. Other filters compare only the 
+            remaining rows of one column.
+
+            Returns: list of (filter, rows) tuples in plan order,
+            where rows is the RowSet remaining after that filter.
+        """
+        if rows is None:
+            rows = indexmodel.RowSet.all(self.n)
+
+        results = []
+        for flt in self.plan(filters, rows, last):
+            rows = self.apply(flt, rows)
+            results.append((flt, rows))
+        return results
+
+
+    def apply(self, flt, rows):
+        """ Return the RowSet left after applying one filter to 
+            rows (a RowSet).
+        """
+        indexed = self._indexed(flt, rows)
+        if indexed is not None:
+            return indexed
+
+        if rows.count == self.n:
+            positions = np.flatnonzero(self._compare_rows(flt, None))
+        elif rows.count * self.DENSE_RATIO >= self.n:
+            keep = np.packbits(self._compare_rows(flt, None))
+            return indexmodel.RowSet(self.n, bits=rows.bits() & keep)
+        else:
+            positions = rows.positions()
+            positions = positions[self._compare_rows(flt, positions)]
+        return indexmodel.RowSet(self.n, positions=positions)
+
+
+class FilterCache:
+    """ Least recently used cache of filter results.
+
+        Keys are the data generation plus the set of normalized 
+        filters in a chain (filter order does not change which 
+        rows remain). Each entry holds the (filter, rows) steps 
+        that produced it. Entries share RowSets with the entries 
+        they were built from, and the total size of the distinct 
+        RowSets is kept under MAX_BYTES.
+    """
+    # Memory limit for cached RowSets
+    MAX_BYTES = 64 * 1024 * 1024
+
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+        self.clear()
+
+
+    def clear(self):
+        """ Remove all entries and reset the counters.
+        """
+        self._drop_entries()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evaluated = 0
+
+
+    def _drop_entries(self):
+        """ Remove all entries.
+        """
+        self._entries = OrderedDict()
+        # Distinct RowSets: id -> [RowSet, number of entries]
+        self._arrays = {}
+        self.nbytes = 0
+
+
+    def stats(self):
+        """ Return a dict of counters for tuning.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evaluated': self.evaluated,
+            'entries': len(self._entries),
+            'bytes': self.nbytes
+        }
+
+
+    @staticmethod
+    def normalize(flt):
+        """ Return a hashable, canonical form of a filter: numpy 
+            scalars become Python numbers, whole numbers become 
+            floats, list values are sorted and dict values become 
+            sorted tuples of items.
+        """
+        def _value(val):
+            if isinstance(val, np.generic):
+                val = val.item()
+            if isinstance(val, float) and np.isnan(val):
+                return ('nan',)
+            if isinstance(val, int) and not isinstance(val, bool):
+                return float(val)
+            return val
+
+        colname, operator, value = flt
+        if isinstance(value, dict):
+            value = tuple(sorted((str(key), tuple(val)) 
+                for key, val in value.items()))
+        elif isinstance(value, (list, tuple, set, np.ndarray)):
+            value = tuple(sorted({_value(val) for val in value}, key=repr))
+        else:
+            value = _value(value)
+        return (colname, operator, value)
+
+
+    def _best(self, generation, wanted):
+        """ Return the cached steps for the largest subset of the 
+            normalized filters in wanted, or None.
+        """
+        best = None
+        for (entry_generation, filters), steps in self._entries.items():
+            if (entry_generation != generation) or \
+                not (filters <= wanted):
+                continue
+            if (best is None) or (len(filters) > len(best[0])) or \
+                ((len(filters) == len(best[0])) and 
+                 (steps[-1][1].count < best[1][-1][1].count)):
+                best = (filters, steps)
+        if best is not None:
+            self._entries.move_to_end((generation, best[0]))
+        return best
+
+
+    def _put(self, key, steps):
+        """ Add an entry, then evict least recently used entries 
+            until cached RowSets fit in max_bytes.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = steps
+        for _, rows in steps:
+            known = self._arrays.get(id(rows))
+            if known is None:
+                self._arrays[id(rows)] = [rows, 1]
+                self.nbytes += rows.nbytes
+            else:
+                known[1] += 1
+
+        while (self.nbytes > self.max_bytes) and (len(self._entries) > 1):
+            _, old_steps = self._entries.popitem(last=False)
+            for _, rows in old_steps:
+                known = self._arrays[id(rows)]
+                known[1] -= 1
+                if known[1] == 0:
+                    del self._arrays[id(rows)]
+                    self.nbytes -= rows.nbytes
+
+
+    def run(self, planner, filters, generation):
+        """ Evaluate filters from the base database with planner, 
+            starting from the largest cached subset of the chain. 
+            Filters that were not part of any cached chain (i.e., 
+            new or edited filters) are evaluated last, so the 
+            next edit can reuse everything before them.
+
+            Returns: list of (filter, rows) tuples in the order 
+            the filters were applied (see FilterPlanner.run).
+        """
+        if not filters:
+            return []
+
+        # Results for older data can never be used again
+        if generation != self.generation:
+            self._drop_entries()
+            self.generation = generation
+
+        wanted = frozenset(self.normalize(flt) for flt in filters)
+        best = self._best(generation, wanted)
+        if best is None:
+            self.misses += 1
+            done, steps, rows = frozenset(), [], None
+        else:
+            self.hits += 1
+            done, steps = best
+            rows = steps[-1][1] if steps else None
+
+        # Filters still to evaluate (repeated filters only once)
+        remaining = []
+        seen = set(done)
+        for flt in filters:
+            norm = self.normalize(flt)
+            if norm not in seen:
+                remaining.append(flt)
+                seen.add(norm)
+
+        # Filters that are not part of any cached chain are new 
+        # or edited
+        known = set().union(*(cached for _, cached in self._entries))
+        last = {ii for ii, flt in enumerate(remaining)
+                if self.normalize(flt) not in known}
+
+        steps = list(steps)
+        for flt, new_rows in planner.run(remaining, rows, last):
+            steps.append((flt, new_rows))
+            done = done | {self.normalize(flt)}
+            self._put((generation, done), list(steps))
+        self.evaluated += len(remaining)
+        return steps
@@ -0,0 +1,639 @@
+""" Fitting rule tables for the Subject Browser.
+
+    Fitting recommendations (e.g., the Pro Fit matrix, coupling
+    and vent size) are written as decision tables in .json files
+    (see fitting_rules/pro_fit.json). A table is compiled once
+    into numpy conditions and evaluated for every subject at once
+    over the threshold matrix, so recommendations can be stored
+    as columns and filtered like any other attribute, and
+    alternative tables can be compared across the whole database.
+
+    Table format:
+        name, version, description: identify the table
+        sides: sides to evaluate (e.g., ["Right", "Left"])
+        inputs: dict of input name: threshold column, with {side}
+            replaced by each side (e.g., "{side}AC 500")
+        failed: value of every output column for subjects whose
+            recommendation cannot be calculated
+        steps: list of steps, evaluated in order. Each step has:
+            name: used by the conditions of later steps
+            column: optional output column name (with {side})
+            rules: list of {"when": [conditions], "value": value},
+                tried in order; the first rule whose conditions
+                all pass sets the step's value
+            default: optional value if no rule passes
+            missing: optional value if a condition compares a
+                missing value
+
+    Conditions are [name, operator, value] (operators: <, <=, >,
+    >=, ==, !=, in, not in), [name, "set"] (not missing or 0
+    dB), or {"any": [conditions]}. Values compared against may
+    be {"input": name}. Conditions are checked in order and stop
+    at the first that fails, and comparing a missing value gives
+    the step's missing value. Rule values are text, numbers,
+    {"input": name, "add": number} or {"mean": [names]}. Without
+    a default or missing value, the subject's recommendation
+    fails for both sides.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+from functools import lru_cache
+import json
+from pathlib import Path
+
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+
+#########
+# BEGIN #
+#########
+# Table used for the Pro Fit recommendation columns
+DEFAULT_RULES = Path(__file__).parent / 'fitting_rules' / 'pro_fit.json'
+
+# Column name patterns of the default table
+MATRIX = '{side} Pro Fit Matrix'
+COUPLING = '{side} Pro Fit Coupling'
+VENT = '{side} Pro Fit Vent Size'
+
+# Fitting range of each receiver: the upper edge of its overlay 
+# on the audiogram, as (frequency, dB HL) points joined by 
+# straight lines on the log frequency axis (flat beyond the first 
+# and last points). Thresholds from RANGE_FLOOR up to the edge fit.
+RECEIVER_RANGES = {
+    'L': [(1000, 60), (2000, 70)],
+    'M': [(1000, 70), (2000, 80)],
+    'P': [(1000, 80), (2000, 90)]
+}
+RANGE_FLOOR = -10
+
+# Column name pattern of the fitting range columns
+RECEIVER_FIT = 'Fits {receiver} Receiver'
+
+# Condition operators
+COMPARISONS = {
+    '<': np.less, '<=': np.less_equal,
+    '>': np.greater, '>=': np.greater_equal,
+    '==': np.equal, '!=': np.not_equal
+}
+LIST_OPERATORS = ['in', 'not in']
+SET = 'set'
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class RuleResult:
+    """ Recommendations of one table for every subject.
+
+        columns: dict of output column name: values (pandas
+            Categorical for text steps, float array for numbers)
+        failed: boolean array of subjects whose recommendation
+            failed (the table's failed value in every column)
+        matches: dataframe of the number of subjects decided by
+            each rule of each step, per side
+    """
+    def __init__(self, columns, failed, matches):
+        self.columns = columns
+        self.failed = failed
+        self.matches = matches
+
+
+class RuleTable:
+    """ Decision table compiled to numpy conditions.
+    """
+    def __init__(self, spec, source=None):
+        """ spec: dict in the table format (see module docstring)
+            source: file the table was read from (for messages)
+
+            Raises ValueError if the table cannot be compiled.
+        """
+        self.source = source
+        self.name = 'table'
+        try:
+            self.name = str(spec['name'])
+            self.version = str(spec.get('version', ''))
+            self.description = str(spec.get('description', ''))
+            self.sides = list(spec['sides'])
+            self.inputs = dict(spec['inputs'])
+            self.failed_value = spec.get('failed', '-')
+            steps = list(spec['steps'])
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            self._error(f"missing or invalid entry ({e})")
+
+        # Name of each input and step: 'number' or 'text'
+        self._kinds = {name: 'number' for name in self.inputs}
+        self.steps = []
+        for step in steps:
+            self.steps.append(self._compile_step(step))
+
+
+    @classmethod
+    def load(cls, path):
+        """ Read and compile a table from a .json file.
+        """
+        try:
+            with open(path) as f:
+                spec = json.load(f)
+        except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Fitting rules '{Path(path).name}': " +
+                f"cannot read the file ({e}).")
+        return cls(spec, source=path)
+
+
+    @property
+    def label(self):
+        """ Name and version, e.g., 'Pro Fit 2022-08'.
+        """
+        return f"{self.name} {self.version}".strip()
+
+
+    def _error(self, message):
+        source = Path(self.source).name if self.source else self.name
+        raise ValueError(f"Fitting rules '{source}': {message}.")
+
+
+    def column_names(self):
+        """ Return the output column names, side by side.
+        """
+        return [step['column'].format(side=side) for side in self.sides
+                for step in self.steps if step['column']]
+
+
+    ###########
+    # Compile #
+    ###########
+    def _compile_step(self, step):
+        """ Return a compiled step dict: name, column, kind
+            ('number' or 'text'), categories (text values), rules
+            (list of (conditions, value, rule)), default and
+            missing (value functions, or None).
+        """
+        try:
+            name = str(step['name'])
+            rules = list(step['rules'])
+        except (KeyError, TypeError) as e:
+            self._error(f"a step is missing {e}")
+        if name in self._kinds:
+            self._error(f"'{name}' names two inputs or steps")
+        for rule in rules:
+            if not isinstance(rule, dict) or ('value' not in rule):
+                self._error(f"a rule of step '{name}' has no value")
+
+        # Values (and default and missing values) must all be text
+        # or all numbers
+        literals = [rule['value'] for rule in rules] + \
+            [step[key] for key in ['default', 'missing'] if key in step]
+        texts = [isinstance(value, str) for value in literals]
+        if any(texts) and not all(texts):
+            self._error(f"step '{name}' mixes text and number values")
+        kind = 'text' if any(texts) else 'number'
+
+        compiled = {
+            'name': name,
+            'column': step.get('column'),
+            'kind': kind,
+            'categories': list(dict.fromkeys(literals))
+                if kind == 'text' else None,
+            'default': None,
+            'missing': None,
+            'rules': [],
+            # Rules describing the default and missing values for
+            # match counts
+            'other': {key: {'value': step[key]} 
+                for key in ['default', 'missing'] if key in step}
+        }
+        for rule in rules:
+            if not isinstance(rule.get('when', []), list):
+                self._error(f"step '{name}' has a rule whose 'when' " +
+                    "is not a list of conditions")
+            when = [self._compile_condition(cond, name)
+                    for cond in rule.get('when', [])]
+            compiled['rules'].append((when,
+                self._compile_value(rule['value'], compiled), rule))
+        for key in ['default', 'missing']:
+            if key in step:
+                compiled[key] = self._compile_value(step[key], compiled)
+        self._kinds[name] = kind
+        return compiled
+
+
+    def _check_name(self, name, step, kind=None):
+        if not isinstance(name, str) or (name not in self._kinds):
+            self._error(f"step '{step}' uses '{name}', which is not " +
+                "an input or an earlier step")
+        if (kind is not None) and (self._kinds[name] != kind):
+            self._error(f"step '{step}' uses '{name}' as a {kind}")
+
+
+    def _compile_value(self, value, step):
+        """ Return a function(env, rows) returning the step's
+            values for a boolean row mask (category codes for text
+            steps).
+        """
+        if step['kind'] == 'text':
+            code = step['categories'].index(value)
+            return lambda env, rows: code
+        if _is_number(value):
+            return lambda env, rows: float(value)
+        if isinstance(value, dict) and ('input' in value):
+            name = value['input']
+            self._check_name(name, step['name'], 'number')
+            add = value.get('add', 0)
+            if not _is_number(add):
+                self._error(f"step '{step['name']}' adds {add!r}, " +
+                    "which is not a number")
+            return lambda env, rows: env[name][rows] + add
+        if isinstance(value, dict) and ('mean' in value):
+            names = value['mean']
+            if not (isinstance(names, list) and names and 
+                all(isinstance(name, str) for name in names)):
+                self._error(f"step '{step['name']}' averages " +
+                    f"{names!r}, which is not a list of names")
+            for name in names:
+                self._check_name(name, step['name'], 'number')
+            return lambda env, rows: np.mean(
+                [env[name][rows] for name in names], axis=0)
+        self._error(f"step '{step['name']}' has an invalid value " +
+            f"{value!r}")
+
+
+    def _compile_condition(self, cond, step):
+        """ Return a function(env) returning boolean arrays
+            (passed, missing) for every row.
+        """
+        if isinstance(cond, dict) and isinstance(cond.get('any'), list):
+            parts = [self._compile_condition(part, step)
+                     for part in cond['any']]
+            def _any(env):
+                # Stop at the first condition that passes
+                passed = np.zeros(env['_n'], dtype=bool)
+                missing = np.zeros(env['_n'], dtype=bool)
+                pending = np.ones(env['_n'], dtype=bool)
+                for part in parts:
+                    part_passed, part_missing = part(env)
+                    missing |= pending & part_missing
+                    pending &= ~part_missing
+                    passed |= pending & part_passed
+                    pending &= ~part_passed
+                return passed, missing
+            return _any
+
+        if not isinstance(cond, list) or (len(cond) not in [2, 3]):
+            self._error(f"step '{step}' has an invalid condition " +
+                f"{cond!r}")
+        name = cond[0]
+        self._check_name(name, step)
+        text = self._kinds[name] == 'text'
+        never = lambda env: np.zeros(env['_n'], dtype=bool)
+
+        # Set: not missing and not 0 (never compares)
+        if cond[1:] == [SET]:
+            if text:
+                return lambda env: (env[name] >= 0, never(env))
+            return lambda env: (~np.isnan(env[name]) & (env[name] != 0),
+                never(env))
+        if len(cond) != 3:
+            self._error(f"step '{step}' has an invalid condition " +
+                f"{cond!r}")
+        operator, value = cond[1], cond[2]
+
+        if text:
+            missing = lambda env: env[name] < 0
+            categories = self._categories(name)
+        else:
+            missing = lambda env: np.isnan(env[name])
+
+        if operator in LIST_OPERATORS:
+            if not isinstance(value, list):
+                self._error(f"step '{step}' needs a list of values " +
+                    f"for '{operator}'")
+            if text:
+                value = [categories.index(val) for val in value
+                         if val in categories]
+            keep = operator == 'in'
+            return lambda env: (np.isin(env[name], value) == keep,
+                missing(env))
+
+        if not isinstance(operator, str) or (operator not in COMPARISONS):
+            self._error(f"step '{step}' has an unknown operator " +
+                f"'{operator}'")
+        compare = COMPARISONS[operator]
+
+        if isinstance(value, dict) and ('input' in value):
+            other = value['input']
+            self._check_name(other, step, 'number')
+            if text:
+                self._error(f"step '{step}' compares text step " +
+                    f"'{name}' with a number")
+            return lambda env: (compare(env[name], env[other]),
+                missing(env) | np.isnan(env[other]))
+
+        if text:
+            if operator not in ['==', '!=']:
+                self._error(f"step '{step}' uses '{operator}' with " +
+                    f"text step '{name}'")
+            # Values the step never gives never match
+            code = categories.index(value) if value in categories \
+                else -2
+            return lambda env: (compare(env[name], code), missing(env))
+
+        if not _is_number(value):
+            self._error(f"step '{step}' compares '{name}' with " +
+                f"{value!r}, which is not a number")
+        return lambda env: (compare(env[name], value), missing(env))
+
+
+    def _categories(self, name):
+        """ Return the text values of an earlier step.
+        """
+        for step in self.steps:
+            if step['name'] == name:
+                return step['categories']
+        return []
+
+
+    ############
+    # Evaluate #
+    ############
+    def evaluate(self, audio):
+        """ Evaluate the table for every subject in audio (an
+            audiomatrix.ThresholdMatrix).
+
+            Returns: RuleResult
+        """
+        n = audio.shape[0]
+        failed = np.zeros(n, dtype=bool)
+        outputs = {}
+        matches = []
+        for side in self.sides:
+            columns = [col.format(side=side)
+                       for col in self.inputs.values()]
+            unknown = [col for col in columns if col not in audio.columns]
+            if unknown:
+                self._error(f"unknown threshold columns {unknown}")
+            env = dict(zip(self.inputs, audio.as_float(columns).T))
+            env['_n'] = n
+
+            for step in self.steps:
+                values, step_failed, counts = self._evaluate_step(
+                    step, env, failed)
+                failed |= step_failed
+                env[step['name']] = values
+                if step['column']:
+                    outputs[step['column'].format(side=side)] = \
+                        (step, values)
+                matches.append((side, step, counts))
+
+        columns = {}
+        for col, (step, values) in outputs.items():
+            if step['kind'] == 'text':
+                categories = list(dict.fromkeys(
+                    step['categories'] + [self.failed_value]))
+                codes = values.copy()
+                codes[failed] = categories.index(self.failed_value)
+                columns[col] = pd.Categorical.from_codes(codes,
+                    categories=categories)
+            else:
+                values = values.copy()
+                values[failed] = np.nan
+                columns[col] = values
+        return RuleResult(columns, failed, self._matches(matches))
+
+
+    def _evaluate_step(self, step, env, failed):
+        """ Return the step's values (category codes, -1 where
+            missing, or floats), the subjects whose recommendation
+            it failed, and the number of subjects decided by each
+            rule, the default value and the missing value, and
+            failed.
+        """
+        n = env['_n']
+        if step['kind'] == 'text':
+            values = np.full(n, -1, dtype=np.int16)
+        else:
+            values = np.full(n, np.nan)
+
+        # Subjects no rule has decided yet, and subjects that
+        # compared a missing value
+        pending = ~failed
+        raised = np.zeros(n, dtype=bool)
+        counts = []
+        for when, value, _ in step['rules']:
+            active = pending.copy()
+            for cond in when:
+                passed, missing = cond(env)
+                raised |= active & missing
+                active &= passed & ~missing
+            values[active] = value(env, active)
+            pending &= ~(active | raised)
+            counts.append(int(active.sum()))
+
+        step_failed = np.zeros(n, dtype=bool)
+        for rows, value in [(pending, step['default']),
+            (raised, step['missing'])]:
+            if value is None:
+                step_failed |= rows
+                counts.append(0)
+            else:
+                values[rows] = value(env, rows)
+                counts.append(int(rows.sum()))
+        counts.append(int(step_failed.sum()))
+        return values, step_failed, counts
+
+
+    def _matches(self, matches):
+        """ Return the match count dataframe: one row per rule of
+            each step (then its default value, missing value and
+            failed subjects), one column per side, and the total.
+        """
+        rows = {}
+        for side, step, counts in matches:
+            labels = [(ii + 1, rule) for ii, (_, _, rule)
+                      in enumerate(step['rules'])]
+            labels += [('Default', step['other'].get('default', {})),
+                ('Missing', step['other'].get('missing', {})),
+                ('Failed', {'value': self.failed_value})]
+            for (number, rule), count in zip(labels, counts):
+                key = (step['name'], number)
+                if key not in rows:
+                    rows[key] = {
+                        'Step': step['name'],
+                        'Rule': number,
+                        'When': describe(rule.get('when', [])),
+                        'Value': describe_value(rule.get('value', '')),
+                        'Note': rule.get('note', '')
+                    }
+                rows[key][side] = count
+        matches = pd.DataFrame(list(rows.values()))
+        matches['Total'] = matches[self.sides].sum(axis=1)
+        return matches
+
+
+def describe(conditions):
+    """ Return conditions as text, e.g., '500 < 30 and 1000 <= 60'.
+    """
+    def _describe(cond):
+        if isinstance(cond, dict):
+            return '(' + ' or '.join(_describe(part)
+                for part in cond.get('any', [])) + ')'
+        parts = []
+        for part in cond:
+            if isinstance(part, dict):
+                part = part.get('input', part)
+            parts.append(str(part))
+        return ' '.join(parts)
+    return ' and '.join(_describe(cond) for cond in conditions)
+
+
+def describe_value(value):
+    """ Return a rule value as text, e.g., '500 + 10'.
+    """
+    if isinstance(value, dict) and ('input' in value):
+        add = value.get('add', 0)
+        if add:
+            return f"{value['input']} {'+' if add > 0 else '-'} {abs(add)}"
+        return str(value['input'])
+    if isinstance(value, dict) and ('mean' in value):
+        return f"mean({', '.join(str(name) for name in value['mean'])})"
+    return value
+
+
+class RuleComparison:
+    """ Recommendations of several tables for the same subjects.
+
+        results: dict of table label: RuleResult
+        counts: dataframe of the number of subjects with each
+            value of each output column (rows), per table (columns)
+        changed: dataframe of the number of subjects whose value
+            of each output column differs from the first table's,
+            per other table
+        matches: match counts of every table, with a 'Rule Set'
+            column
+    """
+    def __init__(self, tables, audio):
+        """ tables: list of RuleTable (the first is the reference)
+            audio: audiomatrix.ThresholdMatrix of the subjects
+        """
+        self.results = {}
+        for table in tables:
+            label = table.label
+            # Keep tables with the same name and version apart
+            copies = 1
+            while label in self.results:
+                copies += 1
+                label = f"{table.label} ({copies})"
+            self.results[label] = table.evaluate(audio)
+
+        labels = list(self.results)
+        reference = self.results[labels[0]].columns
+        columns = list(dict.fromkeys(col for result in
+            self.results.values() for col in result.columns))
+
+        counts = {}
+        changed = {}
+        for label, result in self.results.items():
+            counts[label] = pd.concat({col: pd.Series(values).value_counts(
+                dropna=False, sort=False)
+                for col, values in result.columns.items()})
+            changed[label] = pd.Series({col:
+                _differ(result.columns[col], reference[col])
+                if (col in result.columns) and (col in reference)
+                else np.nan for col in columns}, dtype=float)
+        self.counts = pd.DataFrame(counts).fillna(0).astype(int)
+        self.counts.index.names = ['Column', 'Value']
+        self.changed = pd.DataFrame(changed)[labels[1:]].astype('Int64')
+        self.changed.index.name = 'Column'
+        self.matches = pd.concat([result.matches for result in
+            self.results.values()], keys=labels, names=['Rule Set', None])
+        self.matches = self.matches.reset_index(level=0)
+
+
+def _differ(first, second):
+    """ Return the number of rows where two columns differ
+        (missing values match each other).
+    """
+    first = pd.Series(first).astype(object)
+    second = pd.Series(second).astype(object)
+    return int((~((first == second) | (first.isna() & second.isna()))).sum())
+
+
+@lru_cache(maxsize=1)
+def default_rules():
+    """ Return the compiled default (Pro Fit) table.
+    """
+    return RuleTable.load(DEFAULT_RULES)
+
+
+def range_limits(receiver, freqs):
+    """ Return the highest threshold within a receiver's fitting
+        range at each frequency, interpolated along the edge of
+        its overlay.
+    """
+    edge_freqs, edge_levels = zip(*RECEIVER_RANGES[receiver])
+    return np.interp(np.log(freqs), np.log(edge_freqs), edge_levels)
+
+
+def range_columns(audio):
+    """ Return a dict of column name: pandas Categorical, 'Yes' 
+        for subjects whose air conduction thresholds in both ears
+        are all within each receiver's fitting range, otherwise 
+        'No'. Missing thresholds are skipped, but each ear needs 
+        at least one ('-' otherwise).
+    """
+    sides = {}
+    for side in ['Right', 'Left']:
+        columns = [col for col in audio.columns 
+                   if col.startswith(f"{side}AC ")]
+        values = audio.values[:, audio.positions(columns)]
+        sides[side] = (columns, values, values != audio.MISSING)
+    tested = np.logical_and.reduce(
+        [present.any(axis=1) for _, _, present in sides.values()])
+
+    result = {}
+    for receiver in RECEIVER_RANGES:
+        fits = tested.copy()
+        for columns, values, present in sides.values():
+            freqs = [int(col.split()[1]) for col in columns]
+            # Thresholds are whole dB
+            highs = np.floor(range_limits(receiver, freqs))
+            inside = (values >= RANGE_FLOOR) & (values <= highs)
+            fits &= (inside | ~present).all(axis=1)
+        codes = np.where(tested, np.where(fits, 0, 1), 2).astype(np.int8)
+        result[RECEIVER_FIT.format(receiver=receiver)] = \
+            pd.Categorical.from_codes(codes, categories=['Yes', 'No', '-'])
+    return result
+
+
+def column_names():
+    """ Return the names of the default recommendation columns,
+        then the fitting range columns.
+    """
+    return default_rules().column_names() + \
+        [RECEIVER_FIT.format(receiver=receiver) 
+         for receiver in RECEIVER_RANGES]
+
+
+def coupling_columns(audio):
+    """ Return a dict of column name: pandas Categorical of the
+        default table's recommendations (Pro Fit matrix, coupling
+        and vent size) for each side of every subject in audio (an
+        audiomatrix.ThresholdMatrix).
+    """
+    return default_rules().evaluate(audio).columns
+
+
+def recommendation_columns(audio):
+    """ Return the coupling and fitting range columns for every 
+        subject in audio.
+    """
+    columns = coupling_columns(audio)
+    columns.update(range_columns(audio))
+    return columns
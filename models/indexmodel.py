@@ -0,0 +1,503 @@
+""" Row sets and column indexes for the Subject Browser.
+
+    Filter results are RowSets of base row positions, held as a
+    packed bitmap (one bit per base row) and/or sorted positions.
+    Bitmap indexes hold one bitmap per value of a low-cardinality
+    categorical column, so equals/does not equal/contains/not in
+    filters become bitwise AND/OR/NOT, and counts are popcounts.
+    Sorted indexes hold the row positions of a numeric column in
+    value order, so range filters (>, >=, <, <=) and their counts
+    resolve by binary search. Audiogram indexes hold thresholds 
+    laid out for fast nearest neighbor (similar audiogram) scans.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+
+#########
+# BEGIN #
+#########
+# Number of set bits in each byte value
+POPCOUNT = np.array([bin(ii).count('1') for ii in range(256)],
+    dtype=np.uint8)
+
+
+def popcount(bits):
+    """ Return the number of set bits in a packed bitmap.
+    """
+    return int(POPCOUNT[bits].sum(dtype=np.int64))
+
+
+def full_bitmap(n):
+    """ Return a packed bitmap with the first n bits set.
+    """
+    return np.packbits(np.ones(n, dtype=bool))
+
+
+class RowSet:
+    """ Set of base row positions (out of n base rows), held as
+        sorted positions and/or a packed bitmap. The other form
+        is computed when needed but not kept, so nbytes stays
+        accurate.
+    """
+    # Unions and differences of sets holding fewer than 
+    # 1/SPARSE_RATIO of the base rows use sorted positions
+    SPARSE_RATIO = 32
+
+    def __init__(self, n, positions=None, bits=None):
+        self.n = n
+        self._positions = positions
+        self._bits = bits
+        if positions is not None:
+            self.count = positions.shape[0]
+        else:
+            self.count = popcount(bits)
+
+
+    @classmethod
+    def all(cls, n):
+        """ Return the set of all n base rows.
+        """
+        return cls(n, bits=full_bitmap(n))
+
+
+    @property
+    def is_bitmap(self):
+        return self._bits is not None
+
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in [self._positions, self._bits]
+                   if arr is not None)
+
+
+    def positions(self):
+        """ Return the sorted base row positions.
+        """
+        if self._positions is not None:
+            return self._positions
+        return np.flatnonzero(np.unpackbits(self._bits, count=self.n))
+
+
+    def bits(self):
+        """ Return the packed bitmap of the rows.
+        """
+        if self._bits is not None:
+            return self._bits
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self._positions] = True
+        return np.packbits(mask)
+
+
+    def contains(self, positions):
+        """ Return a boolean array, True for the base row positions 
+            (sorted) that are in this set.
+        """
+        if self._bits is not None:
+            keep = (self._bits[positions >> 3] >> (7 - (positions & 7))) & 1
+            return keep.astype(bool)
+
+        # Look up each position in our sorted positions
+        own = self._positions
+        if own.shape[0] == 0:
+            return np.zeros(positions.shape[0], dtype=bool)
+        found = np.minimum(np.searchsorted(own, positions), own.shape[0] - 1)
+        return own[found] == positions
+
+
+    def intersect(self, positions):
+        """ Return the RowSet of positions (sorted base row 
+            positions) that are also in this set.
+        """
+        return RowSet(self.n, positions=positions[self.contains(positions)])
+
+
+    def _sparse(self, count):
+        """ Return True if count rows are few enough to keep as 
+            sorted positions rather than a bitmap.
+        """
+        return count * self.SPARSE_RATIO < self.n
+
+
+    def union(self, other):
+        """ Return the RowSet of rows in this set or other.
+        """
+        if (self._positions is not None) and \
+            (other._positions is not None) and \
+            self._sparse(self.count + other.count):
+            return RowSet(self.n, 
+                positions=np.union1d(self._positions, other._positions))
+        return RowSet(self.n, bits=self.bits() | other.bits())
+
+
+    def difference(self, other):
+        """ Return the RowSet of rows in this set but not in other.
+        """
+        if (self._positions is not None) and self._sparse(self.count):
+            return RowSet(self.n, positions=self._positions[
+                ~other.contains(self._positions)])
+        return RowSet(self.n, bits=self.bits() & ~other.bits())
+
+
+class BitmapIndex:
+    """ One packed bitmap per value of a categorical column, plus
+        one for missing values.
+    """
+    def __init__(self, series):
+        codes = series.cat.codes.to_numpy()
+        self.n = codes.shape[0]
+        self.categories = series.cat.categories
+
+        # Row 0 holds missing values (code -1); row ii + 1 holds
+        # category ii
+        onehot = np.zeros((len(self.categories) + 1, self.n), dtype=bool)
+        onehot[codes + 1, np.arange(self.n)] = True
+        self.bits = np.packbits(onehot, axis=1)
+        self.valid = full_bitmap(self.n)
+
+
+    def _value_bits(self, value):
+        """ Return the bitmap of rows equal to value, or None if 
+            value is not one of the categories.
+        """
+        try:
+            code = self.categories.get_loc(value)
+        except (KeyError, TypeError):
+            # Values that are not categories may still compare 
+            # equal to one (e.g., True and 1.0)
+            return None
+        if not isinstance(code, (int, np.integer)):
+            return None
+        return self.bits[code + 1]
+
+
+    def bitmap(self, operator, value):
+        """ Return the packed bitmap of rows kept by a filter, with
+            the same results as SubDB._compare, or None if the
+            filter cannot be answered from the index.
+        """
+        if operator in ["equals", "does not equal"]:
+            # Missing values never equal anything
+            if isinstance(value, float) and np.isnan(value):
+                matches = np.zeros_like(self.valid)
+            else:
+                matches = self._value_bits(value)
+            if matches is None:
+                return None
+            if operator == "equals":
+                return matches
+            return ~matches & self.valid
+
+        if operator in ["contains", "not in"]:
+            # Leave invalid values to raise in SubDB._compare
+            if isinstance(value, str) or not pd.api.types.is_list_like(value):
+                return None
+            matches = np.zeros_like(self.valid)
+            for val in value:
+                if isinstance(val, float) and np.isnan(val):
+                    val_bits = self.bits[0]
+                else:
+                    val_bits = self._value_bits(val)
+                if val_bits is None:
+                    return None
+                matches |= val_bits
+            if operator == "contains":
+                return matches
+            return ~matches & self.valid
+
+        return None
+
+
+class SortedIndex:
+    """ Row positions of a numeric column sorted by value, with 
+        missing values last.
+    """
+    def __init__(self, series):
+        values = series.to_numpy(dtype=float)
+        self.n = values.shape[0]
+        self.order = np.argsort(values, kind='stable')
+        self.values = values[self.order]
+        # Number of non-missing values
+        self.valid = self.n - int(np.isnan(values).sum())
+
+
+    def bounds(self, operator, value):
+        """ Return (start, stop) such that self.order[start:stop] 
+            holds the rows kept by a range filter, with the same 
+            results as SubDB._compare, or None if the filter cannot 
+            be answered from the index.
+        """
+        if operator not in [">", ">=", "<", "<="]:
+            return None
+        if isinstance(value, np.generic):
+            value = value.item()
+        # Leave other types to compare (or raise) in SubDB._compare
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        # Missing values never match a comparison
+        if np.isnan(value):
+            return (0, 0)
+
+        values = self.values[:self.valid]
+        if operator == ">":
+            return (np.searchsorted(values, value, 'right'), self.valid)
+        if operator == ">=":
+            return (np.searchsorted(values, value, 'left'), self.valid)
+        if operator == "<":
+            return (0, np.searchsorted(values, value, 'left'))
+        return (0, np.searchsorted(values, value, 'right'))
+
+
+    def positions(self, start, stop):
+        """ Return the sorted base row positions in 
+            self.order[start:stop].
+        """
+        return np.sort(self.order[start:stop])
+
+
+    def bits(self, start, stop):
+        """ Return the packed bitmap of the rows in 
+            self.order[start:stop].
+        """
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.order[start:stop]] = True
+        return np.packbits(mask)
+
+
+class AudiogramIndex:
+    """ Nearest neighbor index over audiograms (rows of a 
+        ThresholdMatrix), laid out for exact vectorized scans.
+
+        Distances only use frequencies present in both audiograms:
+            euclidean: root mean square difference (dB)
+            manhattan: mean absolute difference (dB)
+            max: largest absolute difference (dB)
+
+        Thresholds are held one frequency per row (int16, 0 where 
+        missing) with a 0/1 present mask, so a scan is a few 
+        in-place operations over long contiguous arrays for each 
+        of the target's frequencies. Thresholds are whole dB, so 
+        sums are exact.
+    """
+    METRICS = ['euclidean', 'manhattan', 'max']
+
+
+    def __init__(self, audio, columns):
+        """ audio: ThresholdMatrix
+            columns: threshold columns to compare
+        """
+        self.columns = list(columns)
+        values = audio.values[:, audio.positions(self.columns)].T
+        self.n = values.shape[1]
+        present = values != audio.MISSING
+        self.present = np.ascontiguousarray(present.astype(np.int16))
+        self.thresholds = np.ascontiguousarray(
+            np.where(present, values, 0).astype(np.int16))
+
+
+    def _distances(self, rows, dims, target, metric):
+        """ Return (distance, shared frequencies) from target (at 
+            dims) to rows (None: all rows).
+        """
+        n = self.n if rows is None else rows.shape[0]
+        # Differences of int8 thresholds fit in int16, and so do 
+        # sums of a few hundred of them; squares need int32
+        if (metric == 'euclidean') or (dims.shape[0] > 128):
+            total = np.zeros(n, dtype=np.int32)
+        else:
+            total = np.zeros(n, dtype=np.int16)
+        squares = np.empty(n, dtype=np.int32)
+        shared = np.zeros(n, dtype=np.int16)
+        diff = np.empty(n, dtype=np.int16)
+        for dim, value in zip(dims, target):
+            thresholds = self.thresholds[dim]
+            present = self.present[dim]
+            if rows is not None:
+                thresholds, present = thresholds[rows], present[rows]
+            np.subtract(thresholds, value, out=diff)
+            np.multiply(diff, present, out=diff)
+            if metric == 'euclidean':
+                np.multiply(diff, diff, out=squares, dtype=np.int32)
+                np.add(total, squares, out=total)
+            else:
+                np.abs(diff, out=diff)
+                if metric == 'max':
+                    np.maximum(total, diff, out=total)
+                else:
+                    np.add(total, diff, out=total)
+            np.add(shared, present, out=shared)
+
+        if metric == 'max':
+            dist = total.astype(float)
+            dist[shared == 0] = np.nan
+            return dist, shared
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = total / shared
+        if metric == 'euclidean':
+            dist = np.sqrt(dist)
+        return dist, shared
+
+
+    def search(self, target, k, metric='euclidean', allowed=None, 
+        exclude=None, min_shared=None):
+        """ Return the k rows with audiograms closest to target.
+
+            target: thresholds at self.columns (NaN if missing)
+            allowed: optional boolean array, True for rows that 
+                may be returned
+            exclude: optional row position never returned (e.g., 
+                the target's own row)
+            min_shared: fewest target frequencies a row must share 
+                (default: half of the target's frequencies)
+
+            Returns: (positions, distances, shared) arrays, closest 
+            first (ties by row position).
+        """
+        if metric not in self.METRICS:
+            raise ValueError(f"Unknown distance '{metric}'. Choose " +
+                f"from: {', '.join(self.METRICS)}.")
+        target = np.asarray(target, dtype=float)
+        dims = np.flatnonzero(~np.isnan(target))
+        empty = (np.array([], dtype=np.int64), np.array([]), 
+            np.array([], dtype=np.int64))
+        if (dims.shape[0] == 0) or (k < 1):
+            return empty
+        if min_shared is None:
+            min_shared = -(-dims.shape[0] // 2)
+        min_shared = max(1, min(min_shared, dims.shape[0]))
+        target = np.rint(target[dims]).astype(np.int16)
+
+        # Scan only the allowed rows if they are few
+        rows = None
+        if (allowed is not None) and (allowed.sum() * 4 < self.n):
+            rows = np.flatnonzero(allowed)
+        dist, shared = self._distances(rows, dims, target, metric)
+
+        keep = shared >= min_shared
+        if (allowed is not None) and (rows is None):
+            keep &= allowed
+        if exclude is not None:
+            if rows is None:
+                keep[exclude] = False
+            else:
+                keep &= rows != exclude
+        positions = np.flatnonzero(keep)
+        dist, shared = dist[positions], shared[positions]
+        if rows is not None:
+            positions = rows[positions]
+
+        # Rows within the k-th smallest distance, sorted
+        if positions.shape[0] > k:
+            kth = np.partition(dist, k - 1)[k - 1]
+            close = dist <= kth
+            positions, dist, shared = \
+                positions[close], dist[close], shared[close]
+        best = np.lexsort((positions, dist))[:k]
+        return positions[best].astype(np.int64), dist[best], \
+            shared[best].astype(np.int64)
+
+
+class IndexSet:
+    """ Indexes for the columns of one base dataframe, built on
+        first use. Create a new IndexSet whenever the base data
+        change.
+    """
+    # Largest number of distinct values for a bitmap index
+    MAX_BITMAP_VALUES = 64
+
+
+    def __init__(self, base, audio=None):
+        """ base: unfiltered dataframe
+            audio: optional ThresholdMatrix in the same row order
+        """
+        self.base = base
+        self.audio = audio
+        self.n = base.shape[0]
+        self._bitmaps = {}
+        self._sorted = {}
+        self._audiograms = {}
+
+
+    def bitmap_index(self, colname):
+        """ Return the BitmapIndex for colname, or None if the
+            column is not a low-cardinality categorical.
+        """
+        if colname not in self._bitmaps:
+            series = self.base[colname]
+            if isinstance(series.dtype, pd.CategoricalDtype) and \
+                (len(series.cat.categories) <= self.MAX_BITMAP_VALUES):
+                self._bitmaps[colname] = BitmapIndex(series)
+            else:
+                self._bitmaps[colname] = None
+        return self._bitmaps[colname]
+
+
+    def bitmap(self, colname, operator, value):
+        """ Return the packed bitmap of base rows kept by a filter,
+            or None if no index can answer it.
+        """
+        index = self.bitmap_index(colname)
+        if index is None:
+            return None
+        return index.bitmap(operator, value)
+
+
+    def sorted_index(self, colname):
+        """ Return the SortedIndex for colname, or None if the 
+            column is not numeric.
+        """
+        if colname not in self._sorted:
+            dtype = self.base[colname].dtype
+            if pd.api.types.is_numeric_dtype(dtype) and \
+                not pd.api.types.is_bool_dtype(dtype) and \
+                not isinstance(dtype, pd.CategoricalDtype):
+                self._sorted[colname] = SortedIndex(self.base[colname])
+            else:
+                self._sorted[colname] = None
+        return self._sorted[colname]
+
+
+    def bounds(self, colname, operator, value):
+        """ Return (SortedIndex, (start, stop)) for a range filter,
+            or None if no index can answer it.
+        """
+        if operator not in [">", ">=", "<", "<="]:
+            return None
+        index = self.sorted_index(colname)
+        if index is None:
+            return None
+        bounds = index.bounds(operator, value)
+        if bounds is None:
+            return None
+        return index, bounds
+
+
+    def count(self, colname, operator, value):
+        """ Return the number of base rows kept by a filter, or 
+            None if no index can answer it.
+        """
+        bits = self.bitmap(colname, operator, value)
+        if bits is not None:
+            return popcount(bits)
+        found = self.bounds(colname, operator, value)
+        if found is not None:
+            start, stop = found[1]
+            return int(stop - start)
+        return None
+
+
+    def audiogram_index(self, columns):
+        """ Return the AudiogramIndex for threshold columns.
+        """
+        key = tuple(columns)
+        if key not in self._audiograms:
+            self._audiograms[key] = AudiogramIndex(self.audio, columns)
+        return self._audiograms[key]
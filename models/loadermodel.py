@@ -0,0 +1,80 @@
+""" Background database loader.
+
+    Runs a SubDB read function on a worker thread so the Tk 
+    mainloop stays responsive. Progress, completion and errors 
+    are posted to a queue for the controller to poll.
+
+    Written by: Travis M. Moore
+"""
+
+############
+# IMPORTS  #
+############
+# Import system packages
+import threading
+import queue
+
+# Import custom modules
+from exceptions.db_exceptions import LoadCancelled
+
+
+#########
+# BEGIN #
+#########
+class DBLoader:
+    """ Load a database on a worker thread.
+
+        Events are (kind, value) tuples:
+            ('progress', (stage, rows))
+            ('done', payload dict returned by read_func)
+            ('cancelled', None)
+            ('error', exception)
+    """
+    def __init__(self, read_func, db_path):
+        # Assign variables
+        self.read_func = read_func
+        self.db_path = db_path
+
+        # Worker-to-UI event queue and cancel flag
+        self.events = queue.Queue()
+        self._cancel_event = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+        """ Start loading on the worker thread.
+        """
+        print(f"\nloadermodel: Loading {self.db_path}...")
+        self._thread.start()
+
+
+    def cancel(self):
+        """ Ask the worker to stop at the next checkpoint.
+        """
+        print("\nloadermodel: Cancelling load...")
+        self._cancel_event.set()
+
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+
+    def _progress(self, stage, rows):
+        """ Post a progress event from the worker thread.
+        """
+        self.events.put(('progress', (stage, rows)))
+
+
+    def _run(self):
+        """ Worker thread: read database and post the result.
+        """
+        try:
+            data = self.read_func(self.db_path, progress=self._progress, 
+                cancel=self._cancel_event)
+        except LoadCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+        else:
+            self.events.put(('done', data))
@@ -0,0 +1,122 @@
+""" Background candidate count preview.
+
+    Counts the candidates that would remain after each filter row
+    on a worker thread, so counts can be shown while the user edits
+    the filter rows. Rows are applied in order, and rows shared with
+    the previous preview (up to the first edited row) are not
+    evaluated again. Results are posted to a queue for the
+    controller to poll.
+
+    Written by: Travis M. Moore
+"""
+
+############
+# IMPORTS  #
+############
+# Import system packages
+import threading
+import queue
+
+# Import custom modules
+from models.filtermodel import FilterCache
+from models import indexmodel
+
+
+#########
+# BEGIN #
+#########
+class CountPreview:
+    """ Count remaining candidates for a list of filters on a
+        worker thread.
+
+        Events are (kind, value) tuples:
+            ('done', (counts, memo))
+            ('cancelled', None)
+            ('error', exception)
+
+        counts holds the candidates left after each filter, in
+        order. If a filter fails (e.g., TypeError for a mismatched
+        value), its count is the exception and the following counts
+        are None. memo holds the rows left after each filter, to
+        pass to the next CountPreview.
+    """
+    def __init__(self, planner, generation, filters, memo=None):
+        """ planner: filtermodel.FilterPlanner for the base database
+            generation: SubDB.generation of the base database
+            filters: list of (colname, operator, value) tuples
+            memo: memo from the previous preview, or None
+        """
+        # Assign variables
+        self.planner = planner
+        self.generation = generation
+        self.filters = filters
+        self.memo = memo
+
+        # Worker-to-UI event queue and cancel flag
+        self.events = queue.Queue()
+        self._cancel_event = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+        """ Start counting on the worker thread.
+        """
+        self._thread.start()
+
+
+    def cancel(self):
+        """ Ask the worker to stop before the next filter.
+        """
+        self._cancel_event.set()
+
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+
+    def _run(self):
+        """ Worker thread: count and post the result.
+        """
+        try:
+            result = self._count()
+        except Exception as e:
+            self.events.put(('error', e))
+        else:
+            if result is None:
+                self.events.put(('cancelled', None))
+            else:
+                self.events.put(('done', result))
+
+
+    def _count(self):
+        """ Apply the filters in order, reusing rows from the memo
+            up to the first changed filter.
+
+            Returns: (counts, memo) tuple, or None if cancelled.
+        """
+        memo_steps = []
+        if (self.memo is not None) and (self.memo[0] == self.generation):
+            memo_steps = self.memo[1]
+
+        steps = []
+        counts = []
+        rows = indexmodel.RowSet.all(self.planner.n)
+        for ii, flt in enumerate(self.filters):
+            norm = FilterCache.normalize(flt)
+            if (ii < len(memo_steps)) and (len(steps) == ii) and \
+                (memo_steps[ii][0] == norm):
+                rows = memo_steps[ii][1]
+            else:
+                if self._cancel_event.is_set():
+                    return None
+                try:
+                    rows = self.planner.apply(flt, rows)
+                except (TypeError, KeyError, ValueError) as e:
+                    counts.append(e)
+                    counts.extend([None] * (len(self.filters) - ii - 1))
+                    break
+            steps.append((norm, rows))
+            counts.append(rows.count)
+
+        return counts, (self.generation, steps)
@@ -0,0 +1,280 @@
+""" SQLite storage for the Subject Browser.
+
+    Holds a cleaned 'General Search' export in an indexed
+    'subjects' table, so filters run inside SQLite and only
+    matching rows are read into memory. A prepared database file
+    can be shared and re-opened without re-importing the export.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import os
+import sqlite3
+
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+
+#########
+# BEGIN #
+#########
+class SQLStore:
+    """ Read, write and query a subjects SQLite database.
+    """
+    # Table names
+    TABLE = 'subjects'
+    KINDS_TABLE = 'subject_columns'
+
+    # Column kinds
+    NUMERIC = 'numeric'
+    TEXT = 'text'
+    # Free text columns that only hold numbers (compared as numbers)
+    TEXT_NUMBERS = 'text_numbers'
+
+    # Commonly filtered columns
+    INDEXED = [
+        'Subject Id', 'Status', 'Good Candidate', 'Employment Status',
+        'Availability', 'Miles From Starkey', 'Date Of Birth',
+        'RightStyle', 'LeftStyle', 'Right Earmold Style',
+        'Left Earmold Style', 'Smartphone Type', 'MoCA Total Score',
+        'RightAC 1000', 'LeftAC 1000', 'RightAC 4000', 'LeftAC 4000'
+    ]
+
+    # Derived columns: name -> SQL expression
+    AGE_FUNCTION = 'subject_age'
+    DERIVED = {'Age': f'{AGE_FUNCTION}("Date Of Birth")'}
+
+
+    def __init__(self, sql_path):
+        """ Open an existing database file.
+        """
+        self.sql_path = sql_path
+        self.conn = sqlite3.connect(sql_path)
+
+        # Column kinds, in table order
+        try:
+            rows = self.conn.execute(
+                f"SELECT name, kind FROM {self.KINDS_TABLE} ORDER BY rowid")
+            self.kinds = dict(rows.fetchall())
+        except sqlite3.DatabaseError:
+            self.kinds = {}
+
+
+    @classmethod
+    def create(cls, sql_path, kinds):
+        """ Create a new, empty database file at sql_path
+            (replacing any existing file). kinds is a dict of
+            column name: NUMERIC or TEXT, in table order.
+        """
+        if os.path.exists(sql_path):
+            os.remove(sql_path)
+        store = cls(sql_path)
+
+        # NUMERIC affinity stores whole numbers as integers, so
+        # Subject Ids come back as ints
+        types = {cls.NUMERIC: 'NUMERIC', cls.TEXT: 'TEXT'}
+        columns = ', '.join(f"{cls.quote(col)} {types[kind]}"
+            for col, kind in kinds.items())
+        store.conn.execute(f"CREATE TABLE {cls.TABLE} ({columns})")
+        store.conn.execute(
+            f"CREATE TABLE {cls.KINDS_TABLE} (name TEXT, kind TEXT)")
+        store.conn.executemany(
+            f"INSERT INTO {cls.KINDS_TABLE} VALUES (?, ?)", kinds.items())
+        store.kinds = dict(kinds)
+        return store
+
+
+    @staticmethod
+    def quote(name):
+        """ Quote a column name for use in SQL.
+        """
+        return '"' + name.replace('"', '""') + '"'
+
+
+    def close(self):
+        self.conn.close()
+
+
+    ###################
+    # Write Functions #
+    ###################
+    def append(self, chunk):
+        """ Append a cleaned dataframe chunk to the subjects table.
+        """
+        chunk.to_sql(self.TABLE, self.conn, if_exists='append',
+            index=False)
+
+
+    def finish(self, number_columns):
+        """ Mark free text columns that only hold numbers, create
+            indexes on commonly filtered columns and commit.
+        """
+        for col in number_columns:
+            self.kinds[col] = self.TEXT_NUMBERS
+        self.conn.executemany(
+            f"UPDATE {self.KINDS_TABLE} SET kind = ? WHERE name = ?",
+            [(self.TEXT_NUMBERS, col) for col in number_columns])
+
+        for ii, col in enumerate(self.INDEXED):
+            if self.kinds.get(col) in [self.NUMERIC, self.TEXT]:
+                self.conn.execute(f"CREATE INDEX idx_{ii} ON " +
+                    f"{self.TABLE} ({self.quote(col)})")
+
+        # Collect statistics for the query planner
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+
+
+    ###################
+    # Query Functions #
+    ###################
+    def set_ages(self, ages):
+        """ Make Age filters use ages, a dict of birthdate: age
+            (None for missing/invalid birthdates).
+        """
+        self.conn.create_function(self.AGE_FUNCTION, 1, ages.get,
+            deterministic=True)
+
+
+    def distinct(self, col):
+        """ Return a list of the distinct values in col.
+        """
+        rows = self.conn.execute(
+            f"SELECT DISTINCT {self.quote(col)} FROM {self.TABLE}")
+        return [row[0] for row in rows]
+
+
+    def combine(self, clauses):
+        """ Combine (sql, params) clauses into one clause that 
+            matches rows matching all of them.
+        """
+        if not clauses:
+            return '1', []
+        sql = ' AND '.join(f"({clause})" for clause, _ in clauses)
+        params = [param for _, clause_params in clauses
+                  for param in clause_params]
+        return sql, params
+
+
+    def count(self, clauses):
+        """ Return the number of rows matching all clauses.
+        """
+        where, params = self.combine(clauses)
+        return self.conn.execute(
+            f"SELECT COUNT(*) FROM {self.TABLE} WHERE {where}",
+            params).fetchone()[0]
+
+
+    def fetch(self, clauses):
+        """ Return a dataframe of the rows matching all clauses,
+            sorted by Subject Id.
+        """
+        where, params = self.combine(clauses)
+        # Unary + stops SQLite from walking the whole Subject Id 
+        # index to avoid sorting, so filter indexes can be used
+        return pd.read_sql_query(
+            f"SELECT * FROM {self.TABLE} WHERE {where} " +
+            f"ORDER BY +{self.quote('Subject Id')}, rowid",
+            self.conn, params=params)
+
+
+    def rowids(self, clauses):
+        """ Return a sorted array of the rowids of the rows 
+            matching all clauses.
+        """
+        where, params = self.combine(clauses)
+        rows = self.conn.execute(
+            f"SELECT rowid FROM {self.TABLE} WHERE {where} " +
+            "ORDER BY rowid", params)
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+
+    def subject_ids(self):
+        """ Return (rowids, Subject Ids) arrays of all rows, in 
+            rowid order.
+        """
+        frame = pd.read_sql_query(
+            f"SELECT rowid, {self.quote('Subject Id')} FROM " +
+            f"{self.TABLE} ORDER BY rowid", self.conn)
+        return frame['rowid'].to_numpy(), frame['Subject Id'].to_numpy()
+
+
+    def compile(self, col, operator, value):
+        """ Translate a SubDB filter into a parameterized SQL
+            clause, with the same results as filtering in pandas
+            (missing values never match a comparison, but are
+            kept by 'does not equal' and 'not in').
+
+            Returns: (sql, params) tuple
+        """
+        if col in self.DERIVED:
+            expr, numeric = self.DERIVED[col], True
+        else:
+            kind = self.kinds[col]
+            expr, numeric = self.quote(col), kind != self.TEXT
+            if kind == self.TEXT_NUMBERS:
+                expr = f"CAST({expr} AS REAL)"
+
+        def _fits(val):
+            """ True if val can equal a value in this column """
+            if numeric:
+                return isinstance(val, (int, float)) \
+                    and not isinstance(val, bool)
+            return isinstance(val, str)
+
+        def _missing(val):
+            return isinstance(val, float) and np.isnan(val)
+
+        def _python(val):
+            return val.item() if isinstance(val, np.generic) else val
+
+        if operator in ["contains", "not in"]:
+            if isinstance(value, str) or not hasattr(value, '__iter__'):
+                raise TypeError("only list-like objects are allowed " +
+                    f"with '{operator}', got {type(value).__name__}")
+            values = [_python(val) for val in value]
+            has_missing = any(_missing(val) for val in values)
+            values = [val for val in values
+                      if _fits(val) and not _missing(val)]
+            marks = ', '.join('?' * len(values))
+            if operator == "contains":
+                parts = []
+                if values:
+                    parts.append(f"{expr} IN ({marks})")
+                if has_missing:
+                    parts.append(f"{expr} IS NULL")
+                if not parts:
+                    return '0', []
+                return ' OR '.join(parts), values
+            if not values:
+                return (f"{expr} IS NOT NULL", []) if has_missing \
+                    else ('1', [])
+            if has_missing:
+                return f"{expr} IS NOT NULL AND {expr} NOT IN ({marks})", \
+                    values
+            return f"{expr} IS NULL OR {expr} NOT IN ({marks})", values
+
+        value = _python(value)
+        if operator == "equals":
+            if _missing(value) or not _fits(value):
+                return '0', []
+            return f"{expr} = ?", [value]
+        if operator == "does not equal":
+            if _missing(value) or not _fits(value):
+                return '1', []
+            return f"{expr} IS NULL OR {expr} != ?", [value]
+        if operator in [">", ">=", "<", "<="]:
+            if _missing(value):
+                return '0', []
+            if not _fits(value):
+                raise TypeError(f"'{operator}' not supported between " +
+                    f"'{col}' and {type(value).__name__}")
+            return f"{expr} {operator} ?", [value]
+
+        # Unknown operator: keep all rows
+        return '1', []
@@ -0,0 +1,300 @@
+""" Column statistics catalog for the Subject Browser.
+
+    Summarizes each column of the base database (missing values,
+    distinct values, most common values and, for numeric columns
+    with many values, an equi-depth histogram) so the number of
+    rows a filter keeps can be estimated without evaluating it.
+    Summaries hold counts, so they are updated in place when an
+    update export is merged, and are saved with the cleaned
+    database cache.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+
+#########
+# BEGIN #
+#########
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and \
+        not isinstance(value, (bool, np.bool_)) and not np.isnan(value)
+
+
+class ColumnStats:
+    """ Summary of one column.
+
+        rows, nulls: number of rows and missing values
+        distinct: number of distinct values (estimated after an
+            update for histogram columns)
+        counts: dict of value: rows for columns with at most
+            MAX_VALUES distinct values (None otherwise)
+        mcv: list of the most common (value, rows), most common
+            first
+        bounds, below: equi-depth histogram of numeric columns
+            without counts: bucket boundaries, and the number of
+            values <= each boundary (None otherwise)
+    """
+    # Most common values kept
+    MCV_SIZE = 10
+
+    # Keep exact value counts for columns with at most this many
+    # distinct values
+    MAX_VALUES = 512
+
+    # Histogram buckets
+    BUCKETS = 64
+
+    # Rebuild a histogram when a bucket holds more than this many
+    # times its share of the values after updates
+    MAX_SKEW = 2
+
+
+    def __init__(self, series):
+        self.numeric = pd.api.types.is_numeric_dtype(series.dtype) and \
+            not pd.api.types.is_bool_dtype(series.dtype)
+        self.rows = series.shape[0]
+        self.nulls = int(series.isna().sum())
+        values = series.value_counts(dropna=True, sort=False)
+        # Categoricals also count unused categories
+        values = values[values > 0]
+        self.distinct = values.shape[0]
+
+        self.counts = None
+        if self.distinct <= self.MAX_VALUES:
+            self.counts = dict(zip(values.index.tolist(),
+                values.to_numpy().tolist()))
+        self.mcv = [(value, int(count)) for value, count in
+            values.nlargest(self.MCV_SIZE).items()]
+
+        self.bounds = None
+        self.below = None
+        if self.numeric and (self.counts is None):
+            self._build_histogram(series)
+
+
+    def _build_histogram(self, series):
+        """ Set equi-depth bucket boundaries from the sorted values.
+        """
+        values = np.sort(series.dropna().to_numpy(dtype=float))
+        picks = np.linspace(0, values.shape[0] - 1,
+            self.BUCKETS + 1).round().astype(int)
+        self.bounds = np.unique(values[picks])
+        self.below = np.searchsorted(values, self.bounds, side='right')
+
+
+    def _non_null(self):
+        return self.rows - self.nulls
+
+
+    ################
+    # Update Stats #
+    ################
+    def update(self, series, removed, added):
+        """ Update the summary after rows were removed and added
+            (series: the whole updated column; removed, added: the
+            rows that left and joined it).
+
+            Returns: False if the summary must be rebuilt from
+            series instead (e.g., the column type changed).
+        """
+        numeric = pd.api.types.is_numeric_dtype(series.dtype) and \
+            not pd.api.types.is_bool_dtype(series.dtype)
+        if numeric != self.numeric:
+            return False
+
+        old_non_null = self._non_null()
+        self.rows += added.shape[0] - removed.shape[0]
+        self.nulls += int(added.isna().sum()) - int(removed.isna().sum())
+
+        if self.counts is not None:
+            # Exact: adjust value counts
+            for part, sign in [(removed, -1), (added, 1)]:
+                part_counts = part.value_counts(dropna=True, sort=False)
+                for value, count in zip(part_counts.index.tolist(),
+                    part_counts.to_numpy().tolist()):
+                    total = self.counts.get(value, 0) + sign * count
+                    if total > 0:
+                        self.counts[value] = total
+                    else:
+                        self.counts.pop(value, None)
+            self.distinct = len(self.counts)
+            if self.distinct > self.MAX_VALUES:
+                return False
+            self.mcv = sorted(self.counts.items(),
+                key=lambda item: -item[1])[:self.MCV_SIZE]
+            return True
+
+        if self.bounds is not None:
+            # Values outside the histogram cannot be placed
+            added_values = added.dropna().to_numpy(dtype=float)
+            if added_values.shape[0] and \
+                ((added_values.min() < self.bounds[0]) or
+                 (added_values.max() > self.bounds[-1])):
+                return False
+            removed_values = np.sort(removed.dropna().to_numpy(dtype=float))
+            self.below = self.below + \
+                np.searchsorted(np.sort(added_values), self.bounds,
+                    side='right') - \
+                np.searchsorted(removed_values, self.bounds, side='right')
+            buckets = np.diff(self.below, prepend=0)
+            if buckets.max() > self.MAX_SKEW * max(1,
+                self._non_null() / self.bounds.shape[0]):
+                return False
+
+        # Most common values and distinct values are estimates: 
+        # adjust the counts of the known most common values, and 
+        # scale distinct values with the number of values
+        mcv = []
+        for value, count in self.mcv:
+            count += int((added == value).sum()) - \
+                int((removed == value).sum())
+            if count > 0:
+                mcv.append((value, count))
+        self.mcv = sorted(mcv, key=lambda item: -item[1])
+        if old_non_null > 0:
+            self.distinct = int(round(self.distinct * 
+                self._non_null() / old_non_null))
+        return True
+
+
+    ###############
+    # Selectivity #
+    ###############
+    def _equal_rows(self, value):
+        """ Return the estimated number of rows equal to value.
+        """
+        if self.counts is not None:
+            return self.counts.get(value, 0)
+        for known, count in self.mcv:
+            if known == value:
+                return count
+        # Spread the other values evenly over the other distinct
+        # values
+        rest = self._non_null() - sum(count for _, count in self.mcv)
+        others = self.distinct - len(self.mcv)
+        if (rest <= 0) or (others <= 0):
+            return 0
+        return rest / others
+
+
+    def _rows_below(self, value, inclusive):
+        """ Return the estimated number of values < value (<= if
+            inclusive; histograms do not tell them apart).
+        """
+        if self.counts is not None:
+            if inclusive:
+                return sum(count for known, count in self.counts.items()
+                    if known <= value)
+            return sum(count for known, count in self.counts.items()
+                if known < value)
+
+        # Interpolate within the bucket holding value
+        bounds, below = self.bounds, self.below
+        if value < bounds[0]:
+            return 0
+        if value >= bounds[-1]:
+            return below[-1]
+        ii = np.searchsorted(bounds, value, side='right') - 1
+        fraction = (value - bounds[ii]) / (bounds[ii + 1] - bounds[ii])
+        return below[ii] + fraction * (below[ii + 1] - below[ii])
+
+
+    def selectivity(self, operator, value):
+        """ Return the estimated fraction of rows kept by a filter
+            on this column, or None if it cannot be estimated.
+        """
+        if self.rows == 0:
+            return None
+
+        if operator in ['contains', 'not in']:
+            if not isinstance(value, (list, tuple, set, np.ndarray)):
+                return None
+            values = set(value)
+            try:
+                matched = sum(self._equal_rows(val) for val in values)
+            except TypeError:
+                return None
+            fraction = min(1.0, matched / self.rows)
+            return fraction if operator == 'contains' else 1 - fraction
+
+        if operator in ['equals', 'does not equal']:
+            if isinstance(value, (list, tuple, set, dict, np.ndarray)):
+                return None
+            try:
+                fraction = min(1.0, self._equal_rows(value) / self.rows)
+            except TypeError:
+                return None
+            return fraction if operator == 'equals' else 1 - fraction
+
+        if operator in ['<', '<=', '>', '>=']:
+            # Ranges need numbers on both sides
+            if not (self.numeric and _is_number(value)):
+                return None
+            if (self.counts is None) and (self.bounds is None):
+                return None
+            if operator in ['<', '<=']:
+                rows = self._rows_below(value, operator == '<=')
+            else:
+                rows = self._non_null() - \
+                    self._rows_below(value, operator == '>')
+            return min(1.0, max(0.0, rows / self.rows))
+
+        return None
+
+
+class StatsCatalog:
+    """ ColumnStats for every column of a dataframe.
+    """
+    def __init__(self, frame):
+        self.rows = frame.shape[0]
+        self.columns = {col: ColumnStats(frame[col])
+            for col in frame.columns}
+
+
+    def refresh(self, frame, columns):
+        """ Rebuild the stats of columns from frame (e.g., Age
+            after the reference date changed).
+        """
+        self.rows = frame.shape[0]
+        for col in columns:
+            self.columns[col] = ColumnStats(frame[col])
+
+
+    def update(self, frame, removed, added):
+        """ Update the catalog for frame (the merged dataframe)
+            after the rows in removed were replaced by the rows in
+            added. Columns whose summaries cannot be updated are
+            rebuilt from frame.
+
+            Returns: list of rebuilt columns.
+        """
+        rebuilt = []
+        for col in frame.columns:
+            stats = self.columns.get(col)
+            if (stats is None) or (col not in removed.columns) or \
+                (col not in added.columns) or \
+                not stats.update(frame[col], removed[col], added[col]):
+                self.columns[col] = ColumnStats(frame[col])
+                rebuilt.append(col)
+        for col in set(self.columns) - set(frame.columns):
+            del self.columns[col]
+        self.rows = frame.shape[0]
+        return rebuilt
+
+
+    def selectivity(self, colname, operator, value):
+        """ Return the estimated fraction of rows kept by a filter,
+            or None if it cannot be estimated (e.g., unknown
+            column or a value of the wrong type).
+        """
+        stats = self.columns.get(colname)
+        if stats is None:
+            return None
+        return stats.selectivity(operator, value)
@@ -0,0 +1,87 @@
+""" Value lists for the Subject Browser filter dropdowns.
+
+    Holds the distinct values of a column in the current data, with
+    the number of records for each value and a prefix index for
+    autocompletion. Lists are cached per column until the data
+    change.
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+from bisect import bisect_left
+
+
+#########
+# BEGIN #
+#########
+class ValueList:
+    """ Sorted distinct values of one column with record counts.
+        Missing values and '-' are left out.
+    """
+    def __init__(self, values):
+        """ values: column (series), or a dict of value: count
+        """
+        if isinstance(values, dict):
+            counts = values
+        else:
+            counts = values.value_counts(dropna=True, sort=False)
+            counts = {val: int(count) for val, count
+                      in zip(counts.index, counts.to_numpy())
+                      if (count > 0) and 
+                      not (isinstance(val, str) and val == '-')}
+
+        try:
+            self.values = sorted(counts)
+        except TypeError:
+            # Mixed types: sort by text
+            self.values = sorted(counts, key=str)
+        self.counts = [counts[val] for val in self.values]
+        self.labels = [f"{val} ({count})"
+                       for val, count in zip(self.values, self.counts)]
+
+        # Prefix index: lower case text of each value, sorted,
+        # with the value's position
+        keys = sorted((str(val).lower(), ii)
+                      for ii, val in enumerate(self.values))
+        self._key_text = [text for text, _ in keys]
+        self._key_pos = [ii for _, ii in keys]
+
+
+    def complete(self, prefix):
+        """ Return the positions of values whose text starts with
+            prefix (ignoring case), in value order. An empty
+            prefix matches all values.
+        """
+        if not prefix:
+            return list(range(len(self.values)))
+        prefix = prefix.lower()
+        start = bisect_left(self._key_text, prefix)
+        stop = bisect_left(self._key_text, prefix + '\U0010ffff')
+        return sorted(self._key_pos[start:stop])
+
+
+class ValueCache:
+    """ ValueLists for the columns of one version of the data,
+        built on first use.
+    """
+    def __init__(self):
+        self.version = None
+        self._lists = {}
+
+
+    def get(self, version, colname, series_func):
+        """ Return the ValueList for colname. series_func returns
+            the column (or a dict of value: count), and is only 
+            called if the list is not cached for this version of 
+            the data.
+        """
+        if version != self.version:
+            self._lists = {}
+            self.version = version
+        if colname not in self._lists:
+            self._lists[colname] = ValueList(series_func())
+        return self._lists[colname]
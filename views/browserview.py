@@ -17,6 +17,8 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 # Import custom modules
 from models.constants import FieldTypes as FT
+from models.indexmodel import AudiogramIndex
+from models import fittingmodel
 
 
 #########
@@ -218,15 +220,17 @@ class BrowserView(ttk.Frame):
         ####################
         # Subject Treeview #
         ####################
-        columns = ('subject_id')
+        columns = ('subject_id', 'distance')
         self.tree = ttk.Treeview(self.frm_main, columns=columns, 
             show='headings')
 
         # Headings
         self.tree.heading('subject_id', text='Subject ID')
+        self.tree.heading('distance', text='')
 
         # Columns
         self.tree.column("subject_id", width=100, anchor=tk.CENTER)
+        self.tree.column("distance", width=80, anchor=tk.CENTER)
 
         # Populate tree with data
         self.load_tree()
@@ -244,6 +248,37 @@ class BrowserView(ttk.Frame):
         self.scrollbar.grid(row=5, rowspan=20, column=1, sticky='ns')
 
 
+        ################
+        # Find Similar #
+        ################
+        frm_similar = ttk.Frame(self.frm_main)
+        frm_similar.grid(row=25, column=0, columnspan=2, pady=(10, 0))
+
+        # Number of matches
+        self.similar_k = tk.IntVar(value=10)
+        ttk.Label(frm_similar, text="Matches:").grid(row=0, column=0, 
+            sticky='e')
+        ttk.Spinbox(frm_similar, from_=1, to=500, width=5, 
+            textvariable=self.similar_k).grid(row=0, column=1, sticky='w')
+
+        # Distance metric
+        self.similar_metric = tk.StringVar(value=AudiogramIndex.METRICS[0])
+        ttk.Label(frm_similar, text="Distance:").grid(row=1, column=0, 
+            sticky='e')
+        ttk.Combobox(frm_similar, width=10, state='readonly',
+            values=AudiogramIndex.METRICS, 
+            textvariable=self.similar_metric).grid(row=1, column=1, 
+            sticky='w')
+
+        # Search/reset buttons
+        ttk.Button(frm_similar, text="Find Similar", 
+            command=lambda: self.event_generate(
+                '<<BrowserviewFindSimilar>>')).grid(row=2, column=0, 
+            pady=(5, 0))
+        ttk.Button(frm_similar, text="Show All", 
+            command=self.load_tree).grid(row=2, column=1, pady=(5, 0))
+
+
         #########################
         # Fitting Range Buttons #
         #########################
@@ -280,9 +315,25 @@ class BrowserView(ttk.Frame):
             self.tree.delete(row)
 
         # Populate new tree records
+        self.tree.heading('distance', text='')
         subjects = self.db.data['Subject Id']
         for subject in subjects:
-            self.tree.insert('', tk.END, values=subject)
+            self.tree.insert('', tk.END, values=(subject, ''))
+
+
+    def load_similar(self, matches, record):
+        """ Replace the tree records with the subjects most 
+            similar to record (a dataframe from SubDB.similar), 
+            closest first.
+        """
+        for row in self.tree.get_children():
+            self.tree.delete(row)
+
+        self.tree.heading('distance', text=f"Distance to {record}")
+        for subject, distance in zip(matches['Subject Id'], 
+            matches['Distance']):
+            self.tree.insert('', tk.END, 
+                values=(subject, f"{distance:.1f}"))
 
 
     def _item_selected(self, *args):
@@ -416,18 +467,14 @@ class BrowserView(ttk.Frame):
         # Plot Fitting Range #
         ######################
         # Get overlay value from radio buttons
-        if self.overlay.get() == 'L':
-            overlay_flag = 1
-            coords = [[0,-10], [9500, -10], [9500, 70], [2000, 70], 
-                      [1000, 60], [0, 60]]
-        elif self.overlay.get() == 'M':
-            overlay_flag = 1
-            coords = [[0,-10], [9500, -10], [9500, 80], [2000, 80], 
-                      [1000, 70], [0, 70]]
-        elif self.overlay.get() == 'P':
+        if self.overlay.get() in fittingmodel.RECEIVER_RANGES:
             overlay_flag = 1
-            coords = [[0,-10], [9500, -10], [9500, 90], [2000, 90], 
-                      [1000, 80], [0, 80]]
+            # Floor, then the upper edge from high to low frequencies
+            edge = fittingmodel.RECEIVER_RANGES[self.overlay.get()]
+            floor = fittingmodel.RANGE_FLOOR
+            coords = [[0, floor], [9500, floor], [9500, edge[-1][1]]] + \
+                [list(point) for point in reversed(edge)] + \
+                [[0, edge[0][1]]]
         if overlay_flag == 1:
             coords.append(coords[0])
             xs, ys = zip(*coords)
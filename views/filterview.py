@@ -11,6 +11,10 @@ from tkinter import messagebox
 
 # Import misc packages
 import uuid
+from functools import partial
+
+# Import custom modules
+from models import exprmodel
 
 
 #########
@@ -19,6 +23,8 @@ import uuid
 class FilterView(ttk.Frame):
     """ Filter view for 'Filter' tab of notebook
     """
+    # Wait this long after the last edit before previewing counts
+    PREVIEW_DELAY_MS = 400
 
     def __init__(self, parent, database, sessionpars, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
@@ -33,12 +39,15 @@ class FilterView(ttk.Frame):
         self.sessionpars['initial_scrub'].trace_add('write', self._save_scrub_state)
 
         # Create list of database columns
-        self.attributes = list(self.db.data.columns)
+        self.attributes = self.db.column_names()
         self.attributes.sort()
 
         # Create list of operators
         self.operators = ["equals", "does not equal", "contains", "not in", 
-                          ">", ">=", "<", "<="]
+                          ">", ">=", "<", "<=", "within"]
+
+        # Pending count preview (after ID)
+        self._preview_id = None
 
         self._draw_widgets()
 
@@ -89,7 +98,7 @@ class FilterView(ttk.Frame):
                 row=0, column=0, sticky='w', padx=5, pady=5)
 
         # Filter box labels
-        label_text = ['Attribute', 'Operator', 'Value']
+        label_text = ['Attribute', 'Operator', 'Value', 'Remaining']
         for idx, label in enumerate(label_text, start=1):
             ttk.Label(frm_filter, text=label).grid(
                 row=5, column=idx, pady=10, sticky='n')
@@ -130,6 +139,11 @@ class FilterView(ttk.Frame):
         # Value combobox
         self.value_vars = []
         self.value_cbs = []
+        # (ValueList, positions) shown in each value combobox
+        self.shown_values = [None] * num_fields
+
+        # Remaining candidates preview labels
+        self.count_vars = []
 
         # Create all comboboxes
         for ii in range(0, num_fields):
@@ -172,13 +186,44 @@ class FilterView(ttk.Frame):
             # Create combobox with above variable
             cb_value = ttk.Combobox(frm_filter, 
                 textvariable=self.value_vars[ii],
-                postcommand=self._get_values, takefocus=0)
+                postcommand=partial(self._get_values, ii), takefocus=0)
+            cb_value.bind('<<ComboboxSelected>>', 
+                partial(self._value_selected, ii))
             # Show combobox
             cb_value.grid(row=6+ii, column=3, pady=(0,10), padx=10,
                 sticky='nsew')
             # Append combobox to list
             self.value_cbs.append(cb_value)
 
+            # Remaining candidates preview label
+            self.count_vars.append(tk.StringVar())
+            ttk.Label(frm_filter, textvariable=self.count_vars[ii],
+                style='rec.TLabel', width=10).grid(row=6+ii, column=4,
+                    pady=(0,10), padx=(0,10), sticky='w')
+
+            # Preview counts as the row is edited
+            for var in [self.attrib_vars[ii], self.op_vars[ii], 
+                self.value_vars[ii]]:
+                var.trace_add('write', self._schedule_preview)
+
+
+        #####################
+        # Filter Expression #
+        #####################
+        # Filters combined with AND, OR, NOT and parentheses, 
+        # applied with the filter rows
+        ttk.Label(frm_filter, text="Expression").grid(row=16, column=1,
+            pady=(0,10), padx=10, sticky='e')
+        self.expression_var = tk.StringVar()
+        ttk.Entry(frm_filter, textvariable=self.expression_var, 
+            takefocus=0).grid(row=16, column=2, columnspan=2, 
+            pady=(0,10), padx=(0,10), sticky='nsew')
+        self.expression_count_var = tk.StringVar()
+        ttk.Label(frm_filter, textvariable=self.expression_count_var,
+            style='rec.TLabel', width=10).grid(row=16, column=4,
+                pady=(0,10), padx=(0,10), sticky='w')
+        self.expression_var.trace_add('write', self._schedule_preview)
+
 
     #####################
     # General Functions #
@@ -188,6 +233,22 @@ class FilterView(ttk.Frame):
             checkbox was toggled.
         """
         self.event_generate('<<FilterviewScrubToggled>>')
+        self._schedule_preview()
+
+
+    def refresh(self):
+        """ Update attribute choices after a new database has 
+            been loaded.
+        """
+        self.attributes = self.db.column_names()
+        self.attributes.sort()
+        for ii in range(0, len(self.attrib_cbs)):
+            self.attrib_cbs[ii]['values'] = self.attributes
+            self.value_cbs[ii]['values'] = []
+            self.shown_values[ii] = None
+
+        # Counts for the old database are out of date
+        self._schedule_preview()
 
 
     def clear_output(self):
@@ -208,6 +269,7 @@ class FilterView(ttk.Frame):
             self.attrib_cbs[ii].set('')
             self.op_cbs[ii].set('')
             self.value_cbs[ii].set('')
+        self.expression_var.set('')
 
         # Set the focus to the upper left combobox
         self.attrib_cbs[0].focus_set()
@@ -216,28 +278,96 @@ class FilterView(ttk.Frame):
     ##############################
     # Filter Selection Functions #
     ##############################
-    def _get_values(self, *_):
-        """ Get values to populate value comboboxes based on the selected 
-            attribute in the attribute comboboxes
+    def _get_values(self, ii):
+        """ Populate a value combobox with the values of the 
+            attribute selected in its row (and their record 
+            counts). If the combobox holds text, only values 
+            starting with that text are shown.
         """
-        # Loop through number of comboboxes set in num_fields above
+        attribute = self.attrib_cbs[ii].get()
+        if attribute not in self.attributes:
+            self.shown_values[ii] = None
+            self.value_cbs[ii]['values'] = []
+            return
+
+        # Cached until the data change
+        value_list = self.db.value_list(attribute)
+        positions = value_list.complete(self.value_cbs[ii].get())
+        if not positions:
+            positions = value_list.complete('')
+        self.shown_values[ii] = (value_list, positions)
+        self.value_cbs[ii]['values'] = [
+            value_list.labels[pos] for pos in positions]
+
+
+    def _value_selected(self, ii, *_):
+        """ Replace the selected 'value (count)' label with the 
+            value.
+        """
+        index = self.value_cbs[ii].current()
+        if (self.shown_values[ii] is None) or (index < 0):
+            return
+        value_list, positions = self.shown_values[ii]
+        self.value_vars[ii].set(str(value_list.values[positions[index]]))
+
+
+    ###########################
+    # Candidate Count Preview #
+    ###########################
+    def _schedule_preview(self, *_):
+        """ Ask the controller for new counts once the user has 
+            stopped editing for PREVIEW_DELAY_MS.
+        """
+        if self._preview_id is not None:
+            self.after_cancel(self._preview_id)
+        self._preview_id = self.after(self.PREVIEW_DELAY_MS, 
+            self._request_preview)
+
+
+    def _request_preview(self):
+        """ Send count preview event to controller.
+        """
+        self._preview_id = None
+        self.event_generate('<<FilterviewPreview>>')
+
+
+    def preview_rows(self):
+        """ Return a dictionary of the complete filter rows, up to 
+            the first incomplete or empty row, plus the expression 
+            (without showing any messages).
+        """
+        filter_dict = {}
         for ii in range(0, len(self.attrib_cbs)):
-            # If the user did not specify any values in a combobox, skip it
-            if len(self.attrib_cbs[ii].get()) != 0:
-                # Drop "NaN" from df and grab unique values as list
-                unique_vals = list(
-                    self.db.data[self.attrib_cbs[ii].get()].dropna().unique()
-                    )
-                # Remove non-data fields
-                if '-' in unique_vals:
-                    unique_vals.remove('-')
+            row = [
+                self.attrib_vars[ii].get(), 
+                self.op_vars[ii].get(), 
+                self.value_vars[ii].get()
+            ]
+            if not all(row):
+                break
+            filter_dict[ii] = row
+        filter_dict.update(self._expression_row())
+        return filter_dict
+
+
+    def _expression_row(self):
+        """ Return {'expression': filter} for the expression, or 
+            an empty dictionary if there is no expression.
+        """
+        text = self.expression_var.get().strip()
+        if not text:
+            return {}
+        return {'expression': [self.db.EXPRESSION, exprmodel.MATCHES, text]}
 
-                # Sort the unique data values
-                unique_vals.sort()
 
-                # Assign the unique values to the Values combobox
-                self.value_cbs[ii]['values'] = unique_vals
-                #print(f"\nfilterview: Added {self.attrib_cbs[ii].get()} to value combobox")
+    def show_counts(self, counts):
+        """ Show remaining candidates next to each filter row. 
+            counts is a dictionary of row index (or 'expression'): 
+            text; other rows are cleared.
+        """
+        for ii in range(0, len(self.count_vars)):
+            self.count_vars[ii].set(counts.get(ii, ''))
+        self.expression_count_var.set(counts.get('expression', ''))
 
 
     ###################################
@@ -301,4 +431,5 @@ class FilterView(ttk.Frame):
                             "with values."
                     )
                     return
+        filter_dict.update(self._expression_row())
         return filter_dict
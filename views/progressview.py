@@ -0,0 +1,91 @@
+""" Database import progress dialog
+"""
+
+###########
+# Imports #
+###########
+# Import GUI packages
+import tkinter as tk
+from tkinter import ttk
+
+
+#########
+# BEGIN #
+#########
+class ProgressDialog(tk.Toplevel):
+    """ Modal dialog showing database import progress, with 
+        a cancel button.
+    """
+    def __init__(self, parent, title, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.parent = parent
+
+        self.withdraw()
+        self.resizable(False, False)
+        self.title(title)
+        self.transient(parent)
+        self.grab_set()
+
+        # Closing the window cancels the import
+        self.protocol('WM_DELETE_WINDOW', self._on_cancel)
+
+
+        ################
+        # Draw Widgets #
+        ################
+        options = {'padx': 10, 'pady': 5}
+
+        # Current stage
+        self.stage_var = tk.StringVar(value="Starting...")
+        ttk.Label(self, textvariable=self.stage_var, width=40).grid(
+            row=5, column=5, **options)
+
+        # Rows parsed
+        self.rows_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.rows_var, width=40).grid(
+            row=10, column=5, **options)
+
+        # Activity bar
+        self.progress = ttk.Progressbar(self, mode='indeterminate', 
+            length=280)
+        self.progress.grid(row=15, column=5, **options)
+        self.progress.start(10)
+
+        # Cancel button
+        self.btn_cancel = ttk.Button(self, text="Cancel", 
+            command=self._on_cancel)
+        self.btn_cancel.grid(row=20, column=5, pady=(5, 10))
+
+        # Center the dialog over the main window
+        self.center_window()
+
+
+    #############
+    # Functions #
+    #############
+    def center_window(self):
+        """ Center the dialog over the parent window
+        """
+        self.update_idletasks()
+        x = self.parent.winfo_rootx() + self.parent.winfo_width()/2 - \
+            self.winfo_width()/2
+        y = self.parent.winfo_rooty() + self.parent.winfo_height()/2 - \
+            self.winfo_height()/2
+        self.geometry("+%d+%d" % (x, y))
+        self.deiconify()
+
+
+    def update_progress(self, stage, rows):
+        """ Show the current stage and number of rows parsed.
+        """
+        self.stage_var.set(stage)
+        if rows:
+            self.rows_var.set(f"Rows parsed: {rows:,}")
+
+
+    def _on_cancel(self):
+        """ Send cancel event to controller.
+        """
+        self.stage_var.set("Cancelling...")
+        self.btn_cancel.config(state='disabled')
+        self.parent.event_generate('<<ProgressCancel>>')